@@ -1,75 +1,116 @@
 #!/usr/bin/env python3
+from __future__ import annotations
 
 import argparse
 import json
 import os
 import io
-import sys
 from collections.abc import Sequence
 from collections import defaultdict
-from urllib.parse import urljoin
 
 from itertools import chain, count
-import shapely.wkt
-import geojson
-import etl
 import errno
 
-import pandas as pd
-import requests
-from requests.auth import HTTPBasicAuth
 from dotenv import load_dotenv
 
-import credentials
-
-log = etl.logging.get_logger(log_name="DHIS2 geo data pull", log_group="dhis2_geo_etl")
+import memoize
+import metrics
+import org_unit_queries
+import output_formats
+import profiling
+from lazy_import import LazyLogger, lazy_module
+
+# heavy dependencies are imported on first use, so `--help` and the CSV path start fast
+etl = lazy_module('etl')
+pd = lazy_module('pandas')
+dhis2_client = lazy_module('dhis2_client')
+artefact_diff = lazy_module('artefact_diff')
+dhis2_schema = lazy_module('dhis2_schema')
+geometry = lazy_module('geometry')
+vector_tiles = lazy_module('vector_tiles')
+
+log = LazyLogger(log_name="DHIS2 geo data pull", log_group="dhis2_geo_etl")
 etl.LOGGER = log
 
 
-@etl.decorators.log_start_and_finalisation("get dhis2 org data")
+@profiling.log_and_profile("get dhis2 org data")
 def get_dhis2_org_data(pickle_path=None):
-    dhis2_url, password, username = __get_dhis2_connection_details()
-    org_resource_url = "organisationUnits.csv?paging=false&includeDescendants=true&includeAncestors=true&withinUserHierarchy=true&fields=id,name,displayName,shortName,path,ancestors,featureType,coordinates,geometry"
-    r = requests.get(urljoin(dhis2_url, org_resource_url), auth=HTTPBasicAuth(username, password))
-    try:
-        etl.requests_util.check_if_response_is_ok(r)
-    except ConnectionError:
-        raise ConnectionError("Failed to get organisation data from DHIS2."
-                              " Make sure the URL is correct and ends with '/api/'.")
-    f = io.StringIO(r.text)
-    df = pd.read_csv(f)
+    df = None
+    if os.environ.get("ORG_UNITS_PUSHDOWN", "true").lower() not in ("false", "0", "no"):
+        try:
+            df = __get_org_units_pushed_down()
+        except ConnectionError:
+            log.warning("Failed to pull the org units piece by piece, pulling all of them at once")
+    if df is None:
+        try:
+            r = __get_dhis2_client().get(org_unit_queries.FULL_RESOURCE)
+        except ConnectionError:
+            raise ConnectionError("Failed to get organisation data from DHIS2."
+                                  " Make sure the URL is correct and ends with '/api/'.")
+        df = __read_org_units_csv(r.text)
+    df = dhis2_schema.compact_org_units(df)
     if pickle_path:
         df.to_pickle(pickle_path)
     return df
 
 
-def __get_dhis2_connection_details():
-    dhis2_url = os.environ.get("DHIS2_URL")
-    credentials.read_credentials(os.environ.get("DHIS2_CREDENTIALS_FILE"))
-    username = os.environ.get("DHIS2_USERNAME")
-    password = os.environ.get("DHIS2_PASSWORD")
-    return dhis2_url, password, username
-
-
-@etl.decorators.log_start_and_finalisation("get dhis2 org data from local pickle file")
+def __get_org_units_pushed_down():
+    """Org units of the subtree only, with polygons pulled for areas and points for facilities.
+
+    The subtree root and the area levels are pushed into the DHIS2 queries, so org units and geometries
+    later dropped by `extract_location_subtree` and the facility rows are not downloaded. Returns None
+    if the root can't be told apart by name, the full download then leaves it to `extract_location_subtree`.
+    """
+    client = __get_dhis2_client()
+    root = None
+    if SUBTREE_ORG_NAME:
+        candidates = json.loads(client.get(org_unit_queries.root_resource(SUBTREE_ORG_NAME)).text)
+        root = org_unit_queries.choose_root(candidates.get('organisationUnits', []))
+        if root is None:
+            return None
+    resources = org_unit_queries.get_resources(AREAS_ADMIN_LEVEL, root)
+    r_areas, r_facilities = dhis2_client.get_many([resources['areas'], resources['facilities']], client=client,
+                                                  task='org units')
+    areas, facilities = __read_org_units_csv(r_areas.text), __read_org_units_csv(r_facilities.text)
+    facility_points = None
+    if not facilities.empty:
+        r_points = client.get(org_unit_queries.get_facility_points_resource(facilities, AREAS_ADMIN_LEVEL, root))
+        facility_points = __read_org_units_csv(r_points.text)
+    log.info(f"Pulled {len(areas)} areas and {len(facilities)} facilities"
+             f"{f' of subtree {SUBTREE_ORG_NAME}' if SUBTREE_ORG_NAME else ''}")
+    return org_unit_queries.merge(areas, facilities, facility_points)
+
+
+def __read_org_units_csv(text):
+    if not text.strip():
+        return pd.DataFrame(columns=['id'])
+    return pd.read_csv(io.StringIO(text))
+
+
+def __get_dhis2_client():
+    return dhis2_client.get_client(cache_dir=os.path.join(OUTPUT_DIR_NAME, 'build', 'http_cache'))
+
+
+@profiling.log_and_profile("get dhis2 org data from local pickle file")
 def get_dhis2_org_data_from_pickle(pickle_path):
-    return pd.read_pickle(pickle_path)
+    return dhis2_schema.compact_org_units(pd.read_pickle(pickle_path))
 
 
-@etl.decorators.log_start_and_finalisation("get dhis2 org data from local csv file")
+@profiling.log_and_profile("get dhis2 org data from local csv file")
 def get_dhis2_org_data_from_csv(csv_path, pickle_path=None):
-    df = pd.read_csv(csv_path, dtype=str)
+    df = dhis2_schema.compact_org_units(pd.read_csv(csv_path, dtype=str))
     if pickle_path:
         df.to_pickle(pickle_path)
     return df
 
 
+@profiling.log_and_profile("extract geo data")
 def extract_geo_data(df):
     if 'featureType' in list(df):
         cords = df[df['featureType'] == 'POINT']['coordinates'].str.strip('[]').str.split(',', expand=True)
         if not cords.empty:
             cords = cords.astype(float, errors='ignore')
-            cords, df = _drop_faulty_facilities(cords, df)
+            cords, df = _mark_faulty_facilities(cords, df)
             cords.columns = ['long', 'lat']
             df = pd.concat([df, cords], axis=1, sort=False)
         else:
@@ -93,6 +134,9 @@ def extract_geo_data(df):
         df['geoshape'] = df.apply(__flatten, axis=1)
     elif 'geometry' in list(df):
         # deal with WKT geometry
+        import geojson
+        import shapely.wkt
+
         def __extract_geoshape(row):
             if not pd.isnull(row['geometry']):
                 geometry_str = row['geometry']
@@ -101,8 +145,9 @@ def extract_geo_data(df):
                 __geojson = geojson.Feature(geometry=shape, properties={})
                 geometry = __geojson.geometry
                 if geometry.type == 'Point':
-                    row['lat'] = str(geometry.coordinates[0])
-                    row['long'] = str(geometry.coordinates[1])
+                    # WKT points are (longitude latitude)
+                    row['long'] = str(geometry.coordinates[0])
+                    row['lat'] = str(geometry.coordinates[1])
                 row['geojson'] = str(__geojson)
             return row
         df['geojson'] = ''
@@ -116,20 +161,32 @@ def extract_geo_data(df):
     return df
 
 
-def _drop_faulty_facilities(cords, df):
+def _mark_faulty_facilities(cords, df):
+    # facilities are only dropped by `drop_faulty_facilities`, after the memoized stage, so
+    # dropped_facilities.csv is written on every run
     cords_isna = cords.isna()
     faulty_cords = cords_isna[cords_isna[0] | cords_isna[1]]
-    if not os.path.exists(os.path.join(OUTPUT_DIR_NAME, 'geodata_errors')):
-        os.makedirs(os.path.join(OUTPUT_DIR_NAME, 'geodata_errors'))
-    df.loc[faulty_cords.index].to_csv(f"{OUTPUT_DIR_NAME}/geodata_errors/dropped_facilities.csv", index=False)
     cords = cords.drop(faulty_cords.index)
     if len(list(cords)) > 2:
         cords = cords.drop([2, 3], axis=1)
-    df = df.drop(faulty_cords.index)
+    df.insert(df.columns.get_loc('coordinates') + 1, 'dropped_coordinates',
+              df['coordinates'].where(df.index.isin(faulty_cords.index)))
     return cords, df
 
 
-@etl.decorators.log_start_and_finalisation("convert cords to int")
+@profiling.log_and_profile("drop faulty facilities")
+def drop_faulty_facilities(df: pd.DataFrame) -> pd.DataFrame:
+    """Drop the facilities with unparsable point coordinates, listing them in `dropped_facilities.csv`."""
+    if 'dropped_coordinates' not in df:
+        return df
+    faulty = df['dropped_coordinates'].notna()
+    dropped = df[faulty].drop(columns=['geoshape', 'lat', 'long']).rename(columns={'dropped_coordinates': 'coordinates'})
+    os.makedirs(os.path.join(OUTPUT_DIR_NAME, 'geodata_errors'), exist_ok=True)
+    dropped.to_csv(f"{OUTPUT_DIR_NAME}/geodata_errors/dropped_facilities.csv", index=False)
+    return df[~faulty].drop(columns='dropped_coordinates')
+
+
+@profiling.log_and_profile("convert cords to int")
 def convert_cords_str_to_int(df: pd.DataFrame) -> pd.DataFrame:
     for cord in ['lat', 'long']:
         if df[cord].dtype != pd.np.float64:
@@ -174,7 +231,7 @@ def __flatten(row):
     return cords
 
 
-@etl.decorators.log_start_and_finalisation("extract admin level")
+@profiling.log_and_profile("extract admin level")
 def extract_admin_level(df: pd.DataFrame) -> pd.DataFrame:
     paths: pd.Series = df['path'].str.lstrip('/').str.split('/')
     admin_level = paths.apply(len) - 1
@@ -182,7 +239,7 @@ def extract_admin_level(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-@etl.decorators.log_start_and_finalisation("extract parent")
+@profiling.log_and_profile("extract parent")
 def extract_parent(df: pd.DataFrame) -> pd.DataFrame:
     paths: pd.Series = df['path'].str.lstrip('/').str.split('/')
 
@@ -203,7 +260,7 @@ def extract_parent(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-@etl.decorators.log_start_and_finalisation("save locations in wide format")
+@profiling.log_and_profile("save locations in wide format")
 def save_locations_in_wide_format(df: pd.DataFrame) -> pd.DataFrame:
     ancestors = df['path'].str.lstrip('/').str.split('/', expand=True)
     ancestor_col_names = [f"admin_{i}" for i in list(ancestors)]
@@ -226,79 +283,218 @@ def __get_name(dhis2_id, ids_map):
         return
 
 
-@etl.decorators.log_start_and_finalisation("create index column")
+@profiling.log_and_profile("create index column")
 def create_index_column(df: pd.DataFrame) -> pd.DataFrame:
+    """Give every org unit an `<ISO_CODE>_<admin level>_<n>` area id, numbered per level in row order.
+
+    Ids are kept in a dhis2_id to area_id registry, `AREA_ID_REGISTRY` (default `area_id_registry.csv` in
+    the output directory). Org units in the registry keep their id as long as their level doesn't change,
+    new ones are numbered after the highest id of their level ever registered, so ids are never reused.
+    Without a registry, it starts from the ids of the previous run's `geodata/dhis2_id_mapping.csv`.
+    """
     df['dhis2_id'] = df['id']
-    counters = defaultdict(int)
+    registry_path = __get_area_id_registry_path()
+    previous_mapping_path = os.path.join(OUTPUT_DIR_NAME, 'geodata', 'dhis2_id_mapping.csv')
+    if os.path.exists(registry_path):
+        registry = pd.read_csv(registry_path, dtype=str, keep_default_na=False)
+    elif os.path.exists(previous_mapping_path):
+        registry = (pd.read_csv(previous_mapping_path, dtype=str, keep_default_na=False)
+                    .rename(columns={'map_id': 'dhis2_id', 'map_level': 'area_level'})
+                    [['dhis2_id', 'area_id', 'area_level']])
+        log.info(f"Starting the area id registry {registry_path} from the ids of {previous_mapping_path}")
+    else:
+        registry = pd.DataFrame(columns=['dhis2_id', 'area_id', 'area_level'], dtype=str)
+    registered = registry.drop_duplicates('dhis2_id', keep='last').set_index('dhis2_id')
+    levels = df['admin_level'].astype(str)
+    ids = df['dhis2_id'].map(registered['area_id'])
+    new = ids.isna() | (df['dhis2_id'].map(registered['area_level']) != levels)
+
+    # ids of a level are numbered 1, 2, ... and never removed from the registry, so the highest number
+    # of a level is its count of registered ids, unless the registry was edited by hand
+    last_numbers = registry.groupby('area_level').size()
+    new_ids = __number_area_ids(levels[new], last_numbers)
+    if new_ids.isin(registry['area_id']).any():
+        registered_numbers = pd.to_numeric(registry['area_id'].str.extract(r'_(\d+)$')[0], errors='coerce')
+        new_ids = __number_area_ids(levels[new], registered_numbers.groupby(registry['area_level']).max())
+    ids[new] = new_ids
+    df['id'] = ids
+
+    if new.any():
+        added = pd.DataFrame({'dhis2_id': df.loc[new, 'dhis2_id'], 'area_id': ids[new], 'area_level': levels[new]})
+        registry = pd.concat([registry, added]) if len(registry) else added
+    if new.any() or not os.path.exists(registry_path):
+        memoize.write_if_changed(registry_path, registry.to_csv(index=False), newline='')
+    return df
 
-    def create_index(admin_level):
-        counters[admin_level] += 1
-        return f"{ISO_CODE}_{admin_level}_{counters[admin_level]}"
 
-    df['id'] = df['admin_level'].apply(create_index)
-    return df
+def __number_area_ids(levels, last_numbers):
+    numbers = levels.groupby(levels, sort=False).cumcount() + 1 + levels.map(last_numbers).fillna(0).astype(int)
+    return ISO_CODE + '_' + levels + '_' + numbers.astype(str)
 
 
-@etl.decorators.log_start_and_finalisation("sort by admin level")
+def __get_area_id_registry_path():
+    return os.environ.get('AREA_ID_REGISTRY') or os.path.join(OUTPUT_DIR_NAME, 'area_id_registry.csv')
+
+
+@profiling.log_and_profile("sort by admin level")
 def sort_by_admin_level(df: pd.DataFrame) -> pd.DataFrame:
     return df.sort_values(by='admin_level').reset_index()
 
 
-@etl.decorators.log_start_and_finalisation("save location hierarchy")
+@profiling.log_and_profile("validate area geometries")
+def validate_area_geometries(df: pd.DataFrame) -> pd.DataFrame:
+    """Report invalid area geometries, and overlaps and gaps between sibling areas.
+
+    Issues are written to `geodata_errors/areas_geometry_issues.csv`. With `REPAIR_AREA_GEOMETRIES=true`
+    the geometries are replaced by valid ones with closed, counterclockwise exterior rings.
+    """
+    areas = df[df['admin_level'] <= AREAS_ADMIN_LEVEL]
+    geometries = areas.apply(__get_geometry, axis=1) if len(areas) else pd.Series(dtype=object)
+    records = [(area_id, parent_id, geometry_) for area_id, parent_id, geometry_
+               in zip(areas['id'], areas['parent_id'], geometries) if geometry_]
+    repair = os.environ.get('REPAIR_AREA_GEOMETRIES', 'false').lower() in ('true', '1', 'yes')
+    workers = int(os.environ['GEOMETRY_WORKERS']) if os.environ.get('GEOMETRY_WORKERS') else None
+    tolerance = float(os.environ.get('GEOMETRY_SLIVER_TOLERANCE', geometry.DEFAULT_SLIVER_TOLERANCE))
+    issues, repaired = geometry.validate_areas(records, repair=repair, workers=workers, tolerance=tolerance)
+
+    names = areas.set_index('id')[['dhis2_id', 'name', 'admin_level']]
+    issues = issues.join(names, on='area_id')[['area_id', 'dhis2_id', 'name', 'admin_level', 'issue', 'detail',
+                                                'other_area_id', 'size']]
+    if not os.path.exists(os.path.join(OUTPUT_DIR_NAME, 'geodata_errors')):
+        os.makedirs(os.path.join(OUTPUT_DIR_NAME, 'geodata_errors'))
+    issues.to_csv(f"{OUTPUT_DIR_NAME}/geodata_errors/areas_geometry_issues.csv", index=False)
+    if len(issues):
+        counts = ', '.join(f"{count} {issue}" for issue, count in issues['issue'].value_counts().items())
+        log.warning(f"Area geometry issues: {counts}, see geodata_errors/areas_geometry_issues.csv")
+    if repair:
+        if 'geoshape' in df:
+            # repairs may turn polygons into multi polygons, a feature type new to the categorical
+            df['featureType'] = dhis2_schema.add_categories(df['featureType'], ['POLYGON', 'MULTI_POLYGON'])
+        for i, area_id in areas['id'].items():
+            if area_id in repaired:
+                __set_geometry(df, i, repaired[area_id])
+        log.info(f"Repaired geometries of {len(repaired)} areas")
+    return df
+
+
+def __get_geometry(area: pd.Series):
+    if 'geoshape' in area.index:
+        if not isinstance(area['geoshape'], list) or not len(area['geoshape']):
+            return None
+        return __prepare_geometry(area)
+    if 'geojson' in area.index and isinstance(area['geojson'], str) and area['geojson']:
+        try:
+            geometry_ = json.loads(area['geojson']).get('geometry')
+        except json.decoder.JSONDecodeError:
+            return None
+        if geometry_ and geometry_.get('type') in ('Polygon', 'MultiPolygon'):
+            return geometry_
+    return None
+
+
+def __set_geometry(df, i, geometry_):
+    if 'geoshape' in df:
+        df.at[i, 'geoshape'] = geometry_['coordinates']
+        df.at[i, 'featureType'] = 'MULTI_POLYGON' if geometry_['type'] == 'MultiPolygon' else 'POLYGON'
+    else:
+        feature = json.loads(df.at[i, 'geojson'])
+        feature['geometry'] = geometry_
+        df.at[i, 'geojson'] = json.dumps(feature)
+
+
+@profiling.log_and_profile("check facility parents")
+def check_facility_parents(df: pd.DataFrame) -> pd.DataFrame:
+    """Check that every facility lies within the polygon of its parent area.
+
+    Facilities outside of their parent are reported in `geodata_errors/facility_parent_mismatches.csv`
+    together with the area at the parent's level that contains them. With `REASSIGN_FACILITY_PARENTS=true`
+    they are moved to that area.
+    """
+    areas = df[df['admin_level'] <= AREAS_ADMIN_LEVEL]
+    shapes = geometry.area_shapes(areas)
+    if shapes.empty:
+        log.info("No area geometries, skipping the facility parents check")
+        return df
+    facilities = df[df['admin_level'] > AREAS_ADMIN_LEVEL]
+    lat = pd.to_numeric(facilities['lat'], errors='coerce')
+    long = pd.to_numeric(facilities['long'], errors='coerce')
+    facilities = facilities[lat.notna() & long.notna() & facilities['parent_id'].isin(shapes['id'])]
+    parent_levels = facilities['parent_id'].map(areas.set_index('id')['admin_level'])
+    containing = geometry.containing_areas(shapes, long[facilities.index], lat[facilities.index], parent_levels,
+                                           preferred=facilities['parent_id'].to_numpy(dtype=object))
+    mismatched = facilities['parent_id'].to_numpy(dtype=object) != containing
+    mismatches = facilities.loc[mismatched, ['id', 'name', 'dhis2_id', 'lat', 'long', 'parent_id']]
+    mismatches.columns = ['facility_id', 'facility_name', 'dhis2_id', 'lat', 'long', 'parent_area_id']
+    mismatches['containing_area_id'] = containing[mismatched]
+    if not os.path.exists(os.path.join(OUTPUT_DIR_NAME, 'geodata_errors')):
+        os.makedirs(os.path.join(OUTPUT_DIR_NAME, 'geodata_errors'))
+    mismatches.to_csv(f"{OUTPUT_DIR_NAME}/geodata_errors/facility_parent_mismatches.csv", index=False)
+    if len(mismatches):
+        log.warning(f"{len(mismatches)} of {len(facilities)} facilities are outside of their parent area, "
+                    f"see geodata_errors/facility_parent_mismatches.csv")
+    if os.environ.get('REASSIGN_FACILITY_PARENTS', 'false').lower() in ('true', '1', 'yes'):
+        reassigned = mismatches[mismatches['containing_area_id'] != '']
+        df.loc[reassigned.index, 'parent_id'] = reassigned['containing_area_id']
+        log.info(f"Reassigned {len(reassigned)} facilities to the area containing them")
+    return df
+
+
+@profiling.log_and_profile("save location hierarchy")
 def save_location_hierarchy(df: pd.DataFrame) -> pd.DataFrame:
     lh_df = df[df['admin_level'] <= AREAS_ADMIN_LEVEL][['id', 'name', 'admin_level', 'parent_id', 'area_sort_order']]
     lh_df.columns = ['area_id', 'area_name', 'area_level', 'parent_area_id', 'area_sort_order']
     if not os.path.exists(os.path.join(OUTPUT_DIR_NAME, 'geodata')):
         os.makedirs(os.path.join(OUTPUT_DIR_NAME, 'geodata'))
-    lh_df.to_csv(f"{OUTPUT_DIR_NAME}/geodata/location_hierarchy.csv", index=False)
+    output_formats.write_table(lh_df, f"{OUTPUT_DIR_NAME}/geodata/location_hierarchy.csv", 'location_hierarchy')
+    artefact_diff.diff_table(OUTPUT_DIR_NAME, 'geodata/location_hierarchy', lh_df, ['area_id'])
     return df
 
 
-@etl.decorators.log_start_and_finalisation("save facilities list")
+@profiling.log_and_profile("save facilities list")
 def save_facilities_list(df: pd.DataFrame) -> pd.DataFrame:
     fl_df = df[df['admin_level'] > AREAS_ADMIN_LEVEL].reindex(columns=['id', 'name', 'parent_id', 'lat', 'long', 'type', 'area_sort_order'])
     fl_df['type'] = 'health facility'
     fl_df.columns = ['facility_id', 'facility_name', 'parent_area_id', 'lat', 'long', 'type', 'area_sort_order']
     if not os.path.exists(os.path.join(OUTPUT_DIR_NAME, 'geodata')):
         os.makedirs(os.path.join(OUTPUT_DIR_NAME, 'geodata'))
-    fl_df.to_csv(f"{OUTPUT_DIR_NAME}/geodata/facility_list.csv", index=False)
+    output_formats.write_table(fl_df, f"{OUTPUT_DIR_NAME}/geodata/facility_list.csv", 'facility_list')
+    artefact_diff.diff_table(OUTPUT_DIR_NAME, 'geodata/facility_list', fl_df, ['facility_id'])
     return df
 
 
-@etl.decorators.log_start_and_finalisation("save dhis2 ids")
+@profiling.log_and_profile("save dhis2 ids")
 def save_dhis2_ids(df: pd.DataFrame) -> pd.DataFrame:
     dhis2_ids = df[['id', 'admin_level', 'name', 'dhis2_id']]
     dhis2_ids = dhis2_ids.assign(map_source="DHIS2")
     dhis2_ids.columns = ["area_id", "map_level", "map_name", "map_id", "map_source"]
     if not os.path.exists(os.path.join(OUTPUT_DIR_NAME, 'geodata')):
         os.makedirs(os.path.join(OUTPUT_DIR_NAME, 'geodata'))
-    dhis2_ids.to_csv(f"{OUTPUT_DIR_NAME}/geodata/dhis2_id_mapping.csv", index=False)
+    output_formats.write_table(dhis2_ids, f"{OUTPUT_DIR_NAME}/geodata/dhis2_id_mapping.csv", 'dhis2_id_mapping')
+    artefact_diff.diff_table(OUTPUT_DIR_NAME, 'geodata/dhis2_id_mapping', dhis2_ids, ['map_id'])
     return df
 
 
-@etl.decorators.log_start_and_finalisation("save ids mapping")
+@profiling.log_and_profile("save ids mapping")
 def save_ids_mapping(df: pd.DataFrame) -> pd.DataFrame:
     fl_df = df.reindex(columns=['id', 'dhis2_id'])
     fl_df['pepfar_id'] = ''
     fl_df.columns = ["area_id", "dhis2_id", "pepfar_id"]
     if not os.path.exists(OUTPUT_DIR_NAME):
         os.makedirs(OUTPUT_DIR_NAME)
-    fl_df.to_csv(f"{OUTPUT_DIR_NAME}/ids_mapping.csv", index=False)
+    output_formats.write_table(fl_df, f"{OUTPUT_DIR_NAME}/ids_mapping.csv", 'ids_mapping')
     return df
 
 
-@etl.decorators.log_start_and_finalisation("save area geometries")
+@profiling.log_and_profile("save area geometries")
 def save_area_geometries(df: pd.DataFrame) -> pd.DataFrame:
     incorrect_geojson_areas = defaultdict(list)
     features = []
     is_geojson = 'geojson' in list(df)
     is_geoshape = 'geoshape' in list(df)
     if not is_geojson and not is_geoshape:
-        dhis2_url, password, username = __get_dhis2_connection_details()
         levels = '&'.join([f'level={x}' for x in range(1, AREAS_ADMIN_LEVEL + 1)])
         geojson_r_url = f"organisationUnits.geojson?{levels}"
-        r = requests.get(urljoin(dhis2_url, geojson_r_url), auth=HTTPBasicAuth(username, password))
-        etl.requests_util.check_if_response_is_ok(r)
+        r = __get_dhis2_client().get(geojson_r_url)
         dhis2_geojson = json.loads(r.text)
         for feature in dhis2_geojson['features']:
             _dhis2_id = feature['id']
@@ -350,13 +546,22 @@ def save_area_geometries(df: pd.DataFrame) -> pd.DataFrame:
 
     if not os.path.exists(os.path.join(OUTPUT_DIR_NAME, 'geodata')):
         os.makedirs(os.path.join(OUTPUT_DIR_NAME, 'geodata'))
-    with open(f'{OUTPUT_DIR_NAME}/geodata/areas.json', 'w') as f:
-        f.write(json.dumps(area_geojson))
+    memoize.write_if_changed(f'{OUTPUT_DIR_NAME}/geodata/areas.json', json.dumps(area_geojson))
+    artefact_diff.diff_features(OUTPUT_DIR_NAME, 'geodata/areas', features)
+    if 'parquet' in output_formats.get_formats():
+        output_formats.write_geoparquet(features, f'{OUTPUT_DIR_NAME}/geodata/areas.parquet')
+    if os.environ.get('VECTOR_TILES', 'false').lower() in ('true', '1', 'yes'):
+        tiles_count = vector_tiles.write_mbtiles(
+            features, f'{OUTPUT_DIR_NAME}/geodata/areas.mbtiles',
+            min_zoom=int(os.environ.get('VECTOR_TILES_MIN_ZOOM', vector_tiles.DEFAULT_MIN_ZOOM)),
+            max_zoom=int(os.environ.get('VECTOR_TILES_MAX_ZOOM', vector_tiles.DEFAULT_MAX_ZOOM)),
+            name=ISO_CODE)
+        log.info(f"Saved {tiles_count} vector tiles to geodata/areas.mbtiles")
 
     if not os.path.exists(os.path.join(OUTPUT_DIR_NAME, 'geodata_errors')):
         os.makedirs(os.path.join(OUTPUT_DIR_NAME, 'geodata_errors'))
-    with open(f'{OUTPUT_DIR_NAME}/geodata_errors/areas_geoshapes_errors.json', 'w') as f:
-        f.write(json.dumps(incorrect_geojson_areas, indent=2))
+    memoize.write_if_changed(f'{OUTPUT_DIR_NAME}/geodata_errors/areas_geoshapes_errors.json',
+                             json.dumps(incorrect_geojson_areas, indent=2))
     with open(f'{OUTPUT_DIR_NAME}/geodata_errors/areas_geoshapes_errors.txt', 'w') as f:
         w_ = [9, 13, 13, 45]
         separation_line_ = f"|{'':-^{w_[0]}}+{'':-^{w_[1]}}+{'':-^{w_[2]}}+{'':-^{w_[3]}}|\n"
@@ -437,7 +642,7 @@ def __get_init_df():
         return get_dhis2_org_data(geodata_pickle)
 
 
-@etl.decorators.log_start_and_finalisation("extract location subtree")
+@profiling.log_and_profile("extract location subtree")
 def extract_location_subtree(df: pd.DataFrame) -> pd.DataFrame:
     if not SUBTREE_ORG_NAME:
         return df
@@ -455,7 +660,7 @@ def extract_location_subtree(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-@etl.decorators.log_start_and_finalisation("validate admin level")
+@profiling.log_and_profile("validate admin level")
 def validate_admin_level(df: pd.DataFrame) -> pd.DataFrame:
     df['is_leaf'] = ''
     for i, row in df.iterrows():
@@ -469,17 +674,38 @@ def run_pipeline():
     run_steps(df_)
 
 
+@memoize.stage(config=lambda: {
+    'subtree_org_name': SUBTREE_ORG_NAME,
+    'areas_admin_level': AREAS_ADMIN_LEVEL,
+    'flip_coords': os.environ.get("FLIP_COORDS")
+})
+def transform_org_units(df_):
+    return (df_
+            .pipe(extract_location_subtree)
+            .pipe(extract_admin_level)
+            .pipe(extract_geo_data)
+            .pipe(convert_cords_str_to_int)
+            )
+
+
+def assign_area_ids(df_):
+    # not memoized: these steps write error files and keep the area id registry up to date on every run
+    return (df_
+            .pipe(drop_faulty_facilities)
+            .pipe(sort_by_admin_level)
+            .pipe(create_index_column)
+            .pipe(extract_parent)
+            # .pipe(validate_admin_level)
+            .pipe(etl.add_empty_column('area_sort_order'))
+            )
+
+
 def run_steps(df_):
     (df_
-     .pipe(extract_location_subtree)
-     .pipe(extract_admin_level)
-     .pipe(extract_geo_data)
-     .pipe(convert_cords_str_to_int)
-     .pipe(sort_by_admin_level)
-     .pipe(create_index_column)
-     .pipe(extract_parent)
-     # .pipe(validate_admin_level)
-     .pipe(etl.add_empty_column('area_sort_order'))
+     .pipe(transform_org_units)
+     .pipe(assign_area_ids)
+     .pipe(validate_area_geometries)
+     .pipe(check_facility_parents)
      # .pipe(save_locations_in_wide_format)
      .pipe(save_location_hierarchy)
      .pipe(save_facilities_list)
@@ -488,9 +714,9 @@ def run_steps(df_):
      )
 
 
-if __name__ == '__main__':
+def main(argv=None):
+    global args, OUTPUT_DIR_NAME, SUBTREE_ORG_NAME, AREAS_ADMIN_LEVEL, ISO_CODE, SUBTREE_ORG_CONFIGS
     parser = argparse.ArgumentParser(description='Pull geo data from a DHIS2 to be uploaded into ADR.')
-    argv = sys.argv[1:]
     parser.add_argument('-e', '--env-file',
                         default='.env',
                         help='env file to read config from')
@@ -501,23 +727,43 @@ if __name__ == '__main__':
     parser.add_argument('-c', '--csv-file',
                         dest='csv',
                         help='Fetch data from a CSV file')
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if not os.path.exists(args.env_file):
         raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), args.env_file)
     load_dotenv(args.env_file)
+    etl.LOGGER = log
+    if not args.csv:
+        args.csv = os.environ.get("GEODATA_CSV_FILE")
     SUBTREE_ORG_CONFIGS = json.loads(os.environ.get("SUBTREE_ORG_CONFIGS", "{}"))
+    # fail on a misconfigured OUTPUT_FORMATS before pulling anything
+    output_formats.get_formats()
+    metrics.start('geodata', name=os.environ.get('OUTPUT_DIR_NAME', 'default'))
 
     if SUBTREE_ORG_CONFIGS:
+        subtrees = metrics.progress('geodata subtrees', len(SUBTREE_ORG_CONFIGS), 'subtrees')
         for subtree_config in SUBTREE_ORG_CONFIGS:
             OUTPUT_DIR_NAME = f"output/{os.environ.get('OUTPUT_DIR_NAME', 'default')}/{subtree_config['name']}"
+            memoize.cache_dir = os.path.join(OUTPUT_DIR_NAME, 'build', 'memo')
             SUBTREE_ORG_NAME = subtree_config['name']
             AREAS_ADMIN_LEVEL = int(subtree_config['areas_admin_level'])
             ISO_CODE = subtree_config['iso_code']
             run_pipeline()
+            dhis2_client.log_stats(log)
+            profiling.write_run_report(OUTPUT_DIR_NAME, etl='geodata', env_file=args.env_file, name=SUBTREE_ORG_NAME)
+            subtrees.advance()
     else:
         OUTPUT_DIR_NAME = f"output/{os.environ.get('OUTPUT_DIR_NAME', 'default')}"
+        memoize.cache_dir = os.path.join(OUTPUT_DIR_NAME, 'build', 'memo')
         SUBTREE_ORG_NAME = os.environ.get("SUBTREE_ORG_NAME", False)
         AREAS_ADMIN_LEVEL = int(os.environ.get("AREAS_ADMIN_LEVEL", 2))
         ISO_CODE = os.environ.get("ISO_CODE", os.environ.get('OUTPUT_DIR_NAME', 'XXX'))
         run_pipeline()
+        dhis2_client.log_stats(log)
+        profiling.write_run_report(OUTPUT_DIR_NAME, etl='geodata', env_file=args.env_file,
+                                   name=os.environ.get('OUTPUT_DIR_NAME'))
+    metrics.stop()
+
+
+if __name__ == '__main__':
+    main()
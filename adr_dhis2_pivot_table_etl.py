@@ -1,23 +1,47 @@
 #!/usr/bin/env python3
+from __future__ import annotations
 
 import argparse
+import asyncio
 import json
 import os
-import sys
+import shutil
 
-import etl
-import pandas as pd
-import requests
 from dotenv import load_dotenv
-from requests.auth import HTTPBasicAuth
-from urllib.parse import urljoin
 
-import credentials
+import memoize
+import metrics
+import output_formats
+import profiling
+from lazy_import import LazyLogger, lazy_module
 
-etl.LOGGER = etl.logging.get_logger(log_name="DHIS2 pivot table pull", log_group="etl")
+# heavy dependencies are imported on first use, so `--help` starts fast
+etl = lazy_module('etl')
+pd = lazy_module('pandas')
+artefact_diff = lazy_module('artefact_diff')
+data_value_sets = lazy_module('data_value_sets')
+dhis2_client = lazy_module('dhis2_client')
+dhis2_periods = lazy_module('dhis2_periods')
+dhis2_schema = lazy_module('dhis2_schema')
+program_config = lazy_module('program_config')
+join_area_ids_to_data = lazy_module('utils.join_area_ids_to_data')
 
+# a data value is identified by data element, category option combo, org unit and period
+INCREMENTAL_STORE_KEY = ['dataElement', 'categoryOptionCombo', 'orgUnit', 'period']
 
-@etl.decorators.log_start_and_finalisation("getting DHIS2 metadata")
+# org unit paths used by the dataValueSets engine, loaded on first use
+org_unit_paths = None
+
+# period types of the outputs, the pipeline rolls the pulled periods up to `PERIOD_TYPE`
+PERIOD_TYPES = ('Yearly',)
+PERIOD_TYPE = 'Yearly'
+PULL_PERIOD_TYPE = None
+
+log = LazyLogger(log_name="DHIS2 pivot table pull", log_group="etl")
+etl.LOGGER = log
+
+
+@profiling.log_and_profile("getting DHIS2 metadata")
 def get_metadata(from_pickle=False):
     global category_combos
     global data_elements
@@ -36,9 +60,8 @@ def get_metadata(from_pickle=False):
     cc_resource = "categoryOptionCombos?paging=false&fields=id,name"
     de_resource = "dataElements?paging=false&fields=id,name"
     ou_resource = "organisationUnits?paging=false&fields=id,name"
-    r_cc = __get_dhis2_api_resource(cc_resource)
-    r_de = __get_dhis2_api_resource(de_resource)
-    r_ou = __get_dhis2_api_resource(ou_resource)
+    r_cc, r_de, r_ou = dhis2_client.get_many([cc_resource, de_resource, ou_resource],
+                                              client=__get_dhis2_client())
     cc_list = json.loads(r_cc.text)['categoryOptionCombos']
     de_list = json.loads(r_de.text)['dataElements']
     ou_list = json.loads(r_ou.text)['organisationUnits']
@@ -50,162 +73,168 @@ def get_metadata(from_pickle=False):
     org_units.to_pickle(ou_pickle_path)
 
 
-@etl.decorators.log_start_and_finalisation("get DHIS2 pivot table data")
-def get_dhis2_pivot_table_data(pivot_table_id, from_pickle=False):
-    build_dir_ = os.path.join(OUTPUT_DIR_NAME, "build")
-    os.makedirs(build_dir_, exist_ok=True)
-    pt_pickle_path = os.path.join(build_dir_, f"pivot_table_{pivot_table_id}.pickle")
-    if from_pickle and os.path.exists(pt_pickle_path):
-        df = pd.read_pickle(pt_pickle_path)
-        return df
-    dhis2_pivot_table_resource = __get_dhis2_table_api_resource(pivot_table_id)
-    r_pt = __get_dhis2_api_resource(dhis2_pivot_table_resource)
-    json_pt = json.loads(r_pt.text)
-    df = pd.DataFrame(json_pt['dataValues'])
-    df.to_pickle(pt_pickle_path)
-    return df
+def get_dhis2_pivot_table_data(pivot_table_id, from_pickle=False, incremental=False):
+    return get_dhis2_pivot_tables_data([pivot_table_id], from_pickle=from_pickle, incremental=incremental)[pivot_table_id]
 
 
-@etl.decorators.log_start_and_finalisation("export category config")
+@profiling.log_and_profile("get DHIS2 pivot table data")
+def get_dhis2_pivot_tables_data(pivot_table_ids, from_pickle=False, incremental=False):
+    build_dir_ = os.path.join(OUTPUT_DIR_NAME, "build")
+    os.makedirs(build_dir_, exist_ok=True)
+    tables = {}
+    for pivot_table_id in pivot_table_ids:
+        pt_pickle_path = os.path.join(build_dir_, f"pivot_table_{pivot_table_id}.pickle")
+        if from_pickle and os.path.exists(pt_pickle_path):
+            tables[pivot_table_id] = dhis2_schema.compact_data_values(pd.read_pickle(pt_pickle_path))
+    to_fetch = [x for x in pivot_table_ids if x not in tables]
+    if to_fetch:
+        # details and data pulls of different tables are independent, so tables are fetched concurrently
+        async def fetch_tables(client):
+            return await asyncio.gather(*[__fetch_pivot_table_data(client, x, incremental) for x in to_fetch])
+        for pivot_table_id, df in zip(to_fetch, dhis2_client.run_async(fetch_tables, client=__get_dhis2_client())):
+            df.to_pickle(os.path.join(build_dir_, f"pivot_table_{pivot_table_id}.pickle"))
+            tables[pivot_table_id] = df
+    return tables
+
+
+@profiling.log_and_profile("get DHIS2 pivot table config data")
+def get_dhis2_pivot_tables_config_data(pivot_table_ids, from_pickle=False):
+    """Data element and category option combo pairs of every pivot table, used for the config templates.
+
+    Tables without a local pickle and with the same org unit and period filters share one analytics pull
+    over the data elements of all of them, so it returns one row per pair.
+    """
+    build_dir_ = os.path.join(OUTPUT_DIR_NAME, "build")
+    tables = {}
+    for pivot_table_id in pivot_table_ids:
+        pt_pickle_path = os.path.join(build_dir_, f"pivot_table_{pivot_table_id}.pickle")
+        if from_pickle and os.path.exists(pt_pickle_path):
+            tables[pivot_table_id] = dhis2_schema.compact_data_values(pd.read_pickle(pt_pickle_path))
+    to_fetch = [x for x in pivot_table_ids if x not in tables]
+    if not to_fetch:
+        return tables
+    client = __get_dhis2_client()
+    responses = dhis2_client.get_many([f"reportTables/{x}" for x in to_fetch], client=client)
+    dimensions = {x: __get_dhis2_table_dimensions(x, json.loads(r.text)) for x, r in zip(to_fetch, responses)}
+    # org unit ids combined with levels select the levels within those subtrees and periods are summed up,
+    # so only tables with identical filters can share a pull, the data elements are the union of theirs
+    groups = {}
+    for pivot_table_id, (table_dx, ou_elms, ou_levels, periods) in dimensions.items():
+        dimensions_dx = groups.setdefault((tuple(ou_elms), tuple(ou_levels), tuple(periods)), [])
+        dimensions_dx += [x for x in table_dx if x not in dimensions_dx]
+    resources = [f"analytics.json?"
+                 f"dimension=dx:{';'.join(dimensions_dx)}&"
+                 f"dimension=co&"
+                 f"filter=ou:{';'.join(list(ou_elms) + [f'LEVEL-{x!r}' for x in ou_levels])}&"
+                 f"filter=pe:{';'.join(periods)}&"
+                 f"displayProperty=NAME"
+                 for (ou_elms, ou_levels, periods), dimensions_dx in groups.items()]
+    group_pairs = {}
+    for filters, r in zip(groups, dhis2_client.get_many(resources, client=client)):
+        json_analytics = json.loads(r.text)
+        pairs = pd.DataFrame(json_analytics.get('rows', []), columns=[x['name'] for x in json_analytics['headers']])
+        group_pairs[filters] = pairs.rename(columns={'dx': 'dataElement', 'co': 'categoryOptionCombo'})
+    for pivot_table_id, (table_dx, ou_elms, ou_levels, periods) in dimensions.items():
+        pairs = group_pairs[(tuple(ou_elms), tuple(ou_levels), tuple(periods))]
+        tables[pivot_table_id] = pairs[pairs['dataElement'].isin(table_dx)].reset_index(drop=True)
+    return tables
+
+
+@profiling.log_and_profile("export category config")
 def export_category_config(df: pd.DataFrame) -> pd.DataFrame:
-    categories_names = df['categoryOptionCombo'].replace(category_combos.set_index('id')['name'])
-    categories_ids = df['categoryOptionCombo']
-    categories_map = pd.DataFrame()
-    categories_map['name'] = categories_names
-    categories_map['id'] = categories_ids
-    categories_map = categories_map.drop_duplicates(subset='id')
-
-    data_elements_names = df['dataElement'].replace(data_elements.set_index('id')['name'])
-    data_elements_ids = df['dataElement']
-    data_elements_map = pd.DataFrame()
-    data_elements_map['name'] = data_elements_names
-    data_elements_map['id'] = data_elements_ids
-    data_elements_map = data_elements_map.drop_duplicates(subset='id')
+    category_ids = df['categoryOptionCombo'].astype(object).drop_duplicates()
+    category_names = category_ids.map(__names(category_combos)).fillna(category_ids)
+    data_element_ids = df['dataElement'].astype(object).drop_duplicates()
+    data_element_names = data_element_ids.map(__names(data_elements)).fillna(data_element_ids)
 
     config_output_dir = os.path.join(OUTPUT_DIR_NAME, "configs")
     os.makedirs(config_output_dir, exist_ok=True)
-    with open(os.path.join(config_output_dir, f"{TABLE_TYPE}_category_config.json"), 'w') as f:
-        f.write("[")
-        first = True
-        for i, row in categories_map.iterrows():
-            if not first:
-                f.write(',')
-            else:
-                first = False
-            line = f'''
-{{
-    "id": "{row["id"]}",
-    "name": "{row["name"]}",
-    "mapping": {{
-        "age_group": "",
-        "sex": ""
-    }}
-}}'''
-            f.write(line)
-        f.write("\n]\n")
-    with open(os.path.join(config_output_dir, f"{TABLE_TYPE}_column_config.json"), 'w') as f:
-        f.write("[")
-        first = True
-        for i, row in data_elements_map.iterrows():
-            if not first:
-                f.write(',')
-            else:
-                first = False
-            line = f'''
-{{
-    "id": "{row["id"]}",
-    "name": "{row["name"]}",
-    "mapping": "",
-    "categoryMapping": {{
-        "age_group": "",
-        "sex": ""
-    }}
-}}'''
-            f.write(line)
-        f.write("\n]\n")
+    __write_config_template(
+        os.path.join(config_output_dir, f"{TABLE_TYPE}_category_config.json"),
+        [{'id': id_, 'name': name, 'mapping': {'age_group': '', 'sex': ''}}
+         for id_, name in zip(category_ids, category_names)])
+    __write_config_template(
+        os.path.join(config_output_dir, f"{TABLE_TYPE}_column_config.json"),
+        [{'id': id_, 'name': name, 'mapping': '', 'categoryMapping': {'age_group': '', 'sex': ''}}
+         for id_, name in zip(data_element_ids, data_element_names)])
 
     return df
 
 
-@etl.decorators.log_start_and_finalisation("extract data elements names")
+def __names(metadata_df):
+    # id -> name lookup, the last name wins for duplicated ids
+    return metadata_df.drop_duplicates(subset='id', keep='last').set_index('id')['name']
+
+
+def __write_config_template(path, entries):
+    # one top level entry per block, so templates are easy to edit by hand
+    with open(path, 'w') as f:
+        f.write("[")
+        f.write(",".join(f"\n{json.dumps(x, indent=4, ensure_ascii=False)}" for x in entries))
+        f.write("\n]\n")
+
+
+@profiling.log_and_profile("extract data elements names")
 def extract_data_elements_names(df: pd.DataFrame) -> pd.DataFrame:
-    df['dataElementName'] = df['dataElement']
-    if PROGRAM_DATA_COLUMN_CONFIG:
-        de_id_map = {}
-        for column_config_filename in PROGRAM_DATA_COLUMN_CONFIG.split(','):
-            with open(column_config_filename, 'r') as f:
-                program_config = json.loads(f.read())
-                for config_ in program_config:
-                    mapping = config_.get('mapping')
-                    if not mapping:
-                        continue
-                    elif type(mapping) != list:
-                        mapping = [mapping]
-                    de_id_map[config_['id']] = mapping
-        extra_rows = pd.DataFrame(columns=list(df))
-        for i, row in df.iterrows():
-            de_id = row['dataElementName']
-            mappings = de_id_map.get(de_id, [])
-            if len(mappings) == 0:
-                continue
-            df.loc[i, 'dataElementName'] = mappings[0]
-            if len(mappings) > 1:
-                for mapping in mappings[1:]:
-                    extra_row = row.copy()
-                    extra_row['dataElementName'] = mapping
-                    extra_rows = extra_rows.append(extra_row)
-        df = df.append(extra_rows, ignore_index=True)
+    names = __get_program_config().data_element_names
+    data_element_ids = df['dataElement'].astype(object)
+    first_names = names[names['position'] == 0].set_index('id')['name']
+    df['dataElementName'] = data_element_ids.map(first_names).fillna(data_element_ids)
+    # data elements mapped to more than one column are repeated once for every extra column
+    extra_names = names[names['position'] > 0]
+    if not extra_names.empty:
+        extra = (pd.DataFrame({'row': range(len(df)), 'id': data_element_ids.to_numpy()})
+                 .merge(extra_names, on='id')
+                 .sort_values(['row', 'position'], kind='stable'))
+        extra_rows = df.iloc[extra['row']].copy()
+        extra_rows['dataElementName'] = extra['name'].to_numpy()
+        df = dhis2_schema.compact_data_values(pd.concat([df, extra_rows], ignore_index=True))
 
     # use default dhis2 de names for ids not in config
-    df['dataElementName'] = df['dataElementName'].replace(data_elements.set_index('id')['name'])
+    df['dataElementName'] = dhis2_schema.replace_values(df['dataElementName'], data_elements.set_index('id')['name'])
     return df
 
 
-@etl.decorators.log_start_and_finalisation("extract areas names")
+@profiling.log_and_profile("extract areas names")
 def extract_areas_names(df: pd.DataFrame) -> pd.DataFrame:
     df['area_id'] = df['orgUnit']
-    df['area_name'] = df['orgUnit'].replace(org_units.set_index('id')['name'])
+    df['area_name'] = dhis2_schema.replace_values(df['orgUnit'], org_units.set_index('id')['name'])
     return df
 
 
-@etl.decorators.log_start_and_finalisation("sort by area name")
+@profiling.log_and_profile("sort by area name")
 def sort_by_area_name(df: pd.DataFrame) -> pd.DataFrame:
     return df.sort_values(by=['area_name', 'period']).reset_index(drop=True)
 
 
-@etl.decorators.log_start_and_finalisation("extract categories and aggregate data")
+@profiling.log_and_profile("extract categories and aggregate data")
 def extract_categories_and_aggregate_data(df: pd.DataFrame) -> pd.DataFrame:
-    category_mapping = {}
-    for category_config_filename in PROGRAM_DATA_CATEGORY_CONFIG.split(','):
-        with open(category_config_filename, 'r') as f:
-            category_config = json.loads(f.read())
-            map_ = {x['id']: x.get('mapping', {}) for x in category_config}
-            category_mapping.update(map_)
-    if PROGRAM_DATA_COLUMN_CONFIG:
-        column_categories_map = {}
-        for column_config_filename in PROGRAM_DATA_COLUMN_CONFIG.split(','):
-            with open(column_config_filename, 'r') as f:
-                column_config = json.loads(f.read())
-                map_ = {x['id']: x.get('categoryMapping') for x in column_config}
-                column_categories_map.update(map_)
-    else:
-        column_categories_map = {}
-    categories_to_remove = set([x['id'] for x in category_config if bool(x.get('remove'))])
-    df = df.loc[~df['categoryOptionCombo'].isin(categories_to_remove)]
+    config = __get_program_config()
+    df = df.loc[~df['categoryOptionCombo'].isin(config.categories_to_remove)].copy()
     metadata_cols = ['area_id', 'area_name', 'period']
-    for i, row in df.iterrows():
-        category_id = row['categoryOptionCombo']
-        de_id = row['dataElement']
-        categories = column_categories_map.get(de_id) or category_mapping[category_id]
-        for c_name, c_value in categories.items():
-            if c_name not in metadata_cols:
-                metadata_cols.append(c_name)
-            df.loc[i, c_name] = c_value
+    categories = __get_categories(df, config)
+    # category columns in order of first appearance in the data
+    for c_name in categories.columns:
+        if c_name not in metadata_cols:
+            metadata_cols.append(c_name)
+    row_keys = pd.MultiIndex.from_arrays([df['dataElement'].astype(object), df['categoryOptionCombo'].astype(object)])
+    row_categories = categories.reindex(row_keys)
+    for c_name in categories.columns:
+        c_values = pd.Series(row_categories[c_name].to_numpy(), index=df.index)
+        if c_name in df:
+            c_values = c_values.fillna(df[c_name].astype(object))
+        df[c_name] = c_values
 
     df['value'] = pd.to_numeric(df['value'], errors='coerce', downcast='integer')
-    df[metadata_cols] = df[metadata_cols].fillna('')
-
-    aggregated_rows = df[metadata_cols + ['dataElementName', 'value']].groupby(metadata_cols + ['dataElementName']).sum().reset_index()
+    df = dhis2_schema.fillna(df, metadata_cols)
+    for c_name in metadata_cols:
+        df[c_name] = dhis2_schema.to_categorical(df[c_name])
+
+    # observed=True groups of several categoricals come out in order of appearance, sort_index restores the sorted order
+    aggregated_rows = df[metadata_cols + ['dataElementName', 'value']].groupby(metadata_cols + ['dataElementName'], observed=True).sum()
+    aggregated_rows = aggregated_rows.sort_index().reset_index()
+    # plain strings, so categories without rows don't turn into empty columns
+    aggregated_rows['dataElementName'] = aggregated_rows['dataElementName'].astype(object)
     pivot = aggregated_rows.pivot(columns='dataElementName', values='value')
     semi_wide_format_df = pd.concat([aggregated_rows[metadata_cols], pivot], axis=1)
 
@@ -221,49 +250,189 @@ def extract_categories_and_aggregate_data(df: pd.DataFrame) -> pd.DataFrame:
     return output_df
 
 
-@etl.decorators.log_start_and_finalisation("trimming period strings")
-def trim_period_strings(df: pd.DataFrame) -> pd.DataFrame:
-    df['period'] = df['period'].str[:4]
-    df = df.rename(columns={'period': 'year'})
-    return df
+def __get_categories(df, config):
+    """Category values of every (data element, category option combo) pair in `df`, one column per category.
+
+    The `categoryMapping` of the data element is used if it has one, otherwise the mapping of the category
+    option combo.
+    """
+    pairs = df[['dataElement', 'categoryOptionCombo']].astype(object).drop_duplicates()
+    pairs['pair'] = range(len(pairs))
+    has_column_mapping = pairs['dataElement'].isin(config.column_categories['id'])
+    unmapped = pairs.loc[~has_column_mapping & ~pairs['categoryOptionCombo'].isin(config.category_mappings['id']),
+                         'categoryOptionCombo'].unique()
+    if len(unmapped) > 0:
+        names = category_combos.set_index('id')['name']
+        unmapped = [f"{x} ({names[x]})" if x in names else x for x in unmapped]
+        raise program_config.ConfigError(f"No mapping in PROGRAM_DATA_CATEGORY_CONFIG for category option "
+                                         f"combos: {', '.join(unmapped)}")
+    categories = pd.concat([
+        pairs[has_column_mapping].merge(config.column_categories, left_on='dataElement', right_on='id'),
+        pairs[~has_column_mapping].merge(config.category_mappings, left_on='categoryOptionCombo', right_on='id')
+    ])
+    categories = categories[categories['order'] >= 0].sort_values(['pair', 'order'], kind='stable')
+    category_names = list(categories['category'].drop_duplicates())
+    if not category_names:
+        return pd.DataFrame(index=pd.MultiIndex.from_frame(pairs[['dataElement', 'categoryOptionCombo']]))
+    return (categories.set_index(['dataElement', 'categoryOptionCombo', 'category'])['value']
+            .unstack('category')[category_names])
+
+
+def __get_program_config():
+    return program_config.load(PROGRAM_DATA_CATEGORY_CONFIG, PROGRAM_DATA_COLUMN_CONFIG,
+                               cache_dir=os.path.join(OUTPUT_DIR_NAME, 'build', 'config_cache'))
+
 
+@profiling.log_and_profile("roll up periods")
+def roll_up_periods(df: pd.DataFrame) -> pd.DataFrame:
+    # a copy, the pulled data is rolled up once for every period type
+    return df.assign(period=dhis2_periods.roll_up(df['period'], PERIOD_TYPE))
 
-@etl.decorators.log_start_and_finalisation("map dhis2 id to area id")
+
+@profiling.log_and_profile("name period column")
+def name_period_column(df: pd.DataFrame) -> pd.DataFrame:
+    return df.rename(columns={'period': dhis2_periods.ROLL_UP_COLUMNS[PERIOD_TYPE]})
+
+
+@profiling.log_and_profile("map dhis2 id to area id")
 def map_dhis2_id_area_id(df: pd.DataFrame) -> pd.DataFrame:
     if AREA_ID_MAP:
-        area_id_df = pd.read_csv(AREA_ID_MAP, index_col=False)
-        if 'map_id' in list(area_id_df):
-            mapping_column_name = 'map_id'
-        else:
-            mapping_column_name = 'dhis2_id'
-        df['area_id'] = df['area_id'].replace(area_id_df.set_index(mapping_column_name)['area_id'])
+        area_id_df = join_area_ids_to_data.read_dhis2_id_mapping(AREA_ID_MAP)
+        df, unmatched = join_area_ids_to_data.join_area_ids(df, area_id_df, left_on='area_id', right_on='dhis2_id',
+                                                            keep_unmatched_keys=True)
+        df['area_id'] = dhis2_schema.to_categorical(df['area_id'])
+        if not unmatched.empty:
+            etl.LOGGER.warning(f"No area id mapping for DHIS2 org units: {', '.join(unmatched['area_id'])}")
     return df
 
 
-def __get_dhis2_api_resource(resource):
-    r = requests.get(urljoin(DHIS2_URL, resource), auth=HTTPBasicAuth(DHIS2_USERNAME, DHIS2_PASSWORD))
-    etl.requests_util.check_if_response_is_ok(r)
-    return r
+def __get_dhis2_client():
+    return dhis2_client.get_client(cache_dir=os.path.join(OUTPUT_DIR_NAME, 'build', 'http_cache'))
 
 
-def __fetch_pivot_table_details(dhis2_pivot_table_id):
-    reportTableReport = f"reportTables/{dhis2_pivot_table_id}"
-    rt_r = __get_dhis2_api_resource(reportTableReport)
-    return json.loads(rt_r.text)
+async def __fetch_pivot_table_data(client, pivot_table_id, incremental=False):
+    rt_r = await client.get(f"reportTables/{pivot_table_id}")
+    pivot_table_metadata = json.loads(rt_r.text)
+    if incremental:
+        return await __fetch_pivot_table_data_incrementally(client, pivot_table_id, pivot_table_metadata)
+    df = await __pull_data_values(client, pivot_table_id, pivot_table_metadata)
+    return dhis2_schema.compact_data_values(df)
 
 
-def __get_dhis2_table_api_resource(pivot_table_id):
-    pivot_table_metadata = __fetch_pivot_table_details(pivot_table_id)
+async def __fetch_pivot_table_data_incrementally(client, pivot_table_id, pivot_table_metadata):
+    """Refresh the local store of previously pulled data values of the table and return it.
+
+    Only periods not pulled before and the `INCREMENTAL_PERIODS` latest periods of the table,
+    the ones usually still revised in DHIS2, are pulled again. Pulled periods replace the stored
+    ones, so values deleted in DHIS2 are dropped too, and periods removed from the table config
+    are dropped from the store. The pulled periods are listed next to the store, so periods
+    without any values aren't pulled again either.
+    """
+    recent_periods_count = int(os.getenv("INCREMENTAL_PERIODS", 3))
+    store_path = os.path.join(OUTPUT_DIR_NAME, "build", f"pivot_table_{pivot_table_id}_store.pickle")
+    store_periods_path = os.path.join(OUTPUT_DIR_NAME, "build", f"pivot_table_{pivot_table_id}_store_periods.json")
+    periods = __get_periods(pivot_table_metadata)
+    if os.path.exists(store_path):
+        store = pd.read_pickle(store_path)
+    else:
+        store = pd.DataFrame(columns=INCREMENTAL_STORE_KEY)
+    if os.path.exists(store_path) and os.path.exists(store_periods_path):
+        with open(store_periods_path) as f:
+            stored_periods = set(json.load(f))
+    else:
+        # stores written without the list of pulled periods
+        stored_periods = set(store['period'].astype(object))
+    recent_periods = set(dhis2_periods.latest(periods, recent_periods_count))
+    to_fetch = [x for x in periods if x not in stored_periods or x in recent_periods]
+    if to_fetch:
+        etl.LOGGER.info(f"Pulling periods {', '.join(to_fetch)} of pivot table {pivot_table_id}")
+        fetched = await __pull_data_values(client, pivot_table_id, pivot_table_metadata, to_fetch)
+        kept = store[store['period'].isin(periods) & ~store['period'].isin(to_fetch)]
+        store = (pd.concat([kept.astype(object), fetched], ignore_index=True, sort=False)
+                 .drop_duplicates(subset=INCREMENTAL_STORE_KEY, keep='last')
+                 .reset_index(drop=True))
+        store = dhis2_schema.compact_data_values(store)
+        store.to_pickle(store_path)
+        pulled_periods = [x for x in periods if x in stored_periods or x in to_fetch]
+        memoize.write_if_changed(store_periods_path, json.dumps(pulled_periods))
+    else:
+        etl.LOGGER.info(f"No periods of pivot table {pivot_table_id} to pull, using the stored data")
+    return store
+
+
+async def __pull_data_values(client, pivot_table_id, pivot_table_metadata, periods=None):
+    """Pull data values of the pivot table with the engine set in `PIVOT_TABLE_ENGINE`.
+
+    `analytics` (default) pulls aggregated values from the analytics tables, `dataValueSets`
+    pulls raw values and aggregates them locally.
+    """
+    engine = os.getenv("PIVOT_TABLE_ENGINE", "analytics")
+    if engine == "dataValueSets":
+        return await __pull_raw_data_values(client, pivot_table_id, pivot_table_metadata, periods)
+    if engine != "analytics":
+        raise ValueError(f"Unknown pivot table engine \"{engine}\", use \"analytics\" or \"dataValueSets\"")
+    resource = __get_dhis2_table_api_resource(pivot_table_id, pivot_table_metadata, periods)
+    r_pt = await client.get(resource)
+    return pd.DataFrame(json.loads(r_pt.text).get('dataValues', []))
+
+
+async def __pull_raw_data_values(client, pivot_table_id, pivot_table_metadata, periods=None):
+    dimensions_dx, ou_elms, ou_levels, periods = __get_dhis2_table_dimensions(pivot_table_id, pivot_table_metadata,
+                                                                            periods)
+    org_unit_paths = await __get_org_unit_paths(client)
+    # without boundary org units the levels are selected in the whole (sub)tree the paths hold
+    roots = ou_elms or data_value_sets.hierarchy_roots(org_unit_paths)
+    resources = data_value_sets.get_resources(dimensions_dx, roots, periods)
+    responses = await client.get_many(resources, task=f"pivot table {pivot_table_id} dataValueSets requests")
+    data_values = [pd.DataFrame(json.loads(r.text).get('dataValues', [])) for r in responses]
+    data_values = pd.concat(data_values, ignore_index=True, sort=False) if data_values else pd.DataFrame()
+    etl.LOGGER.info(f"Aggregating {len(data_values)} raw data values of pivot table {pivot_table_id}")
+    return data_value_sets.aggregate_data_values(data_values, org_unit_paths, ou_elms, ou_levels, periods)
+
+
+async def __get_org_unit_paths(client):
+    """Org unit paths indexed by id, taken from the geodata ETL pickle if there is one."""
+    global org_unit_paths
+    if org_unit_paths is None:
+        geodata_pickle = os.path.join(OUTPUT_DIR_NAME, 'build', 'dhis2_orgs.pickle')
+        if os.path.exists(geodata_pickle):
+            org_unit_paths = pd.read_pickle(geodata_pickle).set_index('id')['path']
+        else:
+            r_ou = await client.get("organisationUnits?paging=false&fields=id,path")
+            org_unit_paths = pd.DataFrame(json.loads(r_ou.text)['organisationUnits']).set_index('id')['path']
+    return org_unit_paths
+
+
+def __get_dhis2_table_dimensions(pivot_table_id, pivot_table_metadata, periods=None):
     dimensions_dx = [x['dataElement']['id'] for x in pivot_table_metadata['dataDimensionItems'] if x['dataDimensionItemType'] == "DATA_ELEMENT"]
     ou_elms = [x['id'] for x in pivot_table_metadata['organisationUnits']]
-    ou_level = [f"LEVEL-{x!r}" for x in pivot_table_metadata.get('organisationUnitLevels', [])]
-    periods = [x['id'] for x in pivot_table_metadata['periods']]
+    ou_levels = list(pivot_table_metadata.get('organisationUnitLevels', []))
+    if periods is None:
+        periods = __get_periods(pivot_table_metadata)
     if len(dimensions_dx) < 1:
         raise ValueError(f"No data elements configured for pivot table {pivot_table_id}")
-    if len(ou_elms + ou_level) < 1:
+    if len(ou_elms + ou_levels) < 1:
         raise ValueError(f"No org units configured for pivot table {pivot_table_id}")
     if len(periods) < 1:
         raise ValueError(f"No periods configured for pivot table {pivot_table_id}")
+    return dimensions_dx, ou_elms, ou_levels, periods
+
+
+def __get_periods(pivot_table_metadata):
+    """Periods of the pivot table, split into `PULL_PERIOD_TYPE` periods if it is set.
+
+    The finest periods are pulled once and rolled up locally to every period type of `PERIOD_TYPES`.
+    """
+    periods = [x['id'] for x in pivot_table_metadata['periods']]
+    if PULL_PERIOD_TYPE:
+        periods = dhis2_periods.split(periods, PULL_PERIOD_TYPE)
+    return periods
+
+
+def __get_dhis2_table_api_resource(pivot_table_id, pivot_table_metadata, periods=None):
+    dimensions_dx, ou_elms, ou_levels, periods = __get_dhis2_table_dimensions(pivot_table_id, pivot_table_metadata,
+                                                                            periods)
+    ou_level = [f"LEVEL-{x!r}" for x in ou_levels]
     pivot_table_resource = f"analytics/dataValueSet.json?" \
                            f"dimension=dx:{';'.join(dimensions_dx)}&" \
                            f"dimension=co&" \
@@ -273,20 +442,111 @@ def __get_dhis2_table_api_resource(pivot_table_id):
     return pivot_table_resource
 
 
+@memoize.stage(config=lambda: {
+    'category_configs': [memoize.file_hash(x) for x in (PROGRAM_DATA_CATEGORY_CONFIG or '').split(',')],
+    'column_configs': [memoize.file_hash(x) for x in (PROGRAM_DATA_COLUMN_CONFIG or '').split(',')],
+    'area_id_map': memoize.file_hash(AREA_ID_MAP),
+    'category_combos': category_combos,
+    'data_elements': data_elements,
+    'org_units': org_units,
+    'period_type': PERIOD_TYPE
+})
 def run_pipeline(input_df):
     return (input_df
+            .pipe(roll_up_periods)
             .pipe(extract_data_elements_names)
             .pipe(extract_areas_names)
             .pipe(extract_categories_and_aggregate_data)
             .pipe(sort_by_area_name)
             .pipe(map_dhis2_id_area_id)
-            .pipe(trim_period_strings)
+            .pipe(name_period_column)
             )
 
 
-if __name__ == '__main__':
+def run_chunked_pipeline(pivot_table_id, output_file_path):
+    """Out-of-core version of `run_pipeline` for pulls that don't fit in memory.
+
+    The analytics data is pulled and processed `PIVOT_CHUNK_PERIODS` periods at a time. Each
+    processed chunk is hash partitioned on its metadata columns into `PIVOT_CHUNK_BUCKETS` files,
+    so rows with the same metadata from different chunks end up in the same bucket. Buckets are
+    then summed one at a time and appended to the output csv. Rows are ordered by bucket instead
+    of by area name. Every chunk is processed once for every period type of `PERIOD_TYPES`, see
+    `get_output_file_path`.
+    """
+    global PERIOD_TYPE
+    chunk_periods = int(os.getenv("PIVOT_CHUNK_PERIODS", 1))
+    buckets_count = int(os.getenv("PIVOT_CHUNK_BUCKETS", 16))
+    chunks_dir = os.path.join(OUTPUT_DIR_NAME, "build", f"chunks_{pivot_table_id}")
+    shutil.rmtree(chunks_dir, ignore_errors=True)
+    for period_type in PERIOD_TYPES:
+        os.makedirs(os.path.join(chunks_dir, period_type))
+    client = __get_dhis2_client()
+    pivot_table_metadata = json.loads(client.get(f"reportTables/{pivot_table_id}").text)
+    periods = __get_periods(pivot_table_metadata)
+    metadata_cols = {x: [] for x in PERIOD_TYPES}
+    data_cols = {x: set() for x in PERIOD_TYPES}
+    chunks = metrics.progress(f"pivot table {pivot_table_id} period chunks", -(-len(periods) // chunk_periods),
+                              'chunks')
+    for i in range(0, len(periods), chunk_periods):
+        chunk = periods[i:i + chunk_periods]
+        etl.LOGGER.info(f"Pulling periods {', '.join(chunk)} of pivot table {pivot_table_id}")
+        chunk_df = dhis2_schema.compact_data_values(dhis2_client.run_async(
+            lambda async_client: __pull_data_values(async_client, pivot_table_id, pivot_table_metadata, chunk),
+            client=client))
+        chunks.advance()
+        if chunk_df.empty:
+            continue
+        for period_type in PERIOD_TYPES:
+            PERIOD_TYPE = period_type
+            out = run_pipeline(chunk_df)
+            chunk_metadata_cols = __get_metadata_columns(out)
+            metadata_cols[period_type] += [x for x in chunk_metadata_cols if x not in metadata_cols[period_type]]
+            data_cols[period_type].update(x for x in out if x not in chunk_metadata_cols)
+            # category columns can differ between chunks, so partition only on columns every chunk has
+            partition_cols = ['area_id', 'area_name', dhis2_periods.ROLL_UP_COLUMNS[period_type]]
+            buckets = pd.util.hash_pandas_object(out[partition_cols], index=False) % buckets_count
+            for bucket, bucket_df in out.groupby(buckets):
+                bucket_df.to_pickle(os.path.join(chunks_dir, period_type, f"bucket_{bucket}_chunk_{i}.pickle"))
+    for period_type in PERIOD_TYPES:
+        __merge_chunk_buckets(os.path.join(chunks_dir, period_type), buckets_count, metadata_cols[period_type],
+                              sorted(data_cols[period_type]), get_output_file_path(output_file_path, period_type))
+    shutil.rmtree(chunks_dir, ignore_errors=True)
+
+
+def get_output_file_path(output_file_path, period_type):
+    """Output of the `period_type` periods, yearly data keeps the name of `output_file_path`."""
+    if period_type == 'Yearly':
+        return output_file_path
+    root, extension = os.path.splitext(output_file_path)
+    return f"{root}_{period_type.lower()}{extension}"
+
+
+def __get_metadata_columns(df):
+    # data columns hold the aggregated values, everything else describes the row
+    return [x for x in df if not pd.api.types.is_numeric_dtype(df[x])]
+
+
+@profiling.log_and_profile("merge chunk buckets")
+def __merge_chunk_buckets(chunks_dir, buckets_count, metadata_cols, data_cols, output_file_path):
+    schema = {**{x: 'string' for x in metadata_cols}, **{x: 'double' for x in data_cols},
+              **output_formats.SCHEMAS['program_data']}
+    with output_formats.TableWriter(output_file_path, {x: schema[x] for x in metadata_cols + data_cols},
+                                    float_format='%.f') as writer:
+        for bucket in range(buckets_count):
+            bucket_files = [x for x in os.listdir(chunks_dir) if x.startswith(f"bucket_{bucket}_")]
+            if not bucket_files:
+                continue
+            bucket_df = pd.concat([pd.read_pickle(os.path.join(chunks_dir, x)) for x in bucket_files])
+            bucket_df = bucket_df.reindex(columns=metadata_cols + data_cols)
+            bucket_df[metadata_cols] = bucket_df[metadata_cols].fillna('')
+            merged = bucket_df.groupby(metadata_cols, sort=False, observed=True)[data_cols].sum(min_count=1).reset_index()
+            writer.write(merged)
+
+
+def main(argv=None):
+    global EXPORT_NAME, OUTPUT_DIR_NAME, PROGRAM_DATA, PROGRAM_DATA_CATEGORY_CONFIG, PROGRAM_DATA_COLUMN_CONFIG, \
+        AREA_ID_MAP, TABLE_TYPE, PERIOD_TYPES, PERIOD_TYPE, PULL_PERIOD_TYPE, org_unit_paths
     parser = argparse.ArgumentParser(description='Pull geo data from a DHIS2 to be uploaded into ADR.')
-    argv = sys.argv[1:]
     parser.add_argument('-e', '--env-file',
                         default='.env',
                         help='env file to read config from')
@@ -298,15 +558,24 @@ if __name__ == '__main__':
                         dest='pt_config',
                         action='store_true',
                         help='fetch pivot table configuration data from DHIS2')
-    args = parser.parse_args()
+    parser.add_argument('-i', '--incremental',
+                        dest='incremental',
+                        action='store_true',
+                        help='pull only new and recent periods and merge them into the previously pulled data')
+    parser.add_argument('-k', '--chunked',
+                        dest='chunked',
+                        action='store_true',
+                        help='pull and process the data in chunks of periods to limit memory use')
+    args = parser.parse_args(argv)
+    if args.incremental and args.chunked:
+        parser.error("--incremental keeps all pulled data in one store and can't be combined with --chunked")
 
     load_dotenv(args.env_file)
+    etl.LOGGER = log
+    org_unit_paths = None
     EXPORT_NAME = os.environ.get('OUTPUT_DIR_NAME', 'default')
     OUTPUT_DIR_NAME = f"output/{EXPORT_NAME}"
-    DHIS2_URL = os.getenv("DHIS2_URL")
-    credentials.read_credentials(os.getenv("DHIS2_CREDENTIALS_FILE"))
-    DHIS2_USERNAME = os.getenv("DHIS2_USERNAME")
-    DHIS2_PASSWORD = os.getenv("DHIS2_PASSWORD")
+    memoize.cache_dir = os.path.join(OUTPUT_DIR_NAME, 'build', 'memo')
     PROGRAM_DATA = os.getenv('PROGRAM_DATA')
     PROGRAM_DATA_CATEGORY_CONFIG = os.getenv("PROGRAM_DATA_CATEGORY_CONFIG")
     # Legacy env name support
@@ -314,27 +583,65 @@ if __name__ == '__main__':
         PROGRAM_DATA_CATEGORY_CONFIG = os.getenv("PROGRAM_DATA_CONFIG")
     PROGRAM_DATA_COLUMN_CONFIG = os.getenv("PROGRAM_DATA_COLUMN_CONFIG")
     AREA_ID_MAP = os.getenv("AREA_ID_MAP")
+    PERIOD_TYPES = [x.strip() for x in os.getenv("PERIOD_TYPES", "Yearly").split(',') if x.strip()]
+    PULL_PERIOD_TYPE = os.getenv("PULL_PERIOD_TYPE")
+    # fail on a misconfigured OUTPUT_FORMATS or PERIOD_TYPES before pulling anything
+    output_formats.get_formats()
+    unknown_period_types = [x for x in PERIOD_TYPES if x not in dhis2_periods.ROLL_UP_COLUMNS]
+    if unknown_period_types:
+        raise ValueError(f"Unsupported PERIOD_TYPES {', '.join(unknown_period_types)}, "
+                         f"use {', '.join(dhis2_periods.ROLL_UP_COLUMNS)}")
+    metrics.start('pivot table', name=EXPORT_NAME)
 
     get_metadata(from_pickle=args.pickle)
     tables = json.loads(PROGRAM_DATA)
+    if args.pt_config:
+        pivot_tables_data = get_dhis2_pivot_tables_config_data([x['dhis2_pivot_table_id'] for x in tables],
+                                                               from_pickle=args.pickle)
+    elif not args.chunked:
+        pivot_tables_data = get_dhis2_pivot_tables_data([x['dhis2_pivot_table_id'] for x in tables],
+                                                        from_pickle=args.pickle,
+                                                        incremental=args.incremental)
     if args.pt_config:
         for table in tables:
             TABLE_TYPE = table['name']
+            profiling.context['table'] = TABLE_TYPE
             etl.LOGGER.info(f"Starting fetching metadata for table \"{TABLE_TYPE}\"")
             dhis2_pivot_table_id = table['dhis2_pivot_table_id']
-            (get_dhis2_pivot_table_data(dhis2_pivot_table_id, from_pickle=args.pickle)
+            (pivot_tables_data[dhis2_pivot_table_id]
              .pipe(export_category_config)
              )
             etl.LOGGER.info(f"Finished fetching metadata for table \"{TABLE_TYPE}\"")
     else:
+        tables_progress = metrics.progress('pivot tables', len(tables), 'tables')
         for table in tables:
             TABLE_TYPE = table['name']
+            profiling.context['table'] = TABLE_TYPE
             etl.LOGGER.info(f"Starting data fetch for table \"{TABLE_TYPE}\"")
             dhis2_pivot_table_id = table['dhis2_pivot_table_id']
-            input_df = get_dhis2_pivot_table_data(dhis2_pivot_table_id, from_pickle=args.pickle)
-            out = run_pipeline(input_df)
             output_file_path = os.path.join(OUTPUT_DIR_NAME, 'program', f"{EXPORT_NAME}_dhis2_pull_{TABLE_TYPE}.csv")
-            etl.LOGGER.info(f"Saving \"{TABLE_TYPE}\" data to file {output_file_path}")
             os.makedirs(os.path.join(OUTPUT_DIR_NAME, 'program'), exist_ok=True)
-            out.to_csv(output_file_path, index=None, float_format='%.f')
+            if args.chunked:
+                etl.LOGGER.info(f"Saving \"{TABLE_TYPE}\" data in chunks to file {output_file_path}")
+                run_chunked_pipeline(dhis2_pivot_table_id, output_file_path)
+            else:
+                for period_type in PERIOD_TYPES:
+                    PERIOD_TYPE = period_type
+                    period_output_file_path = get_output_file_path(output_file_path, period_type)
+                    out = run_pipeline(pivot_tables_data[dhis2_pivot_table_id])
+                    etl.LOGGER.info(f"Saving \"{TABLE_TYPE}\" {period_type} data to file {period_output_file_path}")
+                    output_formats.write_table(out, period_output_file_path, 'program_data', float_format='%.f')
+                    artefact_diff.diff_table(OUTPUT_DIR_NAME,
+                                             os.path.relpath(os.path.splitext(period_output_file_path)[0],
+                                                             OUTPUT_DIR_NAME),
+                                             out, [x for x in __get_metadata_columns(out) if x != 'area_name'],
+                                             float_format='%.f')
             etl.LOGGER.info(f"Finished processing table \"{TABLE_TYPE}\"")
+            tables_progress.advance()
+    dhis2_client.log_stats(etl.LOGGER)
+    profiling.write_run_report(OUTPUT_DIR_NAME, etl='pivot table', env_file=args.env_file, name=EXPORT_NAME)
+    metrics.stop()
+
+
+if __name__ == '__main__':
+    main()
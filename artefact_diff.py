@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import io
+import json
+import os
+from datetime import datetime
+
+from lazy_import import lazy_module
+
+pd = lazy_module('pandas')
+
+DELTA_DIR = 'delta'
+SNAPSHOT_DIR = os.path.join('build', 'snapshots')
+SUMMARY_FILE = 'summary.json'
+DELTAS = ['added', 'removed', 'changed']
+
+
+def enabled():
+    return os.environ.get('DELTA_ARTEFACTS', 'true').lower() not in ('false', '0', 'no')
+
+
+def diff_table(output_dir, name, df: pd.DataFrame, keys, float_format=None):
+    """Compare the table artefact `name` (e.g. `geodata/location_hierarchy`) with the one of the previous run.
+
+    Rows are matched by their `keys` columns and compared by a hash of all other values, as they are
+    written to the CSV. Added, removed and changed rows are written to `<output_dir>/delta/<name>_<delta>.csv`,
+    changed rows with the list of their changed columns, and the counts to `delta/summary.json`.
+    """
+    if not enabled():
+        return None
+    # compare the values as they are written, e.g. 1.0 and 1 are the same value in a CSV
+    current = pd.read_csv(io.StringIO(df.to_csv(index=False, float_format=float_format)), dtype=str,
+                          keep_default_na=False)
+    previous = __read_snapshot(output_dir, name)
+    added, removed, changed = compare(previous, current, keys)
+    for delta, delta_df in zip(DELTAS, [added, removed, changed]):
+        path = __delta_path(output_dir, name, f"{delta}.csv")
+        delta_df.to_csv(path, index=False)
+    return __finish(output_dir, name, current, previous, added, removed, changed)
+
+
+def diff_features(output_dir, name, features, key='area_id'):
+    """Same as `diff_table` for GeoJSON features matched by the `key` property, deltas are FeatureCollections."""
+    if not enabled():
+        return None
+    current = pd.DataFrame({
+        key: [str(x['properties'].get(key)) for x in features],
+        'feature': [json.dumps(x, sort_keys=True) for x in features]
+    }, columns=[key, 'feature'])
+    previous = __read_snapshot(output_dir, name)
+    added, removed, changed = compare(previous, current, [key])
+    for delta, delta_df in zip(DELTAS, [added, removed, changed]):
+        collection = {'type': 'FeatureCollection', 'features': [json.loads(x) for x in delta_df['feature']]}
+        with open(__delta_path(output_dir, name, f"{delta}.geojson"), 'w') as f:
+            json.dump(collection, f)
+    return __finish(output_dir, name, current, previous, added, removed, changed)
+
+
+def compare(previous, current, keys):
+    """Rows of `current` missing in `previous`, rows of `previous` missing in `current` and changed rows.
+
+    Both are DataFrames of strings. Rows with the same keys are matched in the order they appear.
+    Changed rows are the current ones with a `changed_columns` column.
+    """
+    if previous is None:
+        return current, current.iloc[0:0], current.iloc[0:0].assign(changed_columns='')
+    columns = list(current) + [x for x in previous if x not in list(current)]
+    current_ = __with_hashes(current.reindex(columns=columns, fill_value=''), keys)
+    previous_ = __with_hashes(previous.reindex(columns=columns, fill_value=''), keys)
+    match_keys = keys + ['_occurrence']
+    merged = current_[match_keys + ['_hash']].reset_index().merge(
+        previous_[match_keys + ['_hash']].reset_index(), on=match_keys, how='outer', suffixes=('', '_previous'),
+        indicator=True)
+    added = current.loc[merged.loc[merged['_merge'] == 'left_only', 'index'].astype(int)]
+    removed = previous.loc[merged.loc[merged['_merge'] == 'right_only', 'index_previous'].astype(int)]
+    both = merged[(merged['_merge'] == 'both') & (merged['_hash'] != merged['_hash_previous'])]
+    changed = current.loc[both['index'].astype(int)].copy()
+    values = [x for x in columns if x not in keys]
+    differences = (current_.loc[both['index'].astype(int), values].to_numpy() !=
+                   previous_.loc[both['index_previous'].astype(int), values].to_numpy())
+    changed['changed_columns'] = [';'.join(x for x, different in zip(values, row) if different)
+                                  for row in differences]
+    return added, removed, changed
+
+
+def __with_hashes(df, keys):
+    values = [x for x in df if x not in keys]
+    return df.assign(
+        _occurrence=df.groupby(keys, sort=False).cumcount(),
+        _hash=pd.util.hash_pandas_object(df[values], index=False) if values else 0
+    )
+
+
+def __finish(output_dir, name, current, previous, added, removed, changed):
+    counts = {
+        'added': len(added),
+        'removed': len(removed),
+        'changed': len(changed),
+        'unchanged': len(current) - len(added) - len(changed),
+        'first_run': previous is None
+    }
+    __write_snapshot(output_dir, name, current)
+    summary_path = os.path.join(output_dir, DELTA_DIR, SUMMARY_FILE)
+    summary = {'artefacts': {}}
+    if os.path.exists(summary_path):
+        with open(summary_path) as f:
+            summary = json.load(f)
+    summary['artefacts'][name] = {**counts, 'time': datetime.now().isoformat(timespec='seconds')}
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+    return counts
+
+
+def __delta_path(output_dir, name, suffix):
+    path = os.path.join(output_dir, DELTA_DIR, f"{name}_{suffix}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def __snapshot_path(output_dir, name):
+    return os.path.join(output_dir, SNAPSHOT_DIR, f"{name.replace('/', '_')}.pickle")
+
+
+def __read_snapshot(output_dir, name):
+    path = __snapshot_path(output_dir, name)
+    return pd.read_pickle(path) if os.path.exists(path) else None
+
+
+def __write_snapshot(output_dir, name, df):
+    path = __snapshot_path(output_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""Local stand-in for the DHIS2 API endpoints both ETLs pull from, for offline load testing.
+
+Serves responses recorded from a real DHIS2 or generated by `benchmarks.synthetic` at any scale,
+with configurable latency, bandwidth, error injection and gzip. Run from the repository root, e.g.:
+
+    python -m benchmarks.dhis2_stand_in --synthetic 100000 --latency 0.2 --error-rate 0.05
+    python -m benchmarks.dhis2_stand_in --record recordings/play --upstream https://play.dhis2.org/2.39.0/api/
+    python -m benchmarks.dhis2_stand_in --replay recordings/play --bandwidth 1000000
+
+and point `DHIS2_URL` of an ETL at the printed URL. `benchmarks.load_test` does this for both ETLs.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+API_PREFIX = '/api/'
+CHUNK_SIZE = 64 * 1024
+# responses smaller than this are not worth compressing, like in nginx' gzip_min_length
+GZIP_MIN_LENGTH = 1024
+DEFAULT_PAGE_SIZE = 50
+JSON = 'application/json'
+CSV = 'application/csv'
+SYNTHETIC_PIVOT_TABLE_ID = 'synthPivot1'
+SYNTHETIC_ATTRIBUTE_OPTION_COMBO = 'HllvX50cXC0'
+FILTER_OPERATORS = {
+    'eq': lambda x, y: x == y,
+    'lt': lambda x, y: x < y,
+    'le': lambda x, y: x <= y,
+    'gt': lambda x, y: x > y,
+    'ge': lambda x, y: x >= y,
+}
+
+
+def normalize(resource):
+    """`resource` (path and query, relative to the API root) with its query parameters sorted."""
+    parts = urlsplit(resource)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)), safe=',:;[]()/*')
+    return f"{parts.path.strip('/')}?{query}" if query else parts.path.strip('/')
+
+
+class RecordedResponses:
+    """Responses recorded in `record_dir`, keyed by their normalized resource.
+
+    Every response is a `<key>.json` file with the resource, status and content type next to a
+    `<key>.body` file, like the entries of the `HTTPCache`.
+    """
+
+    def __init__(self, record_dir):
+        self.record_dir = record_dir
+        os.makedirs(record_dir, exist_ok=True)
+
+    def get(self, resource):
+        path = self._path(resource)
+        if not os.path.exists(f"{path}.json"):
+            return None
+        with open(f"{path}.json") as f:
+            meta = json.load(f)
+        with open(f"{path}.body", 'rb') as f:
+            return meta['status'], meta['content_type'], f.read()
+
+    def store(self, resource, status, content_type, body):
+        path = self._path(resource)
+        with open(f"{path}.body", 'wb') as f:
+            f.write(body)
+        with open(f"{path}.json", 'w') as f:
+            json.dump({'resource': normalize(resource), 'status': status, 'content_type': content_type}, f)
+
+    def _path(self, resource):
+        return os.path.join(self.record_dir, hashlib.sha1(normalize(resource).encode()).hexdigest())
+
+
+class RecordingResponses:
+    """Responses of the `upstream` DHIS2 API, every one is recorded in `recorded` on the way through."""
+
+    def __init__(self, upstream, username, password, recorded: RecordedResponses, timeout=300):
+        import requests
+
+        self.upstream = upstream if upstream.endswith('/') else f"{upstream}/"
+        self.recorded = recorded
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+
+    def get(self, resource):
+        r = self.session.get(f"{self.upstream}{resource}", timeout=self.timeout)
+        content_type = r.headers.get('Content-Type', JSON)
+        if r.status_code == 200:
+            self.recorded.store(resource, r.status_code, content_type, r.content)
+        return r.status_code, content_type, r.content
+
+
+class SyntheticResponses:
+    """Responses of a synthetic DHIS2 with `n_org_units` org units and a pivot table of `n_data_values` values.
+
+    The org unit hierarchy comes from `synthetic.generate_org_units`, the pivot table (with the id
+    `SYNTHETIC_PIVOT_TABLE_ID`) has the values of `synthetic.generate_pivot_table` on the facilities.
+    With `org_units_format='geojson'` the org units CSV has no geometry columns, like older DHIS2
+    versions, so the geodata ETL pulls the area boundaries from `organisationUnits.geojson`.
+    Analytics pulls are filtered by data elements and periods, all values are under the one root.
+    """
+
+    def __init__(self, n_org_units, n_data_values, areas_admin_level=2, org_units_format='coordinates', seed=0):
+        from benchmarks import synthetic
+
+        self.areas_admin_level = areas_admin_level
+        self.org_units_format = org_units_format
+        self.org_units = synthetic.generate_org_units(n_org_units, areas_admin_level, seed)
+        self.org_units['level'] = self.org_units['path'].str.count('/')
+        facility_level = areas_admin_level + 2
+        facilities = self.org_units.loc[self.org_units['level'] == facility_level, 'id'].to_numpy()
+        # a different seed than the org units, so generated ids don't collide
+        data_values, metadata, self.category_config, self.column_config = synthetic.generate_pivot_table(
+            n_data_values, n_org_units=max(1, len(facilities)), seed=seed + 1)
+        if len(facilities):
+            data_values['orgUnit'] = data_values['orgUnit'].map(dict(zip(metadata['org_units']['id'], facilities)))
+        data_values['attributeOptionCombo'] = SYNTHETIC_ATTRIBUTE_OPTION_COMBO
+        self.data_values = data_values
+        self.category_combos = metadata['category_combos']
+        self.data_elements = metadata['data_elements']
+        self.periods = sorted(data_values['period'].unique())
+        self.root = self.org_units.loc[self.org_units['level'] == 1, 'id'].iloc[0]
+        self.report_table = {
+            'id': SYNTHETIC_PIVOT_TABLE_ID,
+            'name': 'Synthetic pivot table',
+            'dataDimensionItems': [{'dataDimensionItemType': 'DATA_ELEMENT', 'dataElement': {'id': x}}
+                                   for x in self.data_elements['id']],
+            'organisationUnits': [{'id': self.root}],
+            'organisationUnitLevels': [facility_level],
+            'periods': [{'id': x} for x in self.periods]
+        }
+        self._date_ranges = None
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, resource):
+        # bodies are cached, so the time measured is the ETLs' and not the time building responses
+        key = normalize(resource)
+        with self._lock:
+            response = self._cache.get(key)
+        if response is None:
+            try:
+                response = self._build(resource)
+            except ValueError as e:
+                # DHIS2 answers queries it can't run with a 409 Conflict
+                response = 409, JSON, self._json({'httpStatusCode': 409, 'status': 'ERROR', 'message': str(e)})
+            with self._lock:
+                self._cache[key] = response
+        return response
+
+    def _build(self, resource):
+        parts = urlsplit(resource)
+        path = parts.path.strip('/')
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        params = dict(query)
+        if path == 'organisationUnits.csv':
+            columns = ['name', 'id', 'shortName', 'path', 'displayName']
+            if self.org_units_format == 'coordinates':
+                columns += ['featureType', 'coordinates']
+            # like DHIS2, the columns come in their own order, whatever the order of the fields
+            fields = params.get('fields', '').split(',')
+            columns = [x for x in columns if x in fields] if params.get('fields') else columns
+            org_units = self._filter(self.org_units, query)
+            return 200, CSV, org_units[columns].to_csv(index=False).encode()
+        if path == 'organisationUnits.geojson':
+            return 200, JSON, self._json(self._geojson([int(v) for k, v in query if k == 'level']))
+        if path in ('organisationUnits', 'organisationUnits.json'):
+            return 200, JSON, self._json(self._list('organisationUnits', self._filter(self.org_units, query), params))
+        if path in ('categoryOptionCombos', 'categoryOptionCombos.json'):
+            return 200, JSON, self._json(self._list('categoryOptionCombos', self.category_combos, params))
+        if path in ('dataElements', 'dataElements.json'):
+            return 200, JSON, self._json(self._list('dataElements', self.data_elements, params))
+        if path in (f"reportTables/{SYNTHETIC_PIVOT_TABLE_ID}", f"reportTables/{SYNTHETIC_PIVOT_TABLE_ID}.json"):
+            return 200, JSON, self._json(self.report_table)
+        if path == 'analytics/dataValueSet.json':
+            dimensions = self._dimensions(query, 'dimension')
+            values = self._analytics_values(dimensions.get('dx'), dimensions.get('pe'))
+            return 200, JSON, self._json({'dataValues': self._records(values)})
+        if path == 'analytics.json':
+            dimensions = {**self._dimensions(query, 'dimension'), **self._dimensions(query, 'filter')}
+            values = self._analytics_values(dimensions.get('dx'), dimensions.get('pe'))
+            rows = values.groupby(['dataElement', 'categoryOptionCombo'])['value'].apply(
+                lambda x: str(x.astype(int).sum())).reset_index()
+            return 200, JSON, self._json({'headers': [{'name': 'dx'}, {'name': 'co'}, {'name': 'value'}],
+                                          'rows': rows.to_numpy().tolist()})
+        if path == 'dataValueSets.json':
+            return 200, JSON, self._json({'dataValues': self._records(self._raw_values(query))})
+        return None
+
+    def _list(self, name, df, params):
+        fields = [x for x in params.get('fields', 'id,name').split(',') if x in df]
+        items = df[fields]
+        if params.get('paging', 'true') == 'false':
+            return {name: self._records(items)}
+        page_size = int(params.get('pageSize', DEFAULT_PAGE_SIZE))
+        page = int(params.get('page', 1))
+        page_count = max(1, -(-len(items) // page_size))
+        return {'pager': {'page': page, 'pageCount': page_count, 'total': len(items), 'pageSize': page_size},
+                name: self._records(items.iloc[(page - 1) * page_size:page * page_size])}
+
+    def _filter(self, df, query):
+        """Rows of `df` matching all `filter=property:operator:value` parameters DHIS2 supports for org units."""
+        if self.org_units_format != 'coordinates':
+            df = df.drop(columns=['featureType', 'coordinates'])
+        for key, value in query:
+            if key != 'filter':
+                continue
+            column, operator, operand = (value.split(':', 2) + [''])[:3]
+            if column not in df:
+                raise ValueError(f"Unknown filter property {column}")
+            values = df[column]
+            if operator in FILTER_OPERATORS:
+                df = df[FILTER_OPERATORS[operator](values, type(values.iloc[0])(operand) if len(values) else operand)]
+            elif operator == 'like':
+                df = df[values.astype(str).str.contains(operand, case=False, regex=False)]
+            else:
+                raise ValueError(f"Unsupported filter operator {operator}")
+        return df
+
+    def _geojson(self, levels):
+        areas = self.org_units[(self.org_units['featureType'] == 'POLYGON') &
+                               self.org_units['level'].isin(levels or range(1, self.areas_admin_level + 2))]
+        return {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'id': x.id, 'geometry': {'type': 'Polygon', 'coordinates': json.loads(x.coordinates)},
+             'properties': {'code': x.id, 'name': x.name, 'level': str(x.level), 'parent': x.path.split('/')[-2]}}
+            for x in areas.itertuples()
+        ]}
+
+    def _analytics_values(self, data_elements, periods):
+        values = self.data_values
+        if data_elements:
+            values = values[values['dataElement'].isin(data_elements)]
+        if periods:
+            values = values[values['period'].isin(periods)]
+        return values[['dataElement', 'period', 'orgUnit', 'categoryOptionCombo', 'value']]
+
+    def _raw_values(self, query):
+        import data_value_sets
+
+        params = dict(query)
+        values = self.data_values
+        data_elements = [v for k, v in query if k == 'dataElement']
+        if data_elements:
+            values = values[values['dataElement'].isin(data_elements)]
+        if params.get('orgUnit') != self.root:
+            values = values.iloc[0:0]
+        if self._date_ranges is None:
+            self._date_ranges = {x: data_value_sets.period_date_range(x) for x in self.periods}
+        start, end = params.get('startDate'), params.get('endDate')
+        in_range = [x for x, (first, last) in self._date_ranges.items()
+                    if (not start or first.isoformat() >= start) and (not end or last.isoformat() <= end)]
+        return values[values['period'].isin(in_range)]
+
+    @staticmethod
+    def _dimensions(query, name):
+        dimensions = {}
+        for key, value in query:
+            if key == name and ':' in value:
+                dimension, items = value.split(':', 1)
+                dimensions[dimension] = items.split(';')
+        return dimensions
+
+    @staticmethod
+    def _records(df):
+        return df.to_dict(orient='records')
+
+    @staticmethod
+    def _json(data):
+        return json.dumps(data, separators=(',', ':'), default=str).encode()
+
+
+class StandIn:
+    """DHIS2 stand-in HTTP server serving `responses`, started and stopped as a context manager.
+
+    Every request waits `latency` seconds (plus a uniform `jitter`), bodies are sent at most at
+    `bandwidth` bytes per second and a share `error_rate` of the requests fails with `error_status`.
+    Bodies are gzip compressed for clients accepting it, unless `gzip_enabled` is false, and carry
+    an ETag, so conditional requests of the HTTP cache get 304 responses. Counters of what was
+    served are kept in `stats`.
+    """
+
+    def __init__(self, responses, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, bandwidth=None,
+                 error_rate=0.0, error_status=503, gzip_enabled=True, seed=0, verbose=False):
+        self.responses = responses
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.gzip_enabled = gzip_enabled
+        self.verbose = verbose
+        self.stats = {'requests': 0, 'errors': 0, 'not_found': 0, 'not_modified': 0, 'bytes_sent': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._compressed = {}
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stand_in = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='dhis2-stand-in', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def _should_fail(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _delay(self):
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter) if self.jitter else 0
+        return self.latency + jitter
+
+    def _gzip(self, etag, body):
+        with self._lock:
+            compressed = self._compressed.get(etag)
+        if compressed is None:
+            compressed = gzip.compress(body, compresslevel=6, mtime=0)
+            with self._lock:
+                self._compressed[etag] = compressed
+        return compressed
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        stand_in._count('requests')
+        delay = stand_in._delay()
+        if delay:
+            time.sleep(delay)
+        if not self.path.startswith(API_PREFIX):
+            return self._send_error(404, f"Not an API path: {self.path}", 'not_found')
+        if stand_in._should_fail():
+            return self._send_error(stand_in.error_status, 'Injected error', 'errors')
+        response = stand_in.responses.get(self.path[len(API_PREFIX):])
+        if response is None:
+            return self._send_error(404, f"No response for {self.path}", 'not_found')
+        status, content_type, body = response
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            stand_in._count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        headers = {'Content-Type': content_type, 'ETag': etag}
+        if stand_in.gzip_enabled and len(body) >= GZIP_MIN_LENGTH and \
+                'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = stand_in._gzip(etag, body)
+            headers['Content-Encoding'] = 'gzip'
+        self._send(status, headers, body)
+
+    def _send_error(self, status, message, counter):
+        self.server.stand_in._count(counter)
+        body = json.dumps({'httpStatusCode': status, 'status': 'ERROR', 'message': message}).encode()
+        # a Retry-After of 0 keeps clients from waiting longer than their own backoff
+        self._send(status, {'Content-Type': JSON, 'Retry-After': '0'}, body)
+
+    def _send(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        bandwidth = self.server.stand_in.bandwidth
+        for i in range(0, len(body), CHUNK_SIZE):
+            chunk = body[i:i + CHUNK_SIZE]
+            start = time.perf_counter()
+            self.wfile.write(chunk)
+            if bandwidth:
+                wait = len(chunk) / bandwidth - (time.perf_counter() - start)
+                if wait > 0:
+                    time.sleep(wait)
+        self.server.stand_in._count('bytes_sent', len(body))
+
+    def log_message(self, format, *args):
+        if self.server.stand_in.verbose:
+            super().log_message(format, *args)
+
+
+def add_network_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds every request waits before the response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra latency, up to this many seconds')
+    parser.add_argument('--bandwidth', type=float, help='bytes per second responses are sent at')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failing with --error-status')
+    parser.add_argument('--error-status', type=int, default=503, help='status code of injected errors')
+    parser.add_argument('--no-gzip', dest='gzip', action='store_false', help='never compress responses')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data and the injected errors')
+
+
+def network_options(args):
+    return {'latency': args.latency, 'jitter': args.jitter, 'bandwidth': args.bandwidth,
+            'error_rate': args.error_rate, 'error_status': args.error_status, 'gzip_enabled': args.gzip,
+            'seed': args.seed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve recorded or synthetic DHIS2 API responses.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--synthetic', type=int, metavar='N_ORG_UNITS',
+                        help='serve a synthetic DHIS2 with this many org units')
+    source.add_argument('--replay', metavar='DIR', help='serve the responses recorded in this directory')
+    source.add_argument('--record', metavar='DIR', help='proxy to --upstream and record the responses here')
+    parser.add_argument('--data-values', type=int, default=10_000,
+                        help='number of data values of the synthetic pivot table')
+    parser.add_argument('--areas-admin-level', type=int, default=2, help='area levels of the synthetic hierarchy')
+    parser.add_argument('--org-units-format', choices=['coordinates', 'geojson'], default='coordinates',
+                        help='serve synthetic org unit geometries in the org units CSV or only as GeoJSON')
+    parser.add_argument('--upstream', help='DHIS2 API URL to record from, defaults to DHIS2_URL')
+    parser.add_argument('-e', '--env-file', default='.env', help='env file with the upstream DHIS2 credentials')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every request')
+    add_network_arguments(parser)
+    args = parser.parse_args()
+
+    if args.synthetic is not None:
+        responses = SyntheticResponses(args.synthetic, args.data_values, args.areas_admin_level,
+                                       args.org_units_format, args.seed)
+    elif args.replay:
+        responses = RecordedResponses(args.replay)
+    else:
+        from dotenv import load_dotenv
+
+        import credentials
+
+        load_dotenv(args.env_file)
+        credentials.read_credentials(os.environ.get("DHIS2_CREDENTIALS_FILE"))
+        responses = RecordingResponses(args.upstream or os.environ["DHIS2_URL"], os.environ.get("DHIS2_USERNAME"),
+                                       os.environ.get("DHIS2_PASSWORD"), RecordedResponses(args.record))
+    stand_in = StandIn(responses, args.host, args.port, verbose=args.verbose, **network_options(args))
+    print(f"DHIS2 stand-in serving at {stand_in.url}", file=sys.stderr)
+    try:
+        stand_in._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stand_in._server.server_close()
+        print(json.dumps(stand_in.stats), file=sys.stderr)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Measure end-to-end throughput of both ETLs pulling from a local DHIS2 stand-in.
+
+Every case runs an ETL CLI in a fresh process against `benchmarks.dhis2_stand_in`, serving synthetic
+responses at the chosen scale or the responses recorded from a real DHIS2. Run from the repository
+root, e.g.:
+
+    python -m benchmarks.load_test --sizes small
+    python -m benchmarks.load_test --suite pivot,pivot-raw --sizes medium --latency 0.3 --error-rate 0.1
+    python -m benchmarks.load_test --suite pivot --replay recordings/play -e .env.play
+
+Requests, bytes, injected errors and client retries are reported next to the wall time and rows per second.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+from benchmarks import dhis2_stand_in
+from benchmarks.run_benchmarks import SIZES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_DIR_NAME = 'loadtest'
+AREAS_ADMIN_LEVEL = 2
+# org units of the pivot cases, enough facilities for every data value to have its own key
+MIN_PIVOT_ORG_UNITS = 1_000
+PIVOT_ROWS_PER_ORG_UNIT = 30
+# geodata cases only pull org units, their pivot table is kept small
+GEODATA_DATA_VALUES = 1_000
+
+CASES = OrderedDict([
+    ('geodata', {'script': 'adr_dhis2_geodata_etl.py', 'sizes': 'geodata'}),
+    ('geodata-geojson', {'script': 'adr_dhis2_geodata_etl.py', 'sizes': 'geodata', 'org_units_format': 'geojson'}),
+    # the org units of one area at the first level below the root, see ORG_UNITS_PUSHDOWN
+    ('geodata-subtree', {'script': 'adr_dhis2_geodata_etl.py', 'sizes': 'geodata',
+                         'env': {'SUBTREE_ORG_NAME': 'Area 1-0', 'AREAS_ADMIN_LEVEL': '1'}}),
+    ('pivot', {'script': 'adr_dhis2_pivot_table_etl.py', 'sizes': 'pivot'}),
+    ('pivot-raw', {'script': 'adr_dhis2_pivot_table_etl.py', 'sizes': 'pivot',
+                   'env': {'PIVOT_TABLE_ENGINE': 'dataValueSets'}}),
+    ('pivot-chunked', {'script': 'adr_dhis2_pivot_table_etl.py', 'sizes': 'pivot', 'argv': ['-k']}),
+])
+
+
+def synthetic_responses(case, size, seed=0):
+    if CASES[case]['sizes'] == 'geodata':
+        n_org_units, n_data_values = size, GEODATA_DATA_VALUES
+    else:
+        n_org_units, n_data_values = max(MIN_PIVOT_ORG_UNITS, size // PIVOT_ROWS_PER_ORG_UNIT), size
+    return dhis2_stand_in.SyntheticResponses(n_org_units, n_data_values, AREAS_ADMIN_LEVEL,
+                                             CASES[case].get('org_units_format', 'coordinates'), seed)
+
+
+def etl_env(stand_in, run_dir, responses, base_env=None):
+    """Environment of an ETL run against `stand_in`, `base_env` (e.g. of a replayed DHIS2) overrides the defaults."""
+    env = {
+        'DHIS2_USERNAME': 'admin',
+        'DHIS2_PASSWORD': 'district',
+        'AREAS_ADMIN_LEVEL': str(AREAS_ADMIN_LEVEL),
+        'ISO_CODE': OUTPUT_DIR_NAME,
+        # every request goes to the stand-in, not to a cache of the previous run
+        'DHIS2_HTTP_CACHE': 'false',
+    }
+    if isinstance(responses, dhis2_stand_in.SyntheticResponses):
+        from benchmarks import synthetic
+
+        category_config_path, column_config_path = synthetic.write_configs(
+            os.path.join(run_dir, 'config'), responses.category_config, responses.column_config)
+        env.update({
+            'PROGRAM_DATA': json.dumps([{'name': 'synthetic',
+                                         'dhis2_pivot_table_id': dhis2_stand_in.SYNTHETIC_PIVOT_TABLE_ID}]),
+            'PROGRAM_DATA_CATEGORY_CONFIG': category_config_path,
+            'PROGRAM_DATA_COLUMN_CONFIG': column_config_path,
+        })
+    env.update(base_env or {})
+    env.update({'DHIS2_URL': stand_in.url, 'OUTPUT_DIR_NAME': OUTPUT_DIR_NAME})
+    return env
+
+
+def run_case(case, responses, stand_in_options, etl_options, base_env=None, keep_dir=None):
+    if not keep_dir:
+        with tempfile.TemporaryDirectory(prefix=f"load_test_{case}_") as run_dir:
+            return run_etl(case, responses, run_dir, stand_in_options, etl_options, base_env)
+    os.makedirs(keep_dir, exist_ok=True)
+    return {**run_etl(case, responses, keep_dir, stand_in_options, etl_options, base_env), 'run_dir': keep_dir}
+
+
+def run_etl(case, responses, run_dir, stand_in_options, etl_options, base_env=None):
+    """Run the ETL of `case` in `run_dir` against a stand-in serving `responses` and measure it."""
+    config = CASES[case]
+    with dhis2_stand_in.StandIn(responses, **stand_in_options) as stand_in:
+        env = {**etl_env(stand_in, run_dir, responses, base_env), **config.get('env', {}), **etl_options}
+        env_path = os.path.join(run_dir, '.env')
+        with open(env_path, 'w') as f:
+            f.writelines(f"{key}='{value}'\n" for key, value in env.items())
+        log_path = os.path.join(run_dir, 'etl.log')
+        start = time.perf_counter()
+        with open(log_path, 'w') as log:
+            # values in the process environment take precedence over the env file with dotenv
+            completed = subprocess.run([sys.executable, os.path.join(ROOT, config['script']), '-e', env_path,
+                                        *config.get('argv', [])], cwd=run_dir, env={**os.environ, **env},
+                                       stdout=log, stderr=subprocess.STDOUT)
+        wall_time = time.perf_counter() - start
+    if completed.returncode:
+        with open(log_path) as f:
+            print(f"{case} failed, last lines of {log_path}:\n{''.join(f.readlines()[-20:])}", file=sys.stderr)
+    report_path = os.path.join(run_dir, 'output', OUTPUT_DIR_NAME, 'reports', 'run_report.json')
+    requests = []
+    if os.path.exists(report_path):
+        with open(report_path) as f:
+            requests = json.load(f)['requests']
+    return {
+        'ok': completed.returncode == 0,
+        'wall_time': wall_time,
+        'rows': _rows(case, responses),
+        'requests': stand_in.stats['requests'],
+        'bytes_sent': stand_in.stats['bytes_sent'],
+        'injected_errors': stand_in.stats['errors'],
+        'client_retries': sum(x['retries'] for x in requests),
+        'client_request_time': sum(x['elapsed'] for x in requests),
+    }
+
+
+def _rows(case, responses):
+    if not isinstance(responses, dhis2_stand_in.SyntheticResponses):
+        return None
+    return len(responses.org_units) if CASES[case]['sizes'] == 'geodata' else len(responses.data_values)
+
+
+def print_results(results):
+    print(f"\n  {'case':<28}{'wall [s]':>10}{'rows/s':>12}{'requests':>10}{'MB sent':>10}{'MB/s':>8}"
+          f"{'errors':>8}{'retries':>9}")
+    for case, r in results.items():
+        rows_per_second = f"{r['rows'] / r['wall_time']:.0f}" if r['rows'] else '-'
+        print(f"  {case:<28}{r['wall_time']:>10.2f}{rows_per_second:>12}{r['requests']:>10}"
+              f"{r['bytes_sent'] / 2 ** 20:>10.1f}{r['bytes_sent'] / 2 ** 20 / r['wall_time']:>8.2f}"
+              f"{r['injected_errors']:>8}{r['client_retries']:>9}{'' if r['ok'] else '  FAILED'}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test both ETLs against a local DHIS2 stand-in.')
+    parser.add_argument('-s', '--suite', default=','.join(CASES),
+                        help=f"comma separated list of cases: {', '.join(CASES)}")
+    parser.add_argument('--sizes', default='small', help='comma separated list of sizes: small, medium, large')
+    parser.add_argument('--replay', metavar='DIR', help='serve the responses recorded in this directory instead')
+    parser.add_argument('-e', '--env-file', help='env file with the ETL config of the replayed DHIS2')
+    parser.add_argument('--concurrency', type=int, help='DHIS2_MAX_CONCURRENCY of the ETLs')
+    parser.add_argument('--backoff-factor', type=float, default=0.1, help='DHIS2_BACKOFF_FACTOR of the ETLs')
+    parser.add_argument('--keep', metavar='DIR', help='keep the run directories (env, log, outputs) in DIR')
+    parser.add_argument('--output', help='save the results to this json file')
+    dhis2_stand_in.add_network_arguments(parser)
+    args = parser.parse_args()
+
+    base_env = None
+    if args.env_file:
+        from dotenv import dotenv_values
+
+        base_env = dict(dotenv_values(args.env_file))
+    etl_options = {'DHIS2_BACKOFF_FACTOR': str(args.backoff_factor)}
+    if args.concurrency:
+        etl_options['DHIS2_MAX_CONCURRENCY'] = str(args.concurrency)
+    stand_in_options = dhis2_stand_in.network_options(args)
+
+    results = OrderedDict()
+    for case in args.suite.split(','):
+        if case not in CASES:
+            parser.error(f"unknown case {case}, use one of {', '.join(CASES)}")
+        for size_name in ([None] if args.replay else args.sizes.split(',')):
+            name = f"{case}-replay" if args.replay else f"{case}-{SIZES[CASES[case]['sizes']][size_name]}"
+            print(f"Running {name}", file=sys.stderr)
+            if args.replay:
+                responses = dhis2_stand_in.RecordedResponses(args.replay)
+            else:
+                responses = synthetic_responses(case, SIZES[CASES[case]['sizes']][size_name], args.seed)
+            keep_dir = os.path.join(args.keep, name) if args.keep else None
+            results[name] = run_case(case, responses, stand_in_options, etl_options, base_env, keep_dir)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0 if all(x['ok'] for x in results.values()) else 1)
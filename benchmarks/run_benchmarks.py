@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Time and memory-profile every stage of both ETL pipelines on synthetic DHIS2-scale fixtures.
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.run_benchmarks --sizes small
+    python -m benchmarks.run_benchmarks --sizes small --save-baseline
+
+Every case runs in a fresh process so peak RSS is measured per case. Results are compared against
+`benchmarks/baseline.json` and the run fails if any stage got slower or bigger than the tolerance.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+SIZES = {
+    'geodata': {'small': 1_000, 'medium': 100_000, 'large': 1_000_000},
+    'pivot': {'small': 10_000, 'medium': 1_000_000, 'large': 10_000_000},
+    # number of runs of every CLI, the median is reported
+    'startup': {'small': 5, 'medium': 10, 'large': 20},
+}
+STARTUP_SCRIPTS = ['adr_dhis2_geodata_etl.py', 'adr_dhis2_pivot_table_etl.py']
+METRICS = ['wall_time', 'cpu_time', 'peak_rss_delta', 'memory_out']
+
+
+def run_geodata_case(n_org_units, output_dir):
+    from benchmarks import synthetic
+    import adr_dhis2_geodata_etl as geo_etl
+    import profiling
+
+    df = synthetic.generate_org_units(n_org_units)
+    geo_etl.OUTPUT_DIR_NAME = output_dir
+    geo_etl.SUBTREE_ORG_NAME = False
+    geo_etl.AREAS_ADMIN_LEVEL = 2
+    geo_etl.ISO_CODE = 'bench'
+    profiling.reset()
+    geo_etl.run_steps(df)
+    return profiling.stages()
+
+
+def run_pivot_case(n_rows, output_dir):
+    from benchmarks import synthetic
+    import adr_dhis2_pivot_table_etl as pivot_etl
+    import profiling
+
+    df, metadata, category_config, column_config = synthetic.generate_pivot_table(n_rows)
+    category_config_path, column_config_path = synthetic.write_configs(output_dir, category_config, column_config)
+    pivot_etl.OUTPUT_DIR_NAME = output_dir
+    pivot_etl.AREA_ID_MAP = ''
+    pivot_etl.PROGRAM_DATA_CATEGORY_CONFIG = category_config_path
+    pivot_etl.PROGRAM_DATA_COLUMN_CONFIG = column_config_path
+    pivot_etl.category_combos = metadata['category_combos']
+    pivot_etl.data_elements = metadata['data_elements']
+    pivot_etl.org_units = metadata['org_units']
+    profiling.reset()
+    pivot_etl.run_pipeline(df)
+    return profiling.stages()
+
+
+def run_startup_case(repeats, output_dir):
+    """Time `--help` of both CLIs, i.e. how long importing the ETL modules takes."""
+    import statistics
+    import subprocess
+    import time
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    stages = []
+    for script in STARTUP_SCRIPTS:
+        wall_times, cpu_times = [], []
+        for _ in range(repeats):
+            cpu_start = os.times()
+            start = time.perf_counter()
+            subprocess.run([sys.executable, script, '--help'], cwd=root, check=True, stdout=subprocess.DEVNULL)
+            wall_times.append(time.perf_counter() - start)
+            cpu_end = os.times()
+            cpu_times.append(cpu_end.children_user + cpu_end.children_system -
+                             cpu_start.children_user - cpu_start.children_system)
+        stages.append({'stage': f"{script} --help", 'wall_time': statistics.median(wall_times),
+                       'cpu_time': statistics.median(cpu_times), 'peak_rss_delta': 0, 'memory_out': 0})
+    return stages
+
+
+CASES = {
+    'geodata': run_geodata_case,
+    'pivot': run_pivot_case,
+    'startup': run_startup_case,
+}
+
+
+def run_case(suite, size):
+    with tempfile.TemporaryDirectory() as output_dir:
+        stages = CASES[suite](size, output_dir)
+    results = OrderedDict()
+    for stage in stages:
+        totals = results.setdefault(stage['stage'], {x: 0 for x in METRICS})
+        for metric in METRICS:
+            totals[metric] += stage[metric] or 0
+    results['total'] = {x: sum(r[x] for r in results.values()) if x != 'memory_out' else
+                        max([r[x] for r in results.values()] or [0]) for x in METRICS}
+    return results
+
+
+def run_isolated(suite, size):
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(run_case, (suite, size))
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    regressions = []
+    for case, stages in results.items():
+        for stage, metrics in stages.items():
+            expected = baseline.get(case, {}).get(stage)
+            if not expected:
+                continue
+            if metrics['wall_time'] > expected['wall_time'] * tolerance and \
+                    metrics['wall_time'] - expected['wall_time'] > min_seconds:
+                regressions.append(f"{case} / {stage}: wall time {metrics['wall_time']:.3f}s, "
+                                   f"baseline {expected['wall_time']:.3f}s")
+            if metrics['memory_out'] > expected['memory_out'] * tolerance:
+                regressions.append(f"{case} / {stage}: output memory {metrics['memory_out']}B, "
+                                   f"baseline {expected['memory_out']}B")
+    return regressions
+
+
+def print_results(results):
+    for case, stages in results.items():
+        print(f"\n{case}")
+        print(f"  {'stage':<45}{'wall [s]':>10}{'cpu [s]':>10}{'peak rss +[MB]':>16}{'output [MB]':>13}")
+        for stage, m in stages.items():
+            print(f"  {stage:<45}{m['wall_time']:>10.3f}{m['cpu_time']:>10.3f}"
+                  f"{m['peak_rss_delta'] / 2 ** 20:>16.1f}{m['memory_out'] / 2 ** 20:>13.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the ETL pipelines on synthetic data.')
+    parser.add_argument('-s', '--suite', choices=['geodata', 'pivot', 'startup', 'all'], default='all')
+    parser.add_argument('--sizes', default='small',
+                        help='comma separated list of sizes: small, medium, large')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline json file to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='allowed slowdown/growth factor against the baseline')
+    parser.add_argument('--min-seconds', type=float, default=0.1,
+                        help='ignore slowdowns smaller than this many seconds')
+    args = parser.parse_args()
+
+    suites = list(CASES) if args.suite == 'all' else [args.suite]
+    results = OrderedDict()
+    for suite in suites:
+        for size_name in args.sizes.split(','):
+            size = SIZES[suite][size_name]
+            print(f"Running {suite} benchmark with {size} {'runs' if suite == 'startup' else 'rows'}", file=sys.stderr)
+            results[f"{suite}-{size}"] = run_isolated(suite, size)
+    print_results(results)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        sys.exit(0)
+    regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+    if regressions:
+        print("\nPerformance regressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("\nNo regressions against the baseline.")
@@ -0,0 +1,133 @@
+"""Synthetic DHIS2-like fixtures at arbitrary scale for the benchmark suite."""
+import json
+import os
+import string
+
+import numpy as np
+import pandas as pd
+
+ID_CHARS = np.array(list(string.ascii_letters + string.digits))
+
+
+def dhis2_ids(n, rng):
+    """Generate `n` unique 11 character DHIS2 style uids."""
+    ids = pd.Series(dtype=object)
+    while len(ids) < n:
+        chars = ID_CHARS[rng.integers(0, len(ID_CHARS), size=(n - len(ids), 11))]
+        ids = pd.concat([ids, pd.Series(chars.view('<U11').ravel())]).drop_duplicates()
+    return ids.to_numpy()
+
+
+def level_sizes(n_org_units, areas_admin_level=2):
+    """Split `n_org_units` into one country, growing area levels and facilities at the bottom level."""
+    sizes = [1]
+    for level in range(1, areas_admin_level + 1):
+        sizes.append(max(sizes[-1] * 2, int(round(n_org_units ** (level / (areas_admin_level + 2))))))
+    sizes.append(max(0, n_org_units - sum(sizes)))
+    return sizes
+
+
+def generate_org_units(n_org_units, areas_admin_level=2, seed=0):
+    """Org unit hierarchy in the `organisationUnits.csv` format (featureType/coordinates) of DHIS2 2.29.
+
+    Areas are square polygons tiling the unit square scaled to a Sierra Leone sized box, every area
+    is split between children of the next level and facilities are points inside their parent area.
+    """
+    rng = np.random.default_rng(seed)
+    sizes = level_sizes(n_org_units, areas_admin_level)
+    ids = dhis2_ids(sum(sizes), rng)
+    frames = []
+    offset = 0
+    parent_paths = np.array([''])
+    parent_boxes = np.array([[-13.3, 6.9, -10.3, 10.0]])
+    for level, size in enumerate(sizes):
+        level_ids = ids[offset:offset + size]
+        offset += size
+        parent_index = np.sort(rng.integers(0, len(parent_paths), size=size)) if level else np.zeros(size, int)
+        paths = np.char.add(np.char.add(parent_paths[parent_index], '/'), level_ids.astype(str))
+        is_facility = level == len(sizes) - 1
+        boxes = _split_boxes(parent_boxes, parent_index)
+        if is_facility:
+            xs = rng.uniform(boxes[:, 0], boxes[:, 2])
+            ys = rng.uniform(boxes[:, 1], boxes[:, 3])
+            coordinates = [f"[{x:.4f},{y:.4f}]" for x, y in zip(xs, ys)]
+            feature_types = np.where(rng.random(size) < 0.5, 'POINT', 'NONE')
+            coordinates = np.where(feature_types == 'POINT', coordinates, None)
+        else:
+            coordinates = [_square(box) for box in boxes]
+            feature_types = np.full(size, 'POLYGON')
+        names = [f"{'Facility' if is_facility else 'Area'} {level}-{i}" for i in range(size)]
+        frames.append(pd.DataFrame({
+            'name': names,
+            'id': level_ids,
+            'shortName': names,
+            'path': paths,
+            'displayName': names,
+            'featureType': feature_types,
+            'coordinates': coordinates
+        }))
+        parent_paths = paths
+        parent_boxes = boxes
+    return pd.concat(frames, ignore_index=True).sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def _split_boxes(parent_boxes, parent_index):
+    """Split every parent box into vertical strips, one for each of its children."""
+    boxes = parent_boxes[parent_index].copy()
+    counts = np.bincount(parent_index, minlength=len(parent_boxes))[parent_index]
+    order = pd.Series(parent_index).groupby(parent_index).cumcount().to_numpy()
+    width = (boxes[:, 2] - boxes[:, 0]) / counts
+    boxes[:, 0] = boxes[:, 0] + width * order
+    boxes[:, 2] = boxes[:, 0] + width
+    return boxes
+
+
+def _square(box):
+    x0, y0, x1, y1 = box
+    return json.dumps([[[round(x0, 4), round(y0, 4)], [round(x1, 4), round(y0, 4)], [round(x1, 4), round(y1, 4)],
+                        [round(x0, 4), round(y1, 4)], [round(x0, 4), round(y0, 4)]]], separators=(',', ':'))
+
+
+def generate_pivot_table(n_rows, n_org_units=None, n_data_elements=4, n_category_combos=6,
+                         periods=('2018', '2019', '2020'), seed=0):
+    """Analytics `dataValues` frame with matching metadata frames and column/category configs."""
+    rng = np.random.default_rng(seed)
+    if n_org_units is None:
+        n_org_units = max(10, 2 * n_rows // (n_data_elements * n_category_combos * len(periods)))
+    de_ids = dhis2_ids(n_data_elements, rng)
+    cc_ids = dhis2_ids(n_category_combos, rng)
+    ou_ids = dhis2_ids(n_org_units, rng)
+    # sample distinct (dx, co, ou, pe) keys, as analytics returns one value per key
+    shape = (n_data_elements, len(periods), n_org_units, n_category_combos)
+    keys = rng.choice(int(np.prod(shape)), size=min(n_rows, int(np.prod(shape))), replace=False)
+    de_index, pe_index, ou_index, cc_index = np.unravel_index(keys, shape)
+    data_values = pd.DataFrame({
+        'dataElement': de_ids[de_index],
+        'period': np.array(periods)[pe_index],
+        'orgUnit': ou_ids[ou_index],
+        'categoryOptionCombo': cc_ids[cc_index],
+        'value': rng.integers(0, 1000, len(keys)).astype(str)
+    })
+    metadata = {
+        'category_combos': pd.DataFrame({'id': cc_ids, 'name': [f"Category {i}" for i in range(n_category_combos)]}),
+        'data_elements': pd.DataFrame({'id': de_ids, 'name': [f"Data element {i}" for i in range(n_data_elements)]}),
+        'org_units': pd.DataFrame({'id': ou_ids, 'name': [f"Org unit {i}" for i in range(n_org_units)]})
+    }
+    age_groups = ['15-24', '25-49', '50+']
+    category_config = [{'id': x, 'name': f"Category {i}",
+                        'mapping': {'age_group': age_groups[i % len(age_groups)], 'sex': ['male', 'female'][i % 2]}}
+                       for i, x in enumerate(cc_ids)]
+    column_config = [{'id': x, 'name': f"Data element {i}", 'mapping': ['anc_clients', 'anc_tested'][i % 2]}
+                     for i, x in enumerate(de_ids)]
+    return data_values, metadata, category_config, column_config
+
+
+def write_configs(output_dir, category_config, column_config):
+    os.makedirs(output_dir, exist_ok=True)
+    category_config_path = os.path.join(output_dir, 'category_config.json')
+    column_config_path = os.path.join(output_dir, 'column_config.json')
+    with open(category_config_path, 'w') as f:
+        json.dump(category_config, f)
+    with open(column_config_path, 'w') as f:
+        json.dump(column_config, f)
+    return category_config_path, column_config_path
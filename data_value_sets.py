@@ -0,0 +1,89 @@
+import pandas as pd
+
+import dhis2_schema
+import dhis2_periods
+
+# a raw data value is identified by these columns, requests of overlapping org unit roots or
+# periods return the same values more than once
+RAW_DATA_VALUE_KEY = ['dataElement', 'categoryOptionCombo', 'attributeOptionCombo', 'orgUnit', 'period']
+
+
+def get_resources(data_elements, org_unit_roots, periods):
+    """`dataValueSets` resources pulling raw values of `data_elements` under every root for every period.
+
+    One resource is made per (root, period), so large pulls are split into many smaller requests
+    that can be fetched concurrently.
+    """
+    data_element_params = '&'.join(f"dataElement={x}" for x in data_elements)
+    resources = []
+    for period in periods:
+        start_date, end_date = period_date_range(period)
+        for root in org_unit_roots:
+            resources.append(f"dataValueSets.json?{data_element_params}&orgUnit={root}&children=true&"
+                             f"startDate={start_date.isoformat()}&endDate={end_date.isoformat()}")
+    return resources
+
+
+def period_date_range(period):
+    """First and last day of a DHIS2 period id, e.g. `2019`, `201903`, `2019Q1`, `2019W12` or `2019April`."""
+    return dhis2_periods.date_range(period)
+
+
+def map_periods(raw_periods, periods):
+    """Frame of (raw period, requested period) pairs, a raw period belongs to every requested period containing it."""
+    requested = dhis2_periods.parse(periods)[['period', 'start', 'end']].rename(columns={'period': 'target'})
+    raw = dhis2_periods.parse(raw_periods)[['period', 'start', 'end']]
+    pairs = raw.merge(requested, how='cross', suffixes=('', '_target'))
+    contained = (pairs['start'] >= pairs['start_target']) & (pairs['end'] <= pairs['end_target'])
+    return pairs.loc[contained, ['period', 'target']].reset_index(drop=True)
+
+
+def hierarchy_roots(org_unit_paths):
+    """Ids of the org units with the shortest paths, the roots of the (sub)trees `org_unit_paths` holds.
+
+    Pickles of a subtree only have paths starting above their root, so roots aren't always at level 1.
+    """
+    depths = org_unit_paths.str.count('/')
+    return list(org_unit_paths[depths == depths.min()].index)
+
+
+def map_org_units(org_unit_paths, org_units, levels):
+    """Frame of (org unit, requested org unit) pairs for the `ou` dimension of a pivot table.
+
+    `org_unit_paths` is a Series of DHIS2 paths (`/root/.../id`) indexed by org unit id. Like in
+    analytics, without `levels` the requested org units are `org_units` themselves, with `levels`
+    they are the org units at those levels within `org_units` (or anywhere, if there are none).
+    """
+    segments = org_unit_paths.str.strip('/').str.split('/').explode()
+    ancestors = pd.DataFrame({'orgUnit': segments.index, 'target': segments.values})
+    ancestors['target_level'] = ancestors.groupby('orgUnit').cumcount() + 1
+    if not levels:
+        pairs = ancestors[ancestors['target'].isin(org_units)]
+    else:
+        if org_units:
+            within_roots = ancestors.loc[ancestors['target'].isin(org_units), 'orgUnit'].unique()
+            ancestors = ancestors[ancestors['orgUnit'].isin(within_roots)]
+        pairs = ancestors[ancestors['target_level'].isin(levels)]
+    return pairs[['orgUnit', 'target']].drop_duplicates().reset_index(drop=True)
+
+
+def aggregate_data_values(data_values, org_unit_paths, org_units, levels, periods):
+    """Sum raw `dataValueSets` values up to the org units and periods an analytics pull would return.
+
+    Values are summed, the aggregation type the program data tables use. Non numeric values are
+    dropped, as analytics does. The result has the columns of analytics `dataValues` the pivot
+    pipeline uses.
+    """
+    columns = ['dataElement', 'categoryOptionCombo', 'orgUnit', 'period', 'value']
+    if data_values.empty:
+        return pd.DataFrame(columns=columns)
+    df = data_values.drop_duplicates(subset=[x for x in RAW_DATA_VALUE_KEY if x in data_values])
+    df = df[columns].astype({'orgUnit': object, 'period': object})
+    df['value'] = pd.to_numeric(df['value'], errors='coerce')
+    df = df.dropna(subset=['value'])
+    df = df.merge(map_org_units(org_unit_paths, org_units, levels), on='orgUnit')
+    df = df.drop(columns='orgUnit').rename(columns={'target': 'orgUnit'})
+    df = df.merge(map_periods(df['period'].unique(), periods), on='period')
+    df = df.drop(columns='period').rename(columns={'target': 'period'})
+    df = df.groupby(['dataElement', 'categoryOptionCombo', 'orgUnit', 'period'], observed=True)['value'].sum()
+    return dhis2_schema.compact_data_values(df.reset_index()[columns])
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+import etl
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+
+import credentials
+import metrics
+from http_cache import HTTPCache
+
+logger = logging.getLogger(__name__)
+logger.setLevel("INFO")
+
+DEFAULT_TIMEOUT = 300
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 1
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_CONCURRENCY = 4
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+RequestStats = namedtuple('RequestStats', ['url', 'status_code', 'elapsed', 'bytes', 'retries'])
+
+_clients = {}
+
+
+class DHIS2Client:
+    """Shared HTTP client for DHIS2 API calls.
+
+    Keeps a keep-alive connection pool, asks for gzip compressed responses, retries failed
+    requests with exponential backoff and optionally limits the number of requests per second.
+    With an `HTTPCache` set as `cache` responses are revalidated instead of downloaded again.
+    Timing of every request is kept in `stats`.
+    """
+
+    def __init__(self, base_url, username, password, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR, rate_limit=None, pool_size=DEFAULT_POOL_SIZE, cache=None):
+        self.base_url = base_url
+        self.username = username
+        self.cache = cache
+        self.timeout = timeout
+        self.min_interval = 1 / rate_limit if rate_limit else 0
+        self.stats = []
+        self._lock = threading.Lock()
+        self._rate_limit_lock = threading.Lock()
+        self._last_request_time = 0
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(username, password)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+                      allowed_methods=frozenset(['GET']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, resource, conditional=True, **kwargs) -> requests.Response:
+        url = urljoin(self.base_url, resource)
+        cache = self.cache
+        request_kwargs = dict(kwargs)
+        if cache and conditional:
+            kwargs['headers'] = {**cache.conditional_headers(url), **kwargs.get('headers', {})}
+        self._wait_for_rate_limit()
+        start = time.perf_counter()
+        metrics.inc('dhis2_etl_http_requests_in_flight', host=urlsplit(url).netloc)
+        try:
+            r = self.session.get(url, timeout=kwargs.pop('timeout', self.timeout), **kwargs)
+        finally:
+            metrics.inc('dhis2_etl_http_requests_in_flight', -1, host=urlsplit(url).netloc)
+        elapsed = time.perf_counter() - start
+        retries = getattr(r.raw, 'retries', None)
+        stats = RequestStats(url, r.status_code, elapsed, len(r.content), len(retries.history) if retries else 0)
+        with self._lock:
+            self.stats.append(stats)
+        metrics.observe_request(url, r.status_code, elapsed, stats.bytes, stats.retries)
+        logger.debug(f"GET {url} {r.status_code} {elapsed:.2f}s {stats.bytes}B")
+        if cache and r.status_code == 304:
+            cached = cache.cached_response(url, r)
+            if cached is not None:
+                return cached
+            if conditional:
+                # the entry was removed or broken since the conditional headers were read
+                logger.warning(f"Cached response of {url} is missing or unreadable, requesting it again")
+                return self.get(resource, conditional=False, **request_kwargs)
+        etl.requests_util.check_if_response_is_ok(r)
+        if cache:
+            cache.store(url, r)
+        return r
+
+    def _wait_for_rate_limit(self):
+        if not self.min_interval:
+            return
+        with self._rate_limit_lock:
+            wait = self._last_request_time + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_request_time = time.monotonic()
+
+    def log_stats(self, log=logger):
+        if not self.stats:
+            return
+        total_time = sum(x.elapsed for x in self.stats)
+        total_bytes = sum(x.bytes for x in self.stats)
+        total_retries = sum(x.retries for x in self.stats)
+        not_modified = sum(x.status_code == 304 for x in self.stats)
+        log.info(f"DHIS2 requests: {len(self.stats)}, time: {total_time:.2f}s, downloaded: {total_bytes}B, "
+                 f"retries: {total_retries}, not modified: {not_modified}")
+        for stats in sorted(self.stats, key=lambda x: x.elapsed, reverse=True)[:5]:
+            log.info(f"  {stats.elapsed:.2f}s {stats.bytes}B {stats.url}")
+
+
+class AsyncDHIS2Client:
+    """asyncio interface to a DHIS2Client.
+
+    Requests are run on a thread pool sharing the client's connection pool, so independent
+    requests overlap while at most `max_concurrency` of them hit the server at the same time.
+    Must be used from within a running event loop, see `run_async`.
+    """
+
+    def __init__(self, client: DHIS2Client, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='dhis2')
+
+    async def get(self, resource, **kwargs) -> requests.Response:
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, lambda: self.client.get(resource, **kwargs))
+
+    async def get_many(self, resources, task=None):
+        """Responses of `resources` in order, with the progress reported as `task` if it's given."""
+        if not task:
+            return await asyncio.gather(*[self.get(resource) for resource in resources])
+        progress = metrics.progress(task, len(resources), 'requests')
+
+        async def get(resource):
+            r = await self.get(resource)
+            progress.advance()
+            return r
+        return await asyncio.gather(*[get(resource) for resource in resources])
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def run_async(main, client=None, max_concurrency=None):
+    """Run coroutine function `main(async_client)` to completion and return its result.
+
+    Concurrency defaults to `DHIS2_MAX_CONCURRENCY` from the environment.
+    """
+    if max_concurrency is None:
+        max_concurrency = int(os.environ.get("DHIS2_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+
+    async def _run():
+        async_client = AsyncDHIS2Client(client or get_client(), max_concurrency)
+        try:
+            return await main(async_client)
+        finally:
+            async_client.close()
+    return asyncio.run(_run())
+
+
+def get_many(resources, client=None, max_concurrency=None, task=None):
+    """Fetch independent resources concurrently, responses are returned in the order of `resources`."""
+    return run_async(lambda async_client: async_client.get_many(resources, task), client, max_concurrency)
+
+
+def get_client(cache_dir=None) -> DHIS2Client:
+    """Get a DHIS2 client configured from the environment, shared by all callers with the same config.
+
+    Besides `DHIS2_URL` and the credentials, the client can be tuned with `DHIS2_TIMEOUT` (seconds),
+    `DHIS2_RETRIES`, `DHIS2_BACKOFF_FACTOR`, `DHIS2_RATE_LIMIT` (requests per second) and `DHIS2_POOL_SIZE`.
+    Responses are cached in `cache_dir` unless `DHIS2_HTTP_CACHE` is set to false.
+    """
+    dhis2_url = os.environ.get("DHIS2_URL")
+    credentials.read_credentials(os.environ.get("DHIS2_CREDENTIALS_FILE"))
+    username = os.environ.get("DHIS2_USERNAME")
+    password = os.environ.get("DHIS2_PASSWORD")
+    key = (dhis2_url, username)
+    if key not in _clients:
+        rate_limit = os.environ.get("DHIS2_RATE_LIMIT")
+        _clients[key] = DHIS2Client(
+            dhis2_url, username, password,
+            timeout=float(os.environ.get("DHIS2_TIMEOUT", DEFAULT_TIMEOUT)),
+            retries=int(os.environ.get("DHIS2_RETRIES", DEFAULT_RETRIES)),
+            backoff_factor=float(os.environ.get("DHIS2_BACKOFF_FACTOR", DEFAULT_BACKOFF_FACTOR)),
+            rate_limit=float(rate_limit) if rate_limit else None,
+            pool_size=int(os.environ.get("DHIS2_POOL_SIZE", DEFAULT_POOL_SIZE))
+        )
+    client = _clients[key]
+    cache_enabled = os.environ.get("DHIS2_HTTP_CACHE", "true").lower() not in ("false", "0", "no")
+    if cache_dir and cache_enabled and (client.cache is None or client.cache.cache_dir != cache_dir):
+        client.cache = HTTPCache(cache_dir, namespace=username or '')
+    return client
+
+
+def log_stats(log=logger):
+    for client in _clients.values():
+        client.log_stats(log)
+
+
+def clients():
+    return list(_clients.values())
+
+
+def reset_stats():
+    for client in _clients.values():
+        with client._lock:
+            client.stats.clear()
@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+
+import dhis2_schema
+
+FINANCIAL_YEAR_START_MONTHS = {'April': 4, 'July': 7, 'Oct': 10, 'Nov': 11}
+# output column of the periods rolled up to each supported period type
+ROLL_UP_COLUMNS = {
+    'Monthly': 'month',
+    'Quarterly': 'quarter',
+    'SixMonthly': 'six_month',
+    'Yearly': 'year',
+    **{f"Financial{x}": 'financial_year' for x in FINANCIAL_YEAR_START_MONTHS},
+}
+# period types pulls can be split into, each is a whole number of months
+SPLIT_PERIOD_TYPES = ('Monthly', 'Quarterly', 'SixMonthly')
+# weeks don't line up with months, they go to the period holding most of their days
+WEEK_PERIOD_TYPES = ('Weekly', 'BiWeekly')
+
+PERIOD_PATTERN = (r'^(?P<year>\d{4})(?:'
+                  r'(?P<month>\d{2})(?:(?P<day>\d{2})|(?P<bi_month>B))?'
+                  r'|Q(?P<quarter>\d)|S(?P<half>\d)|W(?P<week>\d{1,2})|BiW(?P<bi_week>\d{1,2})'
+                  rf"|(?P<financial>{'|'.join(FINANCIAL_YEAR_START_MONTHS)})"
+                  r')?$')
+
+
+def parse(period_ids) -> pd.DataFrame:
+    """Typed columns of DHIS2 period ids: `period_type`, `year` and the `start` and `end` days.
+
+    Daily, weekly, bi-weekly, monthly, bi-monthly, quarterly, six-monthly, yearly and financial year ids
+    are parsed in one vectorized pass, e.g. `20190315`, `2019W12`, `2019BiW6`, `201903`, `201902B`,
+    `2019Q1`, `2019S1`, `2019` or `2019April`. `year` is the year of the id: the ISO week year of
+    weeks and the first year of financial years. Other ids, like relative periods, raise a ValueError.
+    """
+    ids = pd.Series(period_ids, dtype=object).astype(str).reset_index(drop=True)
+    parts = ids.str.extract(PERIOD_PATTERN)
+    year, month, day, quarter, half, week, bi_week = (
+        pd.to_numeric(parts[x]).to_numpy(dtype=float)
+        for x in ('year', 'month', 'day', 'quarter', 'half', 'week', 'bi_week'))
+    financial_month = parts['financial'].map(FINANCIAL_YEAR_START_MONTHS).to_numpy(dtype=float)
+    is_bi_monthly = parts['bi_month'].notna().to_numpy()
+    conditions = [~np.isnan(day), is_bi_monthly, ~np.isnan(month), ~np.isnan(quarter), ~np.isnan(half),
+                  ~np.isnan(week), ~np.isnan(bi_week), ~np.isnan(financial_month), ~np.isnan(year)]
+    financial_types = ('Financial' + parts['financial'].fillna('')).to_numpy()
+    period_type = np.select(conditions, ['Daily', 'BiMonthly', 'Monthly', 'Quarterly', 'SixMonthly', 'Weekly',
+                                         'BiWeekly', financial_types, 'Yearly'], '')
+
+    # everything but weeks is a range of whole months
+    first_month = np.select(conditions, [month, 2 * month - 1, month, 3 * quarter - 2, 6 * half - 5, np.nan, np.nan,
+                                         financial_month, 1], np.nan)
+    months_count = np.select(conditions, [1, 2, 1, 3, 6, np.nan, np.nan, 12, 12], np.nan)
+    in_year = (first_month >= 1) & (first_month + months_count <= 13)
+    valid = in_year | (period_type == 'Weekly') | (period_type == 'BiWeekly') | np.char.startswith(
+        period_type.astype(str), 'Financial')
+    by_months = valid & ~np.isnan(first_month)
+    start = np.full(len(ids), np.datetime64('NaT'), dtype='datetime64[D]')
+    end = start.copy()
+    months = ((year - 1970) * 12 + first_month - 1)[by_months].astype(int)
+    next_months = months + months_count[by_months].astype(int)
+    start[by_months] = months.astype('datetime64[M]').astype('datetime64[D]')
+    end[by_months] = next_months.astype('datetime64[M]').astype('datetime64[D]') - 1
+
+    is_daily = period_type == 'Daily'
+    days_in_month = (end - start).astype(int) + 1
+    valid &= ~is_daily | ((day >= 1) & (day <= np.where(by_months, days_in_month, 0)))
+    daily = valid & is_daily
+    start[daily] += (day[daily] - 1).astype(int)
+    end[daily] = start[daily]
+
+    # ISO weeks, the first one holds the 4th of January
+    weekly = (period_type == 'Weekly') | (period_type == 'BiWeekly')
+    week_number = np.where(period_type == 'BiWeekly', 2 * bi_week - 1, week)[weekly]
+    first_monday = _first_iso_monday(year[weekly])
+    weeks_in_year = (_first_iso_monday(year[weekly] + 1) - first_monday).astype(int) // 7
+    valid_week = (week_number >= 1) & (week_number <= weeks_in_year)
+    valid[weekly] = valid_week
+    week_start = first_monday + (7 * (np.nan_to_num(week_number) - 1)).astype(int)
+    start[weekly] = np.where(valid_week, week_start, np.datetime64('NaT'))
+    end[weekly] = np.where(valid_week, week_start + np.where(period_type[weekly] == 'BiWeekly', 13, 6),
+                           np.datetime64('NaT'))
+
+    invalid = ['"' + x + '"' for x in ids[~valid | (period_type == '')].drop_duplicates()]
+    if invalid:
+        raise ValueError(f"Unsupported DHIS2 period{'s' if len(invalid) > 1 else ''} {', '.join(invalid)}")
+    return pd.DataFrame({'period': ids, 'period_type': period_type, 'year': year.astype(int),
+                         'start': start.astype('datetime64[ns]'), 'end': end.astype('datetime64[ns]')})
+
+
+def date_range(period):
+    """First and last day of a DHIS2 period id, see `parse`."""
+    parsed = parse([period]).iloc[0]
+    return parsed['start'].date(), parsed['end'].date()
+
+
+def latest(period_ids, count):
+    """The `count` periods of `period_ids` starting last, in chronological order.
+
+    Ids don't sort by date as strings, e.g. `2019W9` comes after `2019W10`, so they are ordered by their start day.
+    """
+    if count <= 0:
+        return []
+    parsed = parse(period_ids).sort_values(['start', 'end'], kind='stable')
+    return list(parsed['period'].iloc[-count:])
+
+
+def roll_up(periods: pd.Series, period_type) -> pd.Series:
+    """Ids of the `period_type` periods the DHIS2 `periods` fall into, computed once per distinct period.
+
+    `Yearly` keeps the year of the ids, as DHIS2 labels weeks and financial years. For the other period
+    types periods have to fit in one target period, except weeks, which go to the period holding their
+    middle day, the Thursday for weeks like with ISO week years.
+    """
+    periods = dhis2_schema.to_categorical(periods)
+    categories = periods.cat.categories
+    targets = _target_periods(parse(categories), period_type)
+    return dhis2_schema.replace_values(periods, pd.Series(targets.to_numpy(), index=categories))
+
+
+def split(period_ids, period_type):
+    """`period_ids` with the periods longer than `period_type` split into the `period_type` periods making them up.
+
+    E.g. `2019` split into `Quarterly` periods is `2019Q1` to `2019Q4`. Shorter periods are kept. Used to
+    pull the finest granularity once and roll it up to every output locally. Raises a ValueError if a
+    period isn't made of whole `period_type` periods, like `2019Nov` of quarters.
+    """
+    if period_type not in SPLIT_PERIOD_TYPES:
+        raise ValueError(f"Can't split periods into \"{period_type}\" periods, "
+                         f"use one of {', '.join(SPLIT_PERIOD_TYPES)}")
+    parsed = parse(period_ids)
+    targets = _target_periods(parsed, period_type, check=False)
+    target_ranges = parse(targets)
+    fits = (parsed['period_type'].isin(WEEK_PERIOD_TYPES) |
+            ((parsed['start'] >= target_ranges['start']) & (parsed['end'] <= target_ranges['end'])))
+    split_ids = []
+    for period, fit, start, end in zip(parsed['period'], fits, parsed['start'], parsed['end']):
+        if fit:
+            split_ids.append(period)
+            continue
+        months = pd.Series(pd.period_range(start, end, freq='M').strftime('%Y%m'))
+        parts = list(_target_periods(parse(months), period_type, check=False).drop_duplicates())
+        ranges = parse(parts)
+        if ranges['start'].iloc[0] != start or ranges['end'].iloc[-1] != end:
+            raise ValueError(f"Period \"{period}\" isn't made of whole {period_type} periods")
+        split_ids += parts
+    return list(dict.fromkeys(split_ids))
+
+
+def _target_periods(parsed: pd.DataFrame, period_type, check=True) -> pd.Series:
+    if period_type not in ROLL_UP_COLUMNS:
+        raise ValueError(f"Unsupported period type \"{period_type}\", use one of {', '.join(ROLL_UP_COLUMNS)}")
+    if period_type == 'Yearly':
+        return parsed['year'].astype(str)
+    middle = parsed['start'] + (parsed['end'] - parsed['start']) / 2
+    year, month = middle.dt.year, middle.dt.month
+    if period_type == 'Monthly':
+        targets = year.astype(str) + month.astype(str).str.zfill(2)
+    elif period_type == 'Quarterly':
+        targets = year.astype(str) + 'Q' + ((month - 1) // 3 + 1).astype(str)
+    elif period_type == 'SixMonthly':
+        targets = year.astype(str) + 'S' + ((month - 1) // 6 + 1).astype(str)
+    else:
+        name = period_type[len('Financial'):]
+        targets = (year - (month < FINANCIAL_YEAR_START_MONTHS[name])).astype(str) + name
+    if check:
+        target_ranges = parse(targets)
+        straddling = (~parsed['period_type'].isin(WEEK_PERIOD_TYPES) &
+                      ((parsed['start'] < target_ranges['start']) | (parsed['end'] > target_ranges['end'])))
+        if straddling.any():
+            straddling_ids = ', '.join('"' + x + '"' for x in parsed.loc[straddling, 'period'])
+            raise ValueError(f"Periods {straddling_ids} don't fit in {period_type} periods, pull finer periods")
+    return targets
+
+
+def _first_iso_monday(year):
+    january_4th = ((year - 1970) * 12).astype(int).astype('datetime64[M]').astype('datetime64[D]') + 3
+    # 1970-01-01 was a Thursday
+    weekday = (january_4th.astype(int) + 3) % 7
+    return january_4th - weekday
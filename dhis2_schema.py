@@ -0,0 +1,73 @@
+import pandas as pd
+
+# ids repeat across millions of data values, so they are held as categoricals (integer codes + distinct values)
+DATA_VALUE_CATEGORICAL_COLUMNS = ['dataElement', 'categoryOptionCombo', 'orgUnit', 'period',
+                                  'attributeOptionCombo', 'storedBy', 'created', 'lastUpdated', 'comment']
+ORG_UNIT_CATEGORICAL_COLUMNS = ['featureType']
+
+
+def compact_data_values(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert analytics/dataValueSets `dataValues` to the compact schema used by the pivot pipeline.
+
+    Repeated id columns become categoricals and `value` is parsed to a number once. Applying it
+    to an already compact frame is a no-op.
+    """
+    for column in DATA_VALUE_CATEGORICAL_COLUMNS:
+        if column in df:
+            df[column] = to_categorical(df[column])
+    if 'value' in df and not pd.api.types.is_numeric_dtype(df['value']):
+        df['value'] = pd.to_numeric(df['value'], errors='coerce')
+    return df
+
+
+def compact_org_units(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert low cardinality columns of the org units frame to categoricals.
+
+    `id`, `path` and the geometry columns are unique per org unit, a categorical would only add codes to them.
+    """
+    for column in ORG_UNIT_CATEGORICAL_COLUMNS:
+        if column in df:
+            df[column] = to_categorical(df[column])
+    return df
+
+
+def to_categorical(series: pd.Series) -> pd.Series:
+    """Categorical with lexically sorted categories, so sorting by codes matches sorting by values."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    return series.astype('category')
+
+
+def add_categories(series: pd.Series, values) -> pd.Series:
+    """`series` with `values` added to its categories, still lexically sorted. Other dtypes are returned as they are."""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    return series.cat.set_categories(sorted(set(series.cat.categories) | set(values)))
+
+
+def replace_values(series: pd.Series, mapping: pd.Series) -> pd.Series:
+    """Categorical equivalent of `series.replace(mapping)`, values missing from `mapping` are kept.
+
+    The mapping is evaluated once per distinct value instead of once per row.
+    """
+    series = to_categorical(series)
+    lookup = mapping[~mapping.index.duplicated(keep='last')]
+    categories = series.cat.categories.to_series(index=range(len(series.cat.categories)))
+    new_values = categories.map(lookup).fillna(categories)
+    new_codes, new_categories = pd.factorize(new_values, sort=True)
+    codes = series.cat.codes.to_numpy()
+    mapped_codes = new_codes[codes]
+    mapped_codes[codes == -1] = -1
+    return pd.Series(pd.Categorical.from_codes(mapped_codes, categories=new_categories),
+                     index=series.index, name=series.name)
+
+
+def fillna(df: pd.DataFrame, columns, value='') -> pd.DataFrame:
+    """`df[columns].fillna(value)` that also works for categorical columns."""
+    for column in columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            if df[column].isna().any():
+                df[column] = df[column].astype(object).fillna(value).astype('category')
+        else:
+            df[column] = df[column].fillna(value)
+    return df
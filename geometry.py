@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import json
+import os
+import warnings
+
+from lazy_import import lazy_module
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+
+def area_shapes(df: pd.DataFrame) -> pd.DataFrame:
+    """Shapely geometries of the areas in `df` with a polygon, as columns `id`, `admin_level` and `shape`.
+
+    Geometries come from the `geoshape` and `featureType` columns, or from the `geojson` column of WKT
+    pulls. Areas without a (parsable) polygon are left out.
+    """
+    import shapely.geometry
+
+    shapes = []
+    for area in df.itertuples(index=False):
+        try:
+            if 'geoshape' in df:
+                if not isinstance(area.geoshape, list) or not len(area.geoshape):
+                    continue
+                geometry = {'type': 'MultiPolygon' if area.featureType == 'MULTI_POLYGON' else 'Polygon',
+                            'coordinates': area.geoshape}
+            elif 'geojson' in df and isinstance(area.geojson, str) and area.geojson:
+                geometry = json.loads(area.geojson)['geometry']
+            else:
+                continue
+            shape = shapely.geometry.shape(geometry)
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError):
+            continue
+        if shape.is_empty or shape.geom_type not in ('Polygon', 'MultiPolygon'):
+            continue
+        if not shape.is_valid:
+            # prepared predicates fail on self-intersections, buffer(0) fixes most of them
+            shape = shape.buffer(0)
+        shapes.append((area.id, area.admin_level, shape))
+    # filled in one by one, pandas would otherwise iterate over the parts of multipolygons
+    shape_column = np.empty(len(shapes), dtype=object)
+    for i, (_, _, shape) in enumerate(shapes):
+        shape_column[i] = shape
+    return pd.DataFrame({'id': [x[0] for x in shapes], 'admin_level': [x[1] for x in shapes], 'shape': shape_column})
+
+
+def containing_areas(shapes: pd.DataFrame, x, y, levels, preferred=None):
+    """Id of the area at `levels[i]` whose polygon contains the point (`x[i]`, `y[i]`), '' if there is none.
+
+    Points are sorted by x once, so each polygon is only tested against the points within its bounding
+    box, with `shapely.vectorized.contains` on a prepared geometry. Where polygons overlap, the area in
+    `preferred` (e.g. the current parent) wins over other containing areas.
+    """
+    from shapely.vectorized import contains
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    levels = np.asarray(levels)
+    preferred = np.asarray(preferred if preferred is not None else [''] * len(x), dtype=object)
+    result = np.full(len(x), '', dtype=object)
+    order = np.argsort(x, kind='stable')
+    sorted_x = x[order]
+    for area_id, admin_level, shape in shapes.itertuples(index=False):
+        min_x, min_y, max_x, max_y = shape.bounds
+        candidates = order[np.searchsorted(sorted_x, min_x, side='left'):np.searchsorted(sorted_x, max_x, side='right')]
+        candidates = candidates[(y[candidates] >= min_y) & (y[candidates] <= max_y) & (levels[candidates] == admin_level)]
+        if not len(candidates):
+            continue
+        hits = candidates[contains(shape, x[candidates], y[candidates])]
+        hits = hits[(result[hits] == '') | (preferred[hits] == area_id)]
+        result[hits] = area_id
+    return result
+
+
+ISSUE_COLUMNS = ['area_id', 'issue', 'detail', 'other_area_id', 'size']
+DEFAULT_SLIVER_TOLERANCE = 0.001
+# below this many areas starting worker processes takes longer than checking the areas
+MIN_AREAS_PER_POOL = 500
+
+
+def validate_areas(areas, repair=False, workers=None, tolerance=DEFAULT_SLIVER_TOLERANCE):
+    """Check area geometries and the way sibling areas fit together.
+
+    `areas` are tuples of (id, parent id, GeoJSON geometry). Every geometry is checked for unclosed and
+    too short rings and validity, and is made valid with `make_valid`. Siblings are then checked for
+    overlaps, and for gaps within their parent's polygon, larger than `tolerance` of the smaller area.
+    Both steps run on a pool of `workers` processes.
+
+    Returns a DataFrame of issues (`ISSUE_COLUMNS`) and a dict of repaired GeoJSON geometries, which
+    are valid, with closed rings and counterclockwise exterior rings, of the areas with `repair`.
+    """
+    checked = _map(_check_area, [(x[0], x[2], repair) for x in areas], workers)
+    issues = [issue for area_issues, _, _ in checked for issue in area_issues]
+    repaired = {area[0]: geometry for area, (_, _, geometry) in zip(areas, checked) if geometry is not None}
+    shapes = {area[0]: wkb for area, (_, wkb, _) in zip(areas, checked) if wkb is not None}
+    siblings = {}
+    for area_id, parent_id, _ in areas:
+        if area_id in shapes and parent_id != area_id:
+            siblings.setdefault(parent_id, []).append((area_id, shapes[area_id]))
+    groups = [(parent_id, shapes.get(parent_id), children, tolerance) for parent_id, children in siblings.items()]
+    issues += [issue for group_issues in _map(_check_siblings, groups, workers) for issue in group_issues]
+    return pd.DataFrame(issues, columns=ISSUE_COLUMNS), repaired
+
+
+def _check_area(args):
+    import shapely.geometry
+    import shapely.validation
+
+    area_id, geometry, repair = args
+    issues = []
+    for ring in _rings(geometry):
+        if len(ring) and list(ring[0]) != list(ring[-1]):
+            issues.append((area_id, 'unclosed ring', f"ring of {len(ring)} points starting at {ring[0]}", '', None))
+            ring = list(ring) + [ring[0]]
+        if len(ring) < 4:
+            issues.append((area_id, 'too few points', f"ring of {len(ring)} points", '', None))
+    try:
+        shape = shapely.geometry.shape({'type': geometry['type'], 'coordinates': _close_rings(geometry)})
+    except (ValueError, TypeError, KeyError, IndexError, AttributeError) as e:
+        issues.append((area_id, 'unparsable', str(e), '', None))
+        return issues, None, None
+    if not shape.is_valid:
+        issues.append((area_id, 'invalid', shapely.validation.explain_validity(shape), '', None))
+        shape = _polygonal(shapely.validation.make_valid(shape))
+    if shape.is_empty:
+        return issues, None, None
+    repaired = None
+    if repair:
+        repaired = json.loads(json.dumps(shapely.geometry.mapping(_orient(shape))))
+    return issues, shape.wkb, repaired
+
+
+def _check_siblings(args):
+    import shapely.errors
+    import shapely.ops
+    import shapely.wkb
+    from shapely.strtree import STRtree
+
+    parent_id, parent_wkb, children, tolerance = args
+    issues = []
+    shapes = [shapely.wkb.loads(wkb) for _, wkb in children]
+    ids = [area_id for area_id, _ in children]
+    positions = {id(x): i for i, x in enumerate(shapes)}
+    with warnings.catch_warnings():
+        # shapely 1.8 warns about the API changes of STRtree in 2.0, `query` works in both
+        warnings.simplefilter('ignore', shapely.errors.ShapelyDeprecationWarning)
+        tree = STRtree(shapes)
+    for i, shape in enumerate(shapes):
+        for j in (positions[id(x)] for x in tree.query(shape)):
+            if j <= i or not shape.intersects(shapes[j]):
+                continue
+            overlap = shape.intersection(shapes[j]).area
+            if overlap > tolerance * min(shape.area, shapes[j].area):
+                issues.append((ids[i], 'overlap', f"overlaps {overlap / shape.area:.2%} of the area", ids[j], overlap))
+    if parent_wkb is not None:
+        parent = shapely.wkb.loads(parent_wkb)
+        gap = parent.difference(shapely.ops.unary_union(shapes)).area
+        if gap > tolerance * parent.area:
+            issues.append((parent_id, 'gap', f"{gap / parent.area:.2%} of the area isn't covered by its children",
+                           '', gap))
+    return issues
+
+
+def _map(f, items, workers):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    # pool workers (e.g. of run_all.py) are daemons, which can't start processes of their own
+    if workers == 1 or len(items) < MIN_AREAS_PER_POOL or multiprocessing.current_process().daemon:
+        return [f(x) for x in items]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(f, items, chunksize=max(1, len(items) // (workers * 4))))
+
+
+def _rings(geometry):
+    coordinates = geometry.get('coordinates') or []
+    polygons = coordinates if geometry.get('type') == 'MultiPolygon' else [coordinates]
+    return [ring for polygon in polygons for ring in polygon]
+
+
+def _close_rings(geometry):
+    def close(ring):
+        return list(ring) + [ring[0]] if len(ring) and list(ring[0]) != list(ring[-1]) else ring
+    coordinates = geometry.get('coordinates') or []
+    if geometry.get('type') == 'MultiPolygon':
+        return [[close(ring) for ring in polygon] for polygon in coordinates]
+    return [close(ring) for ring in coordinates]
+
+
+def _polygonal(shape):
+    """Polygons of the result of `make_valid`, which can also hold lines and points of collapsed parts."""
+    import shapely.geometry
+
+    if shape.geom_type in ('Polygon', 'MultiPolygon'):
+        return shape
+    polygons = []
+    for part in getattr(shape, 'geoms', []):
+        if part.geom_type == 'Polygon':
+            polygons.append(part)
+        elif part.geom_type == 'MultiPolygon':
+            polygons.extend(part.geoms)
+    return shapely.geometry.MultiPolygon(polygons)
+
+
+def _orient(shape):
+    import shapely.geometry
+    from shapely.geometry.polygon import orient
+
+    if shape.geom_type == 'Polygon':
+        return orient(shape, sign=1.0)
+    return shapely.geometry.MultiPolygon([orient(x, sign=1.0) for x in shape.geoms])
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import threading
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# headers describing the transfer rather than the content, bodies are stored decompressed
+SKIPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection', 'keep-alive'}
+
+
+class HTTPCache:
+    """On-disk cache of GET responses revalidated with ETag / Last-Modified.
+
+    Entries are keyed by the full URL (including the query string) and the user, every entry
+    is a `<key>.json` file with the validators and headers next to a `<key>.body` file.
+    """
+
+    def __init__(self, cache_dir, namespace=''):
+        self.cache_dir = cache_dir
+        self.namespace = namespace
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def conditional_headers(self, url) -> dict:
+        meta = self._load_meta(url)
+        if meta is None:
+            return {}
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def store(self, url, response: requests.Response):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status_code != 200 or not (etag or last_modified):
+            return
+        meta = {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'encoding': response.encoding,
+            'headers': {k: v for k, v in response.headers.items() if k.lower() not in SKIPPED_HEADERS}
+        }
+        path = self._path(url)
+        # write the body first and replace atomically, so concurrent readers never see half an entry
+        self._write_atomic(f"{path}.body", response.content)
+        self._write_atomic(f"{path}.json", json.dumps(meta).encode())
+
+    def cached_response(self, url, not_modified_response: requests.Response):
+        """The cached response of `url` for a 304 response, or None if the entry is gone or unreadable."""
+        meta = self._load_meta(url)
+        if meta is None:
+            return None
+        try:
+            with open(f"{self._path(url)}.body", 'rb') as f:
+                content = f.read()
+        except OSError:
+            return None
+        response = requests.Response()
+        response.status_code = 200
+        response._content = content
+        response.headers = CaseInsensitiveDict(meta['headers'])
+        response.encoding = meta['encoding']
+        response.url = url
+        response.raw = not_modified_response.raw
+        response.request = not_modified_response.request
+        response.elapsed = not_modified_response.elapsed
+        return response
+
+    def _load_meta(self, url):
+        path = self._path(url)
+        if not (os.path.exists(f"{path}.json") and os.path.exists(f"{path}.body")):
+            return None
+        try:
+            with open(f"{path}.json") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if isinstance(meta, dict) and 'headers' in meta else None
+
+    def _path(self, url):
+        key = hashlib.sha256(f"{self.namespace}:{url}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, key)
+
+    @staticmethod
+    def _write_atomic(path, content):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
@@ -0,0 +1,36 @@
+import importlib.util
+import sys
+
+
+def lazy_module(name):
+    """Module `name`, imported only when one of its attributes is first used.
+
+    Importing pandas, shapely or etl (which sets up boto3, SQLAlchemy and CloudWatch logging) takes
+    a large part of a small run, this keeps them off code paths that don't need them, e.g. `--help`.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+class LazyLogger:
+    """etl logger that is created, and etl imported, on first use."""
+
+    def __init__(self, log_name, log_group):
+        self.log_name = log_name
+        self.log_group = log_group
+        self._logger = None
+
+    def __getattr__(self, name):
+        if self._logger is None:
+            etl = importlib.import_module('etl')
+            self._logger = etl.logging.get_logger(log_name=self.log_name, log_group=self.log_group)
+        return getattr(self._logger, name)
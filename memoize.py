@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import logging
+import os
+import pickle
+import sys
+
+from lazy_import import lazy_module
+
+pd = lazy_module('pandas')
+
+logger = logging.getLogger(__name__)
+logger.setLevel("INFO")
+
+DEFAULT_MAX_SIZE_MB = 1024
+
+# directory of cached stage outputs, set by the ETLs per output dir; memoization is off while it's None
+cache_dir = None
+_code_version = None
+
+
+def stage(config=None):
+    """Memoize a pure `DataFrame -> DataFrame` stage on disk.
+
+    Outputs are keyed by a hash of the input frame, a hash of `config()`, which should return
+    everything else the stage reads (globals, metadata frames, file hashes), and the code version,
+    a hash of the sources of all local modules. Set `MEMOIZE=false` to turn it off; the cache is
+    kept under `MEMOIZE_CACHE_SIZE_MB` (default 1024) by evicting the least recently used outputs.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapped(df):
+            if cache_dir is None or os.environ.get('MEMOIZE', 'true').lower() in ('false', '0', 'no'):
+                return f(df)
+            key = hashlib.sha256()
+            key.update(hash_frame(df).encode())
+            key.update(hash_value(config() if config else None).encode())
+            key.update(code_version().encode())
+            path = os.path.join(cache_dir, f"{f.__name__.strip('_')}_{key.hexdigest()}.pickle")
+            if os.path.exists(path):
+                try:
+                    output = pd.read_pickle(path)
+                    os.utime(path)
+                    logger.info(f"Input of {f.__name__} didn't change, reusing its cached output")
+                    return output
+                except (OSError, pickle.UnpicklingError, EOFError):
+                    logger.warning(f"Failed to read cached output {path}, recomputing it")
+            output = f(df)
+            __store(path, output)
+            return output
+        return wrapped
+    return decorator
+
+
+def hash_frame(df: pd.DataFrame) -> str:
+    h = hashlib.sha256()
+    h.update(repr([(str(name), str(dtype)) for name, dtype in df.dtypes.items()]).encode())
+    h.update(repr(list(df.index.names)).encode())
+    try:
+        h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    except TypeError:
+        # cells that can't be hashed by pandas, e.g. lists of coordinates
+        h.update(pickle.dumps(df, protocol=4))
+    return h.hexdigest()
+
+
+def hash_value(value) -> str:
+    if isinstance(value, pd.DataFrame):
+        return hash_frame(value)
+    if isinstance(value, dict):
+        return hash_value(sorted((str(k), hash_value(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return hashlib.sha256(repr([hash_value(x) for x in value]).encode()).hexdigest()
+    return hashlib.sha256(repr(value).encode()).hexdigest()
+
+
+def file_hash(path):
+    """Hash of the content of the file at `path`, None if there is no such file."""
+    if not path or not os.path.isfile(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def code_version():
+    """Hash of the sources of all loaded modules of this repository and of the pandas version."""
+    global _code_version
+    if _code_version is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        h = hashlib.sha256(pd.__version__.encode())
+        module_files = sorted({os.path.abspath(x.__file__) for x in list(sys.modules.values())
+                               if getattr(x, '__file__', None) and x.__file__.endswith('.py')})
+        for module_file in module_files:
+            if module_file.startswith(root + os.sep):
+                h.update(module_file[len(root):].encode())
+                h.update((file_hash(module_file) or '').encode())
+        _code_version = h.hexdigest()
+    return _code_version
+
+
+def write_if_changed(path, text, newline=None) -> bool:
+    """Write `text` like `open(path, 'w', newline=newline)` would, unless the file already has this content.
+
+    `text` can also be bytes, which are written as they are.
+    Unchanged files are not touched, so their modification time still tells when they last changed.
+    """
+    if isinstance(text, bytes):
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                if f.read() == text:
+                    return False
+        with open(path, 'wb') as f:
+            f.write(text)
+        return True
+    expected = text.replace('\n', os.linesep) if newline is None and os.linesep != '\n' else text
+    if os.path.exists(path):
+        with open(path, newline='') as f:
+            if f.read() == expected:
+                return False
+    with open(path, 'w', newline=newline) as f:
+        f.write(text)
+    return True
+
+
+def __store(path, output):
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    pd.to_pickle(output, tmp_path)
+    os.replace(tmp_path, path)
+    __evict(int(float(os.environ.get('MEMOIZE_CACHE_SIZE_MB', DEFAULT_MAX_SIZE_MB)) * 1024 * 1024))
+
+
+def __evict(max_size):
+    entries = []
+    for file_name in os.listdir(cache_dir):
+        if file_name.endswith('.pickle'):
+            stat = os.stat(os.path.join(cache_dir, file_name))
+            entries.append((stat.st_mtime, stat.st_size, file_name))
+    size = sum(x[1] for x in entries)
+    for _, file_size, file_name in sorted(entries):
+        if size <= max_size:
+            break
+        os.remove(os.path.join(cache_dir, file_name))
+        size -= file_size
@@ -0,0 +1,320 @@
+import atexit
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+logger.setLevel("INFO")
+
+# seconds, from a fast metadata request to a slow analytics pull
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+DEFAULT_INTERVAL = 15
+DEFAULT_PROGRESS_LOG_INTERVAL = 30
+
+METRICS = {
+    'dhis2_etl_info': ('gauge', 'ETL run, the value is the start time in seconds since the epoch.'),
+    'dhis2_etl_http_requests_total': ('counter', 'DHIS2 requests by host, endpoint and status code.'),
+    'dhis2_etl_http_downloaded_bytes_total': ('counter', 'Bytes of DHIS2 response bodies, after decompression.'),
+    'dhis2_etl_http_retries_total': ('counter', 'Retries of DHIS2 requests.'),
+    'dhis2_etl_http_requests_in_flight': ('gauge', 'DHIS2 requests currently waiting for a response.'),
+    'dhis2_etl_http_request_duration_seconds': ('histogram', 'Duration of DHIS2 requests, retries included.'),
+    'dhis2_etl_stage_running': ('gauge', 'Whether a pipeline stage is running.'),
+    'dhis2_etl_stage_duration_seconds': ('gauge', 'Wall time of the last run of a pipeline stage.'),
+    'dhis2_etl_progress_done': ('gauge', 'Done units of a task.'),
+    'dhis2_etl_progress_total': ('gauge', 'Total units of a task.'),
+    'dhis2_etl_progress_eta_seconds': ('gauge', 'Estimated seconds until a task is done.'),
+    'process_resident_memory_bytes': ('gauge', 'Resident memory size of the ETL process.'),
+}
+
+_lock = threading.Lock()
+_values = defaultdict(float)
+_histograms = {}
+_constant_labels = {}
+_exporter = None
+_stop_at_exit_registered = False
+
+
+def inc(name, value=1, **labels):
+    """Add `value` to the counter (or gauge) `name` with `labels`."""
+    with _lock:
+        _values[(name, _key(labels))] += value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _values[(name, _key(labels))] = value
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Record `value` in the histogram `name` with `labels`."""
+    with _lock:
+        key = (name, _key(labels))
+        if key not in _histograms:
+            _histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+        histogram = _histograms[key]
+        for i, bound in enumerate(histogram['buckets']):
+            if value <= bound:
+                histogram['counts'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+def observe_request(url, status_code, elapsed, downloaded_bytes, retries):
+    """Record a finished DHIS2 request, see `DHIS2Client.get`."""
+    labels = {'host': urlsplit(url).netloc, 'endpoint': endpoint(url)}
+    inc('dhis2_etl_http_requests_total', code=str(status_code), **labels)
+    inc('dhis2_etl_http_downloaded_bytes_total', downloaded_bytes, **labels)
+    if retries:
+        inc('dhis2_etl_http_retries_total', retries, **labels)
+    observe('dhis2_etl_http_request_duration_seconds', elapsed, **labels)
+
+
+def endpoint(url):
+    """API resource of `url` without ids and query, e.g. `reportTables` or `analytics/dataValueSet.json`.
+
+    Keeps the number of label values small, whatever the number of tables or chunks pulled.
+    """
+    path = urlsplit(url).path
+    path = path.split('/api/', 1)[1] if '/api/' in path else path.lstrip('/')
+    # DHIS2 uids are 11 alphanumeric characters starting with a letter
+    return '/'.join(x for x in path.split('/') if x and not re.fullmatch(r'[A-Za-z][A-Za-z0-9]{10}', x)) or '/'
+
+
+class Progress:
+    """Progress of a task of `total` units, e.g. subtrees, tables or HTTP requests of a chunked pull.
+
+    Exported as the `dhis2_etl_progress_*` gauges with an ETA extrapolated from the rate so far,
+    and logged at most every `PROGRESS_LOG_INTERVAL` seconds.
+    """
+
+    def __init__(self, task, total, unit='items'):
+        self.task = task
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.started = time.monotonic()
+        self._last_logged = self.started
+        self._log_interval = float(os.environ.get('PROGRESS_LOG_INTERVAL', DEFAULT_PROGRESS_LOG_INTERVAL))
+        self._lock = threading.Lock()
+        set_gauge('dhis2_etl_progress_total', total, task=task)
+        self._update()
+
+    def advance(self, n=1):
+        with self._lock:
+            self.done += n
+            self._update()
+            now = time.monotonic()
+            if self.done >= self.total or now - self._last_logged >= self._log_interval:
+                self._last_logged = now
+                logger.info(str(self))
+
+    def eta(self):
+        """Estimated seconds left, None before anything is done."""
+        if not self.done:
+            return None
+        return max(0.0, (time.monotonic() - self.started) / self.done * (self.total - self.done))
+
+    def _update(self):
+        set_gauge('dhis2_etl_progress_done', self.done, task=self.task)
+        eta = self.eta()
+        if eta is not None:
+            set_gauge('dhis2_etl_progress_eta_seconds', eta, task=self.task)
+
+    def __str__(self):
+        percent = f" ({self.done / self.total:.0%})" if self.total else ''
+        eta = self.eta()
+        eta = f", ETA {time.strftime('%H:%M:%S', time.gmtime(eta))}" \
+            if eta is not None and self.done < self.total else ''
+        return f"{self.task}: {self.done}/{self.total} {self.unit}{percent}{eta}"
+
+
+def progress(task, total, unit='items'):
+    return Progress(task, total, unit)
+
+
+def stage_started(stage, table=''):
+    set_gauge('dhis2_etl_stage_running', 1, stage=stage, table=table)
+
+
+def stage_finished(stage, table, wall_time):
+    set_gauge('dhis2_etl_stage_running', 0, stage=stage, table=table)
+    set_gauge('dhis2_etl_stage_duration_seconds', wall_time, stage=stage, table=table)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    rss = _current_rss()
+    if rss is not None:
+        set_gauge('process_resident_memory_bytes', rss)
+    with _lock:
+        values = dict(_values)
+        histograms = {key: {**x, 'counts': list(x['counts'])} for key, x in _histograms.items()}
+    series = defaultdict(list)
+    for (name, labels), value in sorted(values.items()):
+        series[name].append(f"{name}{_labels(labels)} {_number(value)}")
+    # buckets in increasing order of their bounds, as Prometheus expects them
+    for (name, labels), histogram in sorted(histograms.items()):
+        for bound, count in zip(histogram['buckets'], histogram['counts']):
+            series[name].append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {count}")
+        series[name].append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+        series[name].append(f"{name}_sum{_labels(labels)} {_number(histogram['sum'])}")
+        series[name].append(f"{name}_count{_labels(labels)} {histogram['count']}")
+    lines = []
+    for name in sorted(series):
+        metric_type, help_text = METRICS.get(name, ('untyped', ''))
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"] + series[name]
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path):
+    """Write the metrics for the node exporter textfile collector, replacing the file atomically."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+
+def start(etl_name, **labels):
+    """Start exporting metrics of this run as configured in the environment.
+
+    `METRICS_TEXTFILE` is rewritten every `METRICS_INTERVAL` seconds and when the process exits,
+    `METRICS_PORT` serves them on `http://METRICS_HOST:METRICS_PORT/metrics` while the run lasts.
+    Without either, metrics are only kept in memory.
+    """
+    global _exporter, _stop_at_exit_registered
+    stop()
+    _constant_labels.clear()
+    _constant_labels.update({'etl': etl_name, **labels})
+    set_gauge('dhis2_etl_info', time.time(), pid=str(os.getpid()))
+    textfile = os.environ.get('METRICS_TEXTFILE')
+    port = os.environ.get('METRICS_PORT')
+    if not textfile and not port:
+        return None
+    _exporter = _Exporter(textfile, os.environ.get('METRICS_HOST', '127.0.0.1'), int(port) if port else None,
+                          float(os.environ.get('METRICS_INTERVAL', DEFAULT_INTERVAL)))
+    if not _stop_at_exit_registered:
+        atexit.register(stop)
+        _stop_at_exit_registered = True
+    return _exporter
+
+
+def stop():
+    """Stop the exporter started by `start`, writing the textfile one last time."""
+    global _exporter
+    if _exporter is not None:
+        _exporter.stop()
+        _exporter = None
+
+
+def reset():
+    stop()
+    with _lock:
+        _values.clear()
+        _histograms.clear()
+    _constant_labels.clear()
+
+
+class _Exporter:
+    def __init__(self, textfile, host, port, interval):
+        self.textfile = textfile
+        self.server = None
+        self._stopped = threading.Event()
+        self._threads = []
+        if port is not None:
+            # imported here, so importing the module doesn't slow down the start of the ETLs
+            from http.server import ThreadingHTTPServer
+
+            try:
+                self.server = ThreadingHTTPServer((host, port), _metrics_handler())
+            except OSError as e:
+                # e.g. the port is used by another run, which shouldn't fail this one
+                logger.warning(f"Failed to serve metrics on {host}:{port}: {e}")
+        if self.server:
+            self.server.daemon_threads = True
+            self._threads.append(threading.Thread(target=self.server.serve_forever, name='metrics-server',
+                                                  daemon=True))
+            logger.info(f"Serving metrics on http://{host}:{self.server.server_address[1]}/metrics")
+        if textfile:
+            self._threads.append(threading.Thread(target=self._write_periodically, args=(interval,),
+                                                  name='metrics-textfile', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def _write_periodically(self, interval):
+        while not self._stopped.wait(interval):
+            self._write()
+
+    def _write(self):
+        try:
+            write_textfile(self.textfile)
+        except OSError as e:
+            logger.warning(f"Failed to write metrics to {self.textfile}: {e}")
+
+    def stop(self):
+        self._stopped.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        for thread in self._threads:
+            thread.join()
+        if self.textfile:
+            self._write()
+
+
+def _metrics_handler():
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return MetricsHandler
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _labels(labels):
+    labels = {**_constant_labels, **dict(labels)}
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not float(value).is_integer() else str(int(value))
+
+
+def _current_rss():
+    """Current resident set size of the process in bytes, None where it can't be read without psutil."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if sys.platform == 'darwin':
+        import resource
+
+        # the peak rather than the current size, the closest macOS offers in the standard library
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from urllib.parse import quote
+
+from lazy_import import lazy_module
+
+pd = lazy_module('pandas')
+
+ORG_UNITS_PARAMS = "paging=false&includeDescendants=true&includeAncestors=true&withinUserHierarchy=true"
+ORG_UNIT_FIELDS = "id,name,displayName,shortName,path,ancestors,featureType"
+GEOMETRY_FIELDS = "coordinates,geometry"
+FULL_RESOURCE = f"organisationUnits.csv?{ORG_UNITS_PARAMS}&fields={ORG_UNIT_FIELDS},{GEOMETRY_FIELDS}"
+
+
+def root_resource(name):
+    """Resource listing the org units named `name` with their level, to find the root of a subtree."""
+    return (f"organisationUnits.json?paging=false&withinUserHierarchy=true&fields=id,level&"
+            f"filter=name:eq:{quote(name, safe='')}")
+
+
+def choose_root(org_units):
+    """(id, level) of the highest level org unit of `org_units`, as `extract_location_subtree` picks it.
+
+    None if there is none, or if several share the highest level and the choice would depend on the
+    order DHIS2 returns them in.
+    """
+    if not org_units:
+        return None
+    top_level = min(int(x['level']) for x in org_units)
+    top = [x for x in org_units if int(x['level']) == top_level]
+    if len(top) > 1:
+        return None
+    return top[0]['id'], top_level
+
+
+def get_resources(areas_admin_level, root=None):
+    """Resources of the areas with their geometries and of the facilities without them.
+
+    Only the subtree of the `root` (id, level) is pulled, if there is one. Areas are the org units
+    down to `areas_admin_level` levels below the root, everything deeper is a facility.
+    """
+    root_id, root_level = root or (None, 1)
+    subtree = f"&filter=path:like:{root_id}" if root_id else ''
+    max_area_level = root_level + areas_admin_level
+    return {
+        'areas': f"organisationUnits.csv?{ORG_UNITS_PARAMS}&fields={ORG_UNIT_FIELDS},{GEOMETRY_FIELDS}"
+                 f"{subtree}&filter=level:le:{max_area_level}",
+        'facilities': f"organisationUnits.csv?{ORG_UNITS_PARAMS}&fields={ORG_UNIT_FIELDS}"
+                      f"{subtree}&filter=level:gt:{max_area_level}",
+    }
+
+
+def get_facility_points_resource(facilities: pd.DataFrame, areas_admin_level, root=None):
+    """Resource of the facility coordinates, only the points if the DHIS2 has `featureType` (before 2.32).
+
+    Facility polygons are never used, newer DHIS2 versions with `geometry` can't filter them out.
+    """
+    root_id, root_level = root or (None, 1)
+    subtree = f"&filter=path:like:{root_id}" if root_id else ''
+    resource = f"organisationUnits.csv?{ORG_UNITS_PARAMS}{subtree}&filter=level:gt:{root_level + areas_admin_level}"
+    if 'featureType' in facilities:
+        return f"{resource}&fields=id,coordinates&filter=featureType:eq:POINT"
+    return f"{resource}&fields=id,geometry"
+
+
+def merge(areas: pd.DataFrame, facilities: pd.DataFrame, facility_points: pd.DataFrame = None) -> pd.DataFrame:
+    """Org units frame like the one of `FULL_RESOURCE`, from the pieces of `get_resources`."""
+    if facility_points is not None:
+        facilities = facilities.merge(facility_points, on='id', how='left')
+    columns = list(areas) + [x for x in facilities if x not in list(areas)]
+    return pd.concat([areas, facilities], ignore_index=True, sort=False).reindex(columns=columns)
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import io
+import json
+import os
+
+import memoize
+from lazy_import import lazy_module
+
+pd = lazy_module('pandas')
+
+FORMATS = ['csv', 'parquet', 'feather']
+DEFAULT_COMPRESSION = 'zstd'
+DEFAULT_ROW_GROUP_SIZE = 1_000_000
+
+# column types of the artefacts, so their columnar files have the same schema in every run
+# whatever values a run happens to pull, e.g. a column that is empty in one run stays a double
+SCHEMAS = {
+    'location_hierarchy': {'area_id': 'string', 'area_name': 'string', 'area_level': 'int64',
+                           'parent_area_id': 'string', 'area_sort_order': 'double'},
+    'facility_list': {'facility_id': 'string', 'facility_name': 'string', 'parent_area_id': 'string',
+                      'lat': 'double', 'long': 'double', 'type': 'string', 'area_sort_order': 'double'},
+    'dhis2_id_mapping': {'area_id': 'string', 'map_level': 'int64', 'map_name': 'string', 'map_id': 'string',
+                         'map_source': 'string'},
+    'ids_mapping': {'area_id': 'string', 'dhis2_id': 'string', 'pepfar_id': 'string'},
+    'areas': {'area_id': 'string', 'area_name': 'string', 'area_level': 'int64'},
+    # the remaining columns of a program data table are its categories (strings) and values (doubles)
+    # and one of the period columns, see `dhis2_periods.ROLL_UP_COLUMNS`
+    'program_data': {'area_id': 'string', 'area_name': 'string', 'year': 'string', 'quarter': 'string',
+                     'month': 'string', 'six_month': 'string', 'financial_year': 'string'},
+}
+
+
+def get_formats():
+    """Output formats listed in the `OUTPUT_FORMATS` env variable, `csv` by default.
+
+    Parquet and Feather need pyarrow, which is checked here so a run fails before pulling anything.
+    """
+    formats = [x.strip().lower() for x in os.environ.get('OUTPUT_FORMATS', 'csv').split(',') if x.strip()]
+    unknown = [x for x in formats if x not in FORMATS]
+    if unknown or not formats:
+        raise ValueError(f"Unknown output formats {', '.join(unknown) or 'none'} in OUTPUT_FORMATS, "
+                         f"use a comma separated list of {', '.join(FORMATS)}")
+    if any(x != 'csv' for x in formats):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("Parquet and Feather output needs pyarrow, install it with `pip install pyarrow`")
+    return formats
+
+
+def get_schema(df, schema_name):
+    """Column types of `df`, declared ones from `SCHEMAS` and the rest derived from the dtypes."""
+    declared = SCHEMAS.get(schema_name, {})
+    return {x: declared.get(x) or _get_type(df[x]) for x in df}
+
+
+def write_table(df: pd.DataFrame, csv_path, schema_name=None, float_format=None):
+    """Write `df` to `csv_path` and/or next to it with the extension of every other format in `OUTPUT_FORMATS`.
+
+    Files whose content didn't change are not rewritten, see `memoize.write_if_changed`.
+    """
+    formats = get_formats()
+    if 'csv' in formats:
+        memoize.write_if_changed(csv_path, df.to_csv(index=False, float_format=float_format), newline='')
+    if 'parquet' in formats or 'feather' in formats:
+        table = to_arrow(df, get_schema(df, schema_name))
+        for output_format in formats:
+            if output_format != 'csv':
+                buffer = io.BytesIO()
+                _write_arrow(table, buffer, output_format)
+                memoize.write_if_changed(get_path(csv_path, output_format), buffer.getvalue())
+
+
+def get_path(csv_path, output_format):
+    return f"{os.path.splitext(csv_path)[0]}.{output_format}"
+
+
+class TableWriter:
+    """Writes a table in parts, e.g. one per bucket of the chunked pivot table pipeline.
+
+    Every part goes into the same files: rows appended to the CSV, one or more row groups of the
+    Parquet file and record batches of the Feather file, so no format needs the whole table in memory.
+    `schema` maps all columns to their type, see `get_schema`.
+    """
+
+    def __init__(self, csv_path, schema, float_format=None):
+        self.csv_path = csv_path
+        self.schema = schema
+        self.float_format = float_format
+        self.formats = get_formats()
+        self.files = {}
+        self.writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, df: pd.DataFrame):
+        df = df.reindex(columns=list(self.schema))
+        if 'csv' in self.formats:
+            if 'csv' not in self.files:
+                self.files['csv'] = open(self.csv_path, 'w', newline='')
+                df.to_csv(self.files['csv'], index=False, float_format=self.float_format)
+            else:
+                df.to_csv(self.files['csv'], index=False, float_format=self.float_format, header=False)
+        if 'parquet' in self.formats or 'feather' in self.formats:
+            table = to_arrow(df, self.schema)
+            for output_format in self.formats:
+                if output_format == 'csv':
+                    continue
+                if output_format not in self.writers:
+                    self.writers[output_format] = _open_arrow_writer(get_path(self.csv_path, output_format),
+                                                                      table.schema, output_format)
+                self.writers[output_format].write_table(table, **_row_group_size_kwargs(output_format))
+
+    def close(self):
+        if not self.files and not self.writers:
+            # no parts at all, still write the header/schema
+            self.write(pd.DataFrame(columns=list(self.schema)))
+        for writer in self.writers.values():
+            writer.close()
+        for f in self.files.values():
+            f.close()
+        self.files, self.writers = {}, {}
+
+
+def write_geoparquet(features, path):
+    """Write GeoJSON `features` as GeoParquet: their properties as columns and the geometry as WKB."""
+    import pyarrow as pa
+    import shapely.geometry
+
+    properties = pd.DataFrame([x['properties'] for x in features]).reindex(columns=list(SCHEMAS['areas']))
+    table = to_arrow(properties, SCHEMAS['areas'])
+    geometries = [shapely.geometry.shape(x['geometry']) for x in features]
+    table = table.append_column('geometry', pa.array([x.wkb for x in geometries], pa.binary()))
+    bounds = [x.bounds for x in geometries if not x.is_empty]
+    geo = {
+        'version': '1.0.0',
+        'primary_column': 'geometry',
+        'columns': {
+            'geometry': {
+                'encoding': 'WKB',
+                'geometry_types': sorted({x.geom_type for x in geometries}),
+                'bbox': [min(x[0] for x in bounds), min(x[1] for x in bounds),
+                         max(x[2] for x in bounds), max(x[3] for x in bounds)] if bounds else []
+            }
+        }
+    }
+    table = table.replace_schema_metadata({'geo': json.dumps(geo)})
+    buffer = io.BytesIO()
+    _write_arrow(table, buffer, 'parquet')
+    memoize.write_if_changed(path, buffer.getvalue())
+
+
+def to_arrow(df: pd.DataFrame, schema):
+    """`df` as a pyarrow table with the column types of `schema`, empty strings become nulls like in the CSVs."""
+    import pyarrow as pa
+
+    arrays = []
+    for column, type_name in schema.items():
+        series = df[column] if column in df else pd.Series([None] * len(df), index=df.index, dtype=object)
+        if type_name == 'string':
+            values = series.astype(object)
+            mask = (series.isna() | (values == '')).to_numpy(dtype=bool)
+            arrays.append(pa.array(values.astype(str), mask=mask, type=pa.string()))
+        else:
+            if not pd.api.types.is_numeric_dtype(series):
+                series = pd.to_numeric(series.mask(series.astype(str) == ''))
+            arrays.append(pa.array(series, type=_arrow_type(type_name), from_pandas=True))
+    return pa.Table.from_arrays(arrays, names=list(schema))
+
+
+def _get_type(series):
+    if pd.api.types.is_bool_dtype(series):
+        return 'bool'
+    if pd.api.types.is_numeric_dtype(series):
+        return 'double'
+    return 'string'
+
+
+def _compression():
+    compression = os.environ.get('OUTPUT_COMPRESSION', DEFAULT_COMPRESSION).lower()
+    return None if compression == 'none' else compression
+
+
+def _row_group_size_kwargs(output_format):
+    if output_format != 'parquet':
+        return {}
+    return {'row_group_size': int(os.environ.get('PARQUET_ROW_GROUP_SIZE', DEFAULT_ROW_GROUP_SIZE))}
+
+
+def _open_arrow_writer(sink, schema, output_format):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if output_format == 'parquet':
+        return pq.ParquetWriter(sink, schema, compression=_compression() or 'none')
+    # Feather v2 is the Arrow IPC file format
+    return pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(compression=_compression()))
+
+
+def _write_arrow(table, sink, output_format):
+    writer = _open_arrow_writer(sink, table.schema, output_format)
+    writer.write_table(table, **_row_group_size_kwargs(output_format))
+    writer.close()
+
+
+def _arrow_type(type_name):
+    import pyarrow as pa
+
+    return {'string': pa.string(), 'int64': pa.int64(), 'double': pa.float64(), 'bool': pa.bool_()}[type_name]
@@ -0,0 +1,132 @@
+import cProfile
+import csv
+import functools
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import metrics
+from lazy_import import lazy_module
+
+etl = lazy_module('etl')
+pd = lazy_module('pandas')
+dhis2_client = lazy_module('dhis2_client')
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+STAGE_COLUMNS = ['stage', 'table', 'started', 'wall_time', 'cpu_time', 'peak_rss_delta',
+                 'rows_in', 'rows_out', 'memory_in', 'memory_out']
+
+context = {}
+_stages = []
+_profilers = {}
+
+
+def log_and_profile(msg):
+    """Same as `etl.decorators.log_start_and_finalisation`, but also records metrics of every call.
+
+    Wall time, CPU time, peak RSS growth, row counts and memory of the input and output
+    DataFrames are kept for the run report, see `write_run_report`. The stage named in the
+    `PROFILE_STAGE` env variable is additionally run under cProfile.
+    """
+    def decorator(f):
+        logged = None
+
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            nonlocal logged
+            if logged is None:
+                # created on first call, so decorating a function doesn't import etl
+                logged = etl.decorators.log_start_and_finalisation(msg)(f)
+            input_df = next((x for x in list(args) + list(kwargs.values()) if isinstance(x, pd.DataFrame)), None)
+            record = {
+                'stage': msg,
+                'table': context.get('table', ''),
+                'started': datetime.now().isoformat(timespec='seconds'),
+                'rows_in': _rows(input_df),
+                'memory_in': _memory(input_df)
+            }
+            profiler = cProfile.Profile() if msg == os.environ.get('PROFILE_STAGE') else None
+            peak_rss_before = _peak_rss()
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            metrics.stage_started(msg, record['table'])
+            if profiler:
+                profiler.enable()
+            try:
+                ret = logged(*args, **kwargs)
+            finally:
+                if profiler:
+                    profiler.disable()
+                    _profilers[f"{msg} {record['table']}".strip()] = profiler
+                metrics.stage_finished(msg, record['table'], time.perf_counter() - wall_start)
+            record['wall_time'] = round(time.perf_counter() - wall_start, 4)
+            record['cpu_time'] = round(time.process_time() - cpu_start, 4)
+            record['peak_rss_delta'] = _peak_rss() - peak_rss_before
+            output_df = ret if isinstance(ret, pd.DataFrame) else None
+            record['rows_out'] = _rows(output_df)
+            record['memory_out'] = _memory(output_df)
+            _stages.append(record)
+            return ret
+        return wrapped
+    return decorator
+
+
+def write_run_report(output_dir, **run_info):
+    """Save metrics of all stages and DHIS2 requests since the last report to `output_dir`/reports.
+
+    Writes `run_report.json` with run info, stages and requests, `run_report.csv` with the stages
+    and a `<stage>.prof` cProfile dump for the profiled stage, if any.
+    """
+    report_dir = os.path.join(output_dir, 'reports')
+    os.makedirs(report_dir, exist_ok=True)
+    requests = [stats._asdict() for client in dhis2_client.clients() for stats in client.stats]
+    report = {
+        'run': {**run_info, 'finished': datetime.now().isoformat(timespec='seconds'), 'argv': sys.argv},
+        'stages': _stages,
+        'requests': requests
+    }
+    with open(os.path.join(report_dir, 'run_report.json'), 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    with open(os.path.join(report_dir, 'run_report.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=STAGE_COLUMNS)
+        writer.writeheader()
+        writer.writerows(_stages)
+    for name, profiler in _profilers.items():
+        profiler.dump_stats(os.path.join(report_dir, f"{name.replace(' ', '_')}.prof"))
+    reset()
+
+
+def stages():
+    return list(_stages)
+
+
+def reset():
+    _stages.clear()
+    _profilers.clear()
+    dhis2_client.reset_stats()
+
+
+def _rows(df):
+    return len(df) if df is not None else None
+
+
+def _memory(df):
+    if df is None:
+        return None
+    deep = os.environ.get('PROFILE_DEEP_MEMORY', 'false').lower() in ('true', '1', 'yes')
+    return int(df.memory_usage(index=True, deep=deep).sum())
+
+
+def _peak_rss():
+    """Peak resident set size of the process in bytes."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
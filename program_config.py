@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+import pandas as pd
+
+# bump when the compiled format changes, so stale cache entries are not used
+COMPILER_VERSION = 1
+
+CompiledConfig = namedtuple('CompiledConfig', [
+    'data_element_names',   # id, position, name: position 0 renames the data element, others add extra rows
+    'column_categories',    # id, category, value, order: categoryMapping of data elements
+    'category_mappings',    # id, category, value, order: mapping of category option combos
+    'categories_to_remove'  # list of category option combo ids to drop
+])
+
+_compiled = {}
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def load(category_config_paths, column_config_paths, cache_dir=None) -> CompiledConfig:
+    """Validate and compile category and column config files into lookup tables.
+
+    Paths are comma separated lists, as in the `PROGRAM_DATA_CATEGORY_CONFIG` and
+    `PROGRAM_DATA_COLUMN_CONFIG` env variables. Entries of later files override entries with
+    the same id in earlier files. Compiled configs are kept in memory and in `cache_dir`, keyed
+    by the content of the files, so they are only parsed again when a file changes.
+    """
+    category_files = _split_paths(category_config_paths)
+    column_files = _split_paths(column_config_paths)
+    contents = {path: _read(path) for path in category_files + column_files}
+    key = _cache_key(category_files, column_files, contents)
+    if key in _compiled:
+        return _compiled[key]
+    cache_path = os.path.join(cache_dir, f"{key}.pickle") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        compiled = CompiledConfig(**pd.read_pickle(cache_path))
+    else:
+        category_config = _entries([(x, _parse(x, contents[x])) for x in category_files], _validate_category)
+        column_config = _entries([(x, _parse(x, contents[x])) for x in column_files], _validate_column)
+        compiled = _compile(category_config, column_config)
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            pd.to_pickle(compiled._asdict(), cache_path)
+    _compiled[key] = compiled
+    return compiled
+
+
+def _compile(category_config, column_config) -> CompiledConfig:
+    # same precedence as reading the files one by one into dicts: later entries override earlier ones,
+    # except that an empty column "mapping" doesn't override an earlier name
+    names = {}
+    column_categories = {}
+    for entry in column_config:
+        mapping = entry.get('mapping')
+        if mapping:
+            names[entry['id']] = mapping if isinstance(mapping, list) else [mapping]
+        column_categories[entry['id']] = entry.get('categoryMapping')
+    category_mappings = {}
+    categories_to_remove = {}
+    for entry in category_config:
+        category_mappings[entry['id']] = entry.get('mapping') or {}
+        categories_to_remove[entry['id']] = bool(entry.get('remove'))
+    return CompiledConfig(
+        data_element_names=pd.DataFrame([(id_, position, name) for id_, mapping in names.items()
+                                         for position, name in enumerate(mapping)],
+                                        columns=['id', 'position', 'name']),
+        column_categories=_categories_table({k: v for k, v in column_categories.items() if v}),
+        category_mappings=_categories_table(category_mappings),
+        categories_to_remove=[k for k, v in categories_to_remove.items() if v]
+    )
+
+
+def _categories_table(mappings):
+    rows = []
+    for id_, mapping in mappings.items():
+        if not mapping:
+            # ids mapped to no categories are still mapped
+            rows.append((id_, None, None, -1))
+        rows += [(id_, category, value, order) for order, (category, value) in enumerate(mapping.items())]
+    return pd.DataFrame(rows, columns=['id', 'category', 'value', 'order'])
+
+
+def _entries(files, validate):
+    entries = []
+    for path, config in files:
+        if not isinstance(config, list):
+            raise ConfigError(f"Config file {path} must contain a list of entries")
+        for i, entry in enumerate(config):
+            validate(path, i, entry)
+            entries.append(entry)
+    return entries
+
+
+def _validate_entry(path, i, entry):
+    if not isinstance(entry, dict) or not isinstance(entry.get('id'), str):
+        raise ConfigError(f"Entry {i} of config file {path} must be an object with an \"id\"")
+
+
+def _validate_category(path, i, entry):
+    _validate_entry(path, i, entry)
+    mapping = entry.get('mapping', {})
+    if mapping is not None and not isinstance(mapping, dict):
+        raise ConfigError(f"\"mapping\" of category {entry['id']} in {path} must be an object")
+
+
+def _validate_column(path, i, entry):
+    _validate_entry(path, i, entry)
+    mapping = entry.get('mapping')
+    if mapping and not (isinstance(mapping, str) or
+                        isinstance(mapping, list) and all(isinstance(x, str) for x in mapping)):
+        raise ConfigError(f"\"mapping\" of column {entry['id']} in {path} must be a string or a list of strings")
+    category_mapping = entry.get('categoryMapping')
+    if category_mapping is not None and not isinstance(category_mapping, dict):
+        raise ConfigError(f"\"categoryMapping\" of column {entry['id']} in {path} must be an object")
+
+
+def _split_paths(paths):
+    return [x for x in (paths or '').split(',') if x]
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _parse(path, content):
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError as e:
+        raise ConfigError(f"Config file {path} is not valid JSON: {e}")
+
+
+def _cache_key(category_files, column_files, contents):
+    key = hashlib.sha256(f"v{COMPILER_VERSION}".encode())
+    for kind, files in (('category', category_files), ('column', column_files)):
+        for path in files:
+            key.update(f"|{kind}|".encode())
+            key.update(hashlib.sha256(contents[path]).digest())
+    return key.hexdigest()
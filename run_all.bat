@@ -1,4 +1,3 @@
 CALL .\env\Scripts\activate.bat
-python adr_dhis2_geodata_etl.py -e inputs/datim/datim.env
-python adr_dhis2_geodata_etl.py -e inputs/zmb/zmb.env
+python run_all.py --etl geodata inputs/datim/datim.env inputs/zmb/zmb.env
 pause
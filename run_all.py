@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+import argparse
+import importlib
+import json
+import os
+import shlex
+import traceback
+from collections import Counter, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from urllib.parse import urlparse
+
+import etl
+from dotenv import dotenv_values
+
+log = etl.logging.get_logger(log_name="ADR DHIS2 batch export", log_group="etl")
+
+ETL_MODULES = {
+    'geodata': 'adr_dhis2_geodata_etl',
+    'pivot': 'adr_dhis2_pivot_table_etl'
+}
+DEFAULT_STATE_FILE = 'output/run_all_state.json'
+
+Job = namedtuple('Job', ['id', 'etl', 'env_file', 'argv', 'host', 'depends_on'])
+
+
+def run_job(etl_name, argv, job_environ=None):
+    """Run one ETL in a pool worker with `job_environ` set, the worker's environment is restored afterwards.
+
+    Both ETLs read their config from env files with `load_dotenv`, which never overrides variables
+    that are already set, so every job has to start from the environment the worker started with.
+    Imported modules, DHIS2 clients and their connection pools are kept for the next job.
+    A `SystemExit` of the ETL, e.g. argparse rejecting its arguments, fails the job like any other error.
+    """
+    environ = dict(os.environ)
+    try:
+        os.environ.update(job_environ or {})
+        importlib.import_module(ETL_MODULES[etl_name]).main(argv)
+    except SystemExit as e:
+        if e.code in (None, 0):
+            return
+        raise RuntimeError(f"{etl_name} ETL exited with code {e.code}") from None
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+def get_metrics_environ(job, index):
+    """`METRICS_PORT` and `METRICS_TEXTFILE` of the `index`-th job, so jobs running at the same time don't share them.
+
+    The port is moved up by `index` and the ETL and env file names are added to the textfile name.
+    """
+    config = {**dotenv_values(job.env_file), **os.environ}
+    environ = {}
+    if config.get('METRICS_PORT'):
+        environ['METRICS_PORT'] = str(int(config['METRICS_PORT']) + index)
+    if config.get('METRICS_TEXTFILE'):
+        root, ext = os.path.splitext(config['METRICS_TEXTFILE'])
+        env_name = os.path.splitext(os.path.basename(job.env_file))[0]
+        environ['METRICS_TEXTFILE'] = f"{root}_{job.etl}_{env_name}{ext}"
+    return environ
+
+
+def get_jobs(env_files, etls, geodata_args, pivot_args):
+    jobs = []
+    for env_file in env_files:
+        if not os.path.exists(env_file):
+            raise FileNotFoundError(f"Env file {env_file} not found")
+        host = urlparse(dotenv_values(env_file).get('DHIS2_URL') or '').netloc
+        geodata_job_id = f"geodata:{env_file}"
+        if 'geodata' in etls:
+            jobs.append(Job(geodata_job_id, 'geodata', env_file, ['-e', env_file] + geodata_args, host, None))
+        if 'pivot' in etls and 'PROGRAM_DATA' in dotenv_values(env_file):
+            # the pivot ETL may use the org unit hierarchy pulled by the geodata ETL
+            depends_on = geodata_job_id if 'geodata' in etls else None
+            jobs.append(Job(f"pivot:{env_file}", 'pivot', env_file, ['-e', env_file] + pivot_args, host, depends_on))
+    return jobs
+
+
+def run_jobs(jobs, workers, per_host, state, state_file):
+    """Run `jobs` on a pool of `workers` processes, with at most `per_host` jobs per DHIS2 server at a time."""
+    pending = list(jobs)
+    running = {}
+    hosts = Counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for job in list(pending):
+                if len(running) >= workers:
+                    break
+                dependency_status = state.get(job.depends_on, {}).get('status') if job.depends_on else 'done'
+                if dependency_status == 'failed':
+                    pending.remove(job)
+                    __set_status(state, state_file, job, 'failed', error=f"{job.depends_on} failed")
+                    log.error(f"Skipping {job.id}, {job.depends_on} failed")
+                    continue
+                if dependency_status != 'done' or (job.host and hosts[job.host] >= per_host):
+                    continue
+                pending.remove(job)
+                hosts[job.host] += 1
+                metrics_environ = get_metrics_environ(job, jobs.index(job))
+                running[pool.submit(run_job, job.etl, job.argv, metrics_environ)] = job
+                __set_status(state, state_file, job, 'running')
+                log.info(f"Started {job.id}")
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                hosts[job.host] -= 1
+                try:
+                    future.result()
+                    __set_status(state, state_file, job, 'done')
+                    log.info(f"Finished {job.id}")
+                except Exception as e:
+                    error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+                    __set_status(state, state_file, job, 'failed', error=error)
+                    log.error(f"Failed {job.id}: {error}")
+    return state
+
+
+def read_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def __set_status(state, state_file, job, status, error=None):
+    state[job.id] = {'status': status, 'time': datetime.now().isoformat(timespec='seconds')}
+    if error:
+        state[job.id]['error'] = error
+    os.makedirs(os.path.dirname(state_file) or '.', exist_ok=True)
+    tmp_state_file = f"{state_file}.tmp"
+    with open(tmp_state_file, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_state_file, state_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the geodata and pivot table ETLs for many countries.')
+    parser.add_argument('env_files', nargs='+',
+                        help='env files of the countries to export')
+    parser.add_argument('--etl',
+                        dest='etls',
+                        action='append',
+                        choices=sorted(ETL_MODULES),
+                        help='ETL to run, can be repeated (default: geodata and pivot)')
+    parser.add_argument('-j', '--workers',
+                        type=int,
+                        default=os.cpu_count(),
+                        help='number of worker processes (default: number of cores)')
+    parser.add_argument('--per-host',
+                        type=int,
+                        default=2,
+                        help='maximum number of jobs pulling from the same DHIS2 server at a time (default: 2)')
+    parser.add_argument('--geodata-args',
+                        default='',
+                        help='extra arguments for the geodata ETL, e.g. "-p"')
+    parser.add_argument('--pivot-args',
+                        default='',
+                        help='extra arguments for the pivot table ETL, e.g. "-i"')
+    parser.add_argument('-r', '--resume',
+                        action='store_true',
+                        help='skip jobs that finished in the previous run')
+    parser.add_argument('--state-file',
+                        default=DEFAULT_STATE_FILE,
+                        help=f'file keeping the status of every job (default: {DEFAULT_STATE_FILE})')
+    args = parser.parse_args(argv)
+
+    jobs = get_jobs(args.env_files, args.etls or list(ETL_MODULES),
+                    shlex.split(args.geodata_args), shlex.split(args.pivot_args))
+    state = {}
+    if args.resume:
+        state = {k: v for k, v in read_state(args.state_file).items() if v['status'] == 'done'}
+        skipped = [x for x in jobs if x.id in state]
+        if skipped:
+            log.info(f"Resuming, skipping finished jobs: {', '.join(x.id for x in skipped)}")
+        jobs = [x for x in jobs if x.id not in state]
+    state = run_jobs(jobs, max(args.workers, 1), max(args.per_host, 1), state, args.state_file)
+    failed = [k for k, v in state.items() if v['status'] == 'failed']
+    if failed:
+        log.error(f"Failed jobs: {', '.join(failed)}. Rerun with --resume to retry them.")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    exit(main())
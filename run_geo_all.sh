@@ -1,20 +1,13 @@
 #!/usr/bin/env bash
 source venv/bin/activate
-echo Exporting ken
-python3 adr_dhis2_geodata_etl.py -p -e inputs/ken/ken.env
-echo Exporting lso
-python3 adr_dhis2_geodata_etl.py -p -e inputs/lso/lso.env
-echo Exporting mwi
-python3 adr_dhis2_geodata_etl.py -p -e inputs/mwi/mwi.env
-echo Exporting nam
-python3 adr_dhis2_geodata_etl.py -p -e inputs/nam/nam.env
-echo Exporting uga
-python3 adr_dhis2_geodata_etl.py -p -e inputs/uga/uga.env
-echo Exporting zmb
-python3 adr_dhis2_geodata_etl.py -p -e inputs/zmb/zmb.env
-echo Exporting tza
-python3 adr_dhis2_geodata_etl.py -p -e inputs/tza/tza.env -c inputs/tza/tza_location_data.csv
-echo Exporting zwe
-python3 adr_dhis2_geodata_etl.py -p -e inputs/zwe/zwe.env -c inputs/tza/zwe_location_data.csv
-echo Exporting DATIM
-python3 adr_dhis2_geodata_etl.py -e inputs/datim/datim.env
+python3 run_all.py --etl geodata --geodata-args=-p "$@" \
+  inputs/ken/ken.env \
+  inputs/lso/lso.env \
+  inputs/mwi/mwi.env \
+  inputs/nam/nam.env \
+  inputs/uga/uga.env \
+  inputs/zmb/zmb.env \
+  inputs/tza/tza.env \
+  inputs/zwe/zwe.env
+# DATIM is always pulled fresh
+python3 run_all.py --etl geodata --state-file output/run_all_datim_state.json "$@" inputs/datim/datim.env
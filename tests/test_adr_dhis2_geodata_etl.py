@@ -1,6 +1,8 @@
 import json
 import os
+import tempfile
 import unittest
+from unittest import mock
 
 import adr_dhis2_geodata_etl as geo_etl
 import pandas.util.testing as pd_test
@@ -18,7 +20,13 @@ class TestGeodataETLGoldenMaster(unittest.TestCase):
         geo_etl.AREAS_ADMIN_LEVEL = 2
         geo_etl.ISO_CODE = 'play'
 
-        geo_etl.run_steps(df)
+        # number the areas from scratch, without the registry or the id mapping of an earlier test run
+        previous_mapping_path = os.path.join(geo_etl.OUTPUT_DIR_NAME, 'geodata', 'dhis2_id_mapping.csv')
+        if os.path.exists(previous_mapping_path):
+            os.remove(previous_mapping_path)
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.dict(os.environ, {'AREA_ID_REGISTRY': os.path.join(tmp_dir, 'area_id_registry.csv')}):
+            geo_etl.run_steps(df)
 
     def test_golden_master_geo_areas_json(self):
         dirname = os.path.dirname(__file__)
@@ -29,6 +37,78 @@ class TestGeodataETLGoldenMaster(unittest.TestCase):
         self.assertEqual(expected, actual)
 
 
+class TestAreaIds(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        geo_etl.OUTPUT_DIR_NAME = self.tmp_dir.name
+        geo_etl.ISO_CODE = 'play'
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_ids_are_numbered_per_level(self):
+        df = pd.DataFrame({'id': ['c', 'r1', 'r2', 'd1'], 'admin_level': [0, 1, 1, 2]})
+        df = geo_etl.create_index_column(df)
+        self.assertEqual(['play_0_1', 'play_1_1', 'play_1_2', 'play_2_1'], list(df['id']))
+        self.assertEqual(['c', 'r1', 'r2', 'd1'], list(df['dhis2_id']))
+
+    def test_registered_ids_are_kept(self):
+        geo_etl.create_index_column(pd.DataFrame({'id': ['c', 'r1', 'r2', 'd1'], 'admin_level': [0, 1, 1, 2]}))
+        # a new region sorted before the others, r2 removed and d1 moved up a level
+        df = geo_etl.create_index_column(pd.DataFrame({'id': ['c', 'r0', 'r1', 'd1'], 'admin_level': [0, 1, 1, 1]}))
+        self.assertEqual(['play_0_1', 'play_1_3', 'play_1_1', 'play_1_4'], list(df['id']))
+
+        # removed ids are not reused
+        df = geo_etl.create_index_column(pd.DataFrame({'id': ['c', 'r2'], 'admin_level': [0, 1]}))
+        self.assertEqual(['play_0_1', 'play_1_2'], list(df['id']))
+        registry = pd.read_csv(os.path.join(self.tmp_dir.name, 'area_id_registry.csv'))
+        self.assertEqual(6, len(registry))
+
+    def test_hand_edited_registry(self):
+        with open(os.path.join(self.tmp_dir.name, 'area_id_registry.csv'), 'w') as f:
+            f.write("dhis2_id,area_id,area_level\nr1,play_1_2,1\n")
+        df = geo_etl.create_index_column(pd.DataFrame({'id': ['r1', 'r2'], 'admin_level': [1, 1]}))
+        self.assertEqual(['play_1_2', 'play_1_3'], list(df['id']))
+
+    def test_registry_starts_from_previous_id_mapping(self):
+        os.makedirs(os.path.join(self.tmp_dir.name, 'geodata'))
+        with open(os.path.join(self.tmp_dir.name, 'geodata', 'dhis2_id_mapping.csv'), 'w') as f:
+            f.write("area_id,map_level,map_name,map_id,map_source\n"
+                    "play_0_1,0,Country,c,DHIS2\nplay_1_1,1,Region 2,r2,DHIS2\n")
+        df = geo_etl.create_index_column(pd.DataFrame({'id': ['c', 'r1', 'r2'], 'admin_level': [0, 1, 1]}))
+        self.assertEqual(['play_0_1', 'play_1_2', 'play_1_1'], list(df['id']))
+        registry = pd.read_csv(os.path.join(self.tmp_dir.name, 'area_id_registry.csv'))
+        self.assertEqual(['c', 'r2', 'r1'], list(registry['dhis2_id']))
+
+    def test_registry_is_written_without_new_ids(self):
+        os.makedirs(os.path.join(self.tmp_dir.name, 'geodata'))
+        with open(os.path.join(self.tmp_dir.name, 'geodata', 'dhis2_id_mapping.csv'), 'w') as f:
+            f.write("area_id,map_level,map_name,map_id,map_source\nplay_0_1,0,Country,c,DHIS2\n")
+        geo_etl.create_index_column(pd.DataFrame({'id': ['c'], 'admin_level': [0]}))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, 'area_id_registry.csv')))
+
+
+class TestDroppedFacilities(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        geo_etl.OUTPUT_DIR_NAME = self.tmp_dir.name
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_dropped_facilities_are_written_after_the_memoized_stage(self):
+        df = pd.DataFrame({'id': ['a', 'f1', 'f2'], 'featureType': ['POLYGON', 'POINT', 'POINT'],
+                           'coordinates': ['[[[0,0],[1,0],[1,1],[0,0]]]', '[1,2]', '[x]']})
+        df = geo_etl.extract_geo_data(df)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, 'geodata_errors')))
+        df = geo_etl.drop_faulty_facilities(df)
+        self.assertEqual(['a', 'f1'], list(df['id']))
+        self.assertNotIn('dropped_coordinates', df)
+        dropped = pd.read_csv(os.path.join(self.tmp_dir.name, 'geodata_errors', 'dropped_facilities.csv'))
+        self.assertEqual(['id', 'featureType', 'coordinates'], list(dropped))
+        self.assertEqual(['f2'], list(dropped['id']))
+
+
 def create_test(csv_file):
     dirname = os.path.dirname(__file__)
     def do_test_expected(self):
@@ -1,12 +1,59 @@
+import json
 import unittest
+from unittest import mock
 import pandas.util.testing as pd_test
 import os
 import shutil
+import tempfile
+from types import SimpleNamespace
+from urllib.parse import unquote
 
 import adr_dhis2_pivot_table_etl as pivot_etl
+import program_config
 import pandas as pd
 
 
+def fake_client(df, periods=None, requested=None):
+    """A DHIS2 client answering the pivot table requests from the data values in `df`.
+
+    `df` holds the data of every pivot table, or is a dict of it by pivot table id. A pivot table has the data
+    elements and org units of its data and `periods`, by default the periods of its data. Requested resources
+    are appended to `requested`.
+    """
+    data_values = pd.concat(df.values(), ignore_index=True) if isinstance(df, dict) else df
+
+    class FakeClient:
+        def get(self, resource):
+            if requested is not None:
+                requested.append(resource)
+            if resource.startswith('reportTables/'):
+                table_df = df[resource.split('/')[-1]] if isinstance(df, dict) else df
+                table_periods = periods if periods is not None else sorted(table_df['period'].unique())
+                return SimpleNamespace(text=json.dumps({
+                    'dataDimensionItems': [{'dataDimensionItemType': 'DATA_ELEMENT', 'dataElement': {'id': x}}
+                                           for x in table_df['dataElement'].unique()],
+                    'organisationUnits': [{'id': x} for x in table_df['orgUnit'].unique()],
+                    'periods': [{'id': x} for x in table_periods]
+                }))
+            dimensions = dict(x.split('=')[1].split(':') for x in unquote(resource).split('?')[1].split('&')
+                              if ':' in x)
+            if resource.startswith('analytics/dataValueSet'):
+                chunk = data_values[data_values['period'].isin(dimensions['pe'].split(';'))]
+                return SimpleNamespace(text=json.dumps({'dataValues': chunk.to_dict(orient='records')}))
+            # data element and category option combo pairs of the config templates
+            pairs = data_values[data_values['dataElement'].isin(dimensions['dx'].split(';')) &
+                                data_values['orgUnit'].isin(dimensions['ou'].split(';'))]
+            pairs = pairs[['dataElement', 'categoryOptionCombo']].drop_duplicates()
+            return SimpleNamespace(text=json.dumps({'headers': [{'name': 'dx'}, {'name': 'co'}],
+                                                    'rows': pairs.values.tolist()}))
+
+    return FakeClient()
+
+
+def requested_periods(requested):
+    return [unquote(x).split('dimension=pe:')[1].split('&')[0].split(';') for x in requested if 'dimension=pe:' in x]
+
+
 class TestPivotTableETLGoldenMaster(unittest.TestCase):
 
     @classmethod
@@ -40,6 +87,156 @@ class TestPivotTableETLGoldenMaster(unittest.TestCase):
 
         pd_test.assert_frame_equal(expected, actual, check_dtype=False)
 
+    def test_play_anc_pull_in_chunks(self):
+        dirname = os.path.dirname(__file__)
+        pivot_table_id = 'wIpu9GVn5gG'
+        input_df = pivot_etl.get_dhis2_pivot_table_data(pivot_table_id, from_pickle=True)
+
+        output_path = os.path.join(dirname, 'output/build/actual_chunked.csv')
+        with mock.patch.object(pivot_etl, '__get_dhis2_client', return_value=fake_client(input_df)):
+            pivot_etl.run_chunked_pipeline(pivot_table_id, output_path)
+        key = ['area_id', 'area_name', 'year', 'age_group']
+        actual = pd.read_csv(output_path).sort_values(key).reset_index(drop=True)
+        expected = pd.read_csv(os.path.join(dirname, 'resources/pivot_table/play_dhis2_pull_anc.csv'))
+        expected = expected.sort_values(key).reset_index(drop=True)
+
+        pd_test.assert_frame_equal(expected, actual, check_dtype=False)
+
+    def test_play_anc_pull_incrementally(self):
+        dirname = os.path.dirname(__file__)
+        pivot_table_id = 'wIpu9GVn5gG'
+        input_df = pivot_etl.get_dhis2_pivot_table_data(pivot_table_id, from_pickle=True)
+        all_periods = sorted(input_df['period'].unique())
+        requested = []
+
+        output_dir_name = pivot_etl.OUTPUT_DIR_NAME
+        # 2010 has no values
+        client = fake_client(input_df, periods=['2010'] + all_periods, requested=requested)
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(pivot_etl, '__get_dhis2_client', return_value=client), \
+                mock.patch.dict(os.environ, {'INCREMENTAL_PERIODS': '1'}):
+            pivot_etl.OUTPUT_DIR_NAME = tmp_dir
+            try:
+                pivot_etl.get_dhis2_pivot_table_data(pivot_table_id, incremental=True)
+                stored_df = pivot_etl.get_dhis2_pivot_table_data(pivot_table_id, incremental=True)
+            finally:
+                pivot_etl.OUTPUT_DIR_NAME = output_dir_name
+        self.assertEqual([['2010'] + all_periods, all_periods[-1:]], requested_periods(requested))
+
+        key = ['area_id', 'area_name', 'year', 'age_group']
+        actual = pivot_etl.run_pipeline(stored_df)
+        actual.to_csv(os.path.join(dirname, 'output/build/actual_incremental.csv'), index=False)
+        actual = pd.read_csv(os.path.join(dirname, 'output/build/actual_incremental.csv'))
+        actual = actual.sort_values(key).reset_index(drop=True)
+        expected = pd.read_csv(os.path.join(dirname, 'resources/pivot_table/play_dhis2_pull_anc.csv'))
+        expected = expected.sort_values(key).reset_index(drop=True)
+
+        pd_test.assert_frame_equal(expected, actual, check_dtype=False)
+
+    def test_incremental_pull_in_chunks_is_rejected(self):
+        with mock.patch('sys.stderr'), self.assertRaises(SystemExit) as cm:
+            pivot_etl.main(['--incremental', '--chunked'])
+        self.assertEqual(2, cm.exception.code)
+
+    def test_monthly_pull_rolled_up(self):
+        dirname = os.path.dirname(__file__)
+        input_df = pivot_etl.get_dhis2_pivot_table_data('wIpu9GVn5gG', from_pickle=True)
+        # the quarters of the pull split into two months with the same values
+        monthly_df = pd.concat([input_df.astype({'period': object}).replace({'period': months})
+                                for months in ({'2018Q4': '201810', '2019Q4': '201911'},
+                                               {'2018Q4': '201812', '2019Q4': '201912'})], ignore_index=True)
+        expected = pd.read_csv(os.path.join(dirname, 'resources/pivot_table/play_dhis2_pull_anc.csv'))
+        expected['anc_clients'] *= 2
+
+        with mock.patch.object(pivot_etl, 'PERIOD_TYPE', 'Yearly'):
+            actual = pivot_etl.run_pipeline(monthly_df.copy())
+        self.assertEqual(list(expected['year'].astype(str)), list(actual['year']))
+        self.assertEqual(list(expected['anc_clients']), list(actual['anc_clients']))
+
+        with mock.patch.object(pivot_etl, 'PERIOD_TYPE', 'Quarterly'):
+            actual = pivot_etl.run_pipeline(monthly_df.copy())
+        self.assertEqual([f"{x}Q4" for x in expected['year']], list(actual['quarter']))
+        self.assertEqual(list(expected['anc_clients']), list(actual['anc_clients']))
+
+        with mock.patch.object(pivot_etl, 'PERIOD_TYPE', 'FinancialOct'), self.assertRaises(ValueError):
+            pivot_etl.run_pipeline(monthly_df.assign(period='2019'))
+
+    def test_quarters_pulled_by_month_in_chunks(self):
+        dirname = os.path.dirname(__file__)
+        input_df = pivot_etl.get_dhis2_pivot_table_data('wIpu9GVn5gG', from_pickle=True)
+        monthly_df = input_df.astype({'period': object}).replace({'period': {'2018Q4': '201811', '2019Q4': '201910'}})
+        requested = []
+
+        output_path = os.path.join(dirname, 'output/build/actual_monthly.csv')
+        client = fake_client(monthly_df, periods=['2018Q4', '2019Q4'], requested=requested)
+        with mock.patch.object(pivot_etl, '__get_dhis2_client', return_value=client), \
+                mock.patch.object(pivot_etl, 'PERIOD_TYPES', ['Yearly', 'Quarterly']), \
+                mock.patch.object(pivot_etl, 'PERIOD_TYPE', 'Yearly'), \
+                mock.patch.object(pivot_etl, 'PULL_PERIOD_TYPE', 'Monthly'):
+            pivot_etl.run_chunked_pipeline('wIpu9GVn5gG', output_path)
+        self.assertEqual(['201810', '201811', '201812', '201910', '201911', '201912'],
+                         [x for periods in requested_periods(requested) for x in periods])
+        key = ['area_id', 'area_name', 'year', 'age_group']
+        expected = pd.read_csv(os.path.join(dirname, 'resources/pivot_table/play_dhis2_pull_anc.csv'))
+        expected = expected.sort_values(key).reset_index(drop=True)
+        actual = pd.read_csv(output_path).sort_values(key).reset_index(drop=True)
+        pd_test.assert_frame_equal(expected, actual, check_dtype=False)
+
+        quarterly = pd.read_csv(os.path.join(dirname, 'output/build/actual_monthly_quarterly.csv'))
+        self.assertEqual(['area_id', 'area_name', 'quarter', 'age_group', 'anc_clients'], list(quarterly))
+        quarterly = quarterly.sort_values(['area_id', 'area_name', 'quarter', 'age_group']).reset_index(drop=True)
+        self.assertEqual([f"{x}Q4" for x in expected['year']], list(quarterly['quarter']))
+        self.assertEqual(list(expected['anc_clients']), list(quarterly['anc_clients']))
+
+    def test_unmapped_categories(self):
+        input_df = pivot_etl.get_dhis2_pivot_table_data('wIpu9GVn5gG', from_pickle=True)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            category_config = os.path.join(tmp_dir, 'category_config.json')
+            with open(category_config, 'w') as f:
+                json.dump([{'id': 'PT59n8BQbqM', 'mapping': {}}], f)
+            with mock.patch.object(pivot_etl, 'PROGRAM_DATA_CATEGORY_CONFIG', category_config), \
+                    mock.patch.object(pivot_etl, 'PROGRAM_DATA_COLUMN_CONFIG', ''):
+                with self.assertRaises(program_config.ConfigError) as cm:
+                    pivot_etl.run_pipeline(input_df)
+        self.assertIn('pq2XI5kz2BY', str(cm.exception))
+        self.assertNotIn('PT59n8BQbqM', str(cm.exception))
+
+    def test_config_templates_of_tables_with_the_same_filters_from_one_pull(self):
+        requested = []
+        columns = ['dataElement', 'categoryOptionCombo', 'orgUnit', 'period', 'value']
+        table_values = {
+            't1': pd.DataFrame([['fbfJHSPpUQD', 'PT59n8BQbqM', 'ImspTQPwCqd', '2019', '10'],
+                                ['fbfJHSPpUQD', 'pq2XI5kz2BY', 'ImspTQPwCqd', '2019', '5']], columns=columns),
+            't2': pd.DataFrame([['cYeuwXTCPkU', 'pq2XI5kz2BY', 'ImspTQPwCqd', '2019', '3']], columns=columns),
+            't3': pd.DataFrame([['fbfJHSPpUQD', 'PT59n8BQbqM', 'O6uvpzGd5pu', '2019', '1'],
+                                ['fbfJHSPpUQD', 'pq2XI5kz2BY', 'O6uvpzGd5pu', '2019', '2']], columns=columns)
+        }
+
+        output_dir_name = pivot_etl.OUTPUT_DIR_NAME
+        client = fake_client(table_values, requested=requested)
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(pivot_etl, '__get_dhis2_client', return_value=client), \
+                mock.patch.object(pivot_etl, 'category_combos',
+                                  pd.DataFrame({'id': ['PT59n8BQbqM'], 'name': ['Outreach "mobile"']})):
+            pivot_etl.OUTPUT_DIR_NAME = tmp_dir
+            try:
+                tables = pivot_etl.get_dhis2_pivot_tables_config_data(['t1', 't2', 't3'])
+                pivot_etl.TABLE_TYPE = 't1'
+                pivot_etl.export_category_config(tables['t1'])
+                with open(os.path.join(tmp_dir, 'configs/t1_category_config.json')) as f:
+                    category_config = json.load(f)
+            finally:
+                pivot_etl.OUTPUT_DIR_NAME = output_dir_name
+        analytics_requests = sorted((x for x in requested if x.startswith('analytics')), key=len, reverse=True)
+        self.assertEqual(2, len(analytics_requests))
+        self.assertIn('dimension=dx:fbfJHSPpUQD;cYeuwXTCPkU&dimension=co&filter=ou:ImspTQPwCqd&',
+                      analytics_requests[0])
+        self.assertIn('dimension=dx:fbfJHSPpUQD&dimension=co&filter=ou:O6uvpzGd5pu&', analytics_requests[1])
+        self.assertEqual(['cYeuwXTCPkU'], list(tables['t2']['dataElement']))
+        self.assertEqual(['fbfJHSPpUQD', 'fbfJHSPpUQD'], list(tables['t3']['dataElement']))
+        self.assertEqual([('PT59n8BQbqM', 'Outreach "mobile"'), ('pq2XI5kz2BY', 'pq2XI5kz2BY')],
+                         [(x['id'], x['name']) for x in category_config])
+
 
 if __name__ == '__main__':
     unittest.main()
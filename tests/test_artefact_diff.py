@@ -0,0 +1,85 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import artefact_diff
+
+
+class TestArtefactDiff(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.previous = pd.DataFrame({
+            'area_id': ['a', 'b', 'c'],
+            'area_name': ['A', 'B', 'C'],
+            'parent_area_id': ['a', 'a', 'a'],
+        })
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_compare(self):
+        current = pd.DataFrame({
+            'area_id': ['a', 'c', 'd'],
+            'area_name': ['A', 'C renamed', 'D'],
+            'parent_area_id': ['a', 'b', 'a'],
+        })
+        added, removed, changed = artefact_diff.compare(self.previous, current, ['area_id'])
+        self.assertEqual(['d'], list(added['area_id']))
+        self.assertEqual(['b'], list(removed['area_id']))
+        self.assertEqual(['c'], list(changed['area_id']))
+        self.assertEqual(['area_name;parent_area_id'], list(changed['changed_columns']))
+
+    def test_compare_duplicate_keys_and_new_columns(self):
+        previous = pd.DataFrame({'area_id': ['a', 'a'], 'year': ['2020', '2020'], 'tested': ['1', '2']})
+        current = pd.DataFrame({'area_id': ['a', 'a', 'a'], 'year': ['2020', '2020', '2020'],
+                                'tested': ['1', '3', '4'], 'positive': ['', '', '']})
+        added, removed, changed = artefact_diff.compare(previous, current, ['area_id', 'year'])
+        self.assertEqual(['4'], list(added['tested']))
+        self.assertTrue(removed.empty)
+        self.assertEqual(['3'], list(changed['tested']))
+        self.assertEqual(['tested'], list(changed['changed_columns']))
+
+    def test_diff_table_between_runs(self):
+        output_dir = self.tmp_dir.name
+        counts = artefact_diff.diff_table(output_dir, 'geodata/location_hierarchy', self.previous, ['area_id'])
+        self.assertEqual({'added': 3, 'removed': 0, 'changed': 0, 'unchanged': 0, 'first_run': True}, counts)
+
+        current = self.previous.assign(area_sort_order=[1.0, 2.0, 3.0])
+        current.loc[1, 'area_name'] = 'B renamed'
+        counts = artefact_diff.diff_table(output_dir, 'geodata/location_hierarchy', current, ['area_id'],
+                                          float_format='%.f')
+        self.assertEqual({'added': 0, 'removed': 0, 'changed': 3, 'unchanged': 0, 'first_run': False}, counts)
+        changed = pd.read_csv(os.path.join(output_dir, 'delta/geodata/location_hierarchy_changed.csv'), dtype=str)
+        self.assertEqual(['1', '2', '3'], list(changed['area_sort_order']))
+        self.assertEqual('area_name;area_sort_order', changed['changed_columns'][1])
+
+        counts = artefact_diff.diff_table(output_dir, 'geodata/location_hierarchy', current, ['area_id'],
+                                          float_format='%.f')
+        self.assertEqual(3, counts['unchanged'])
+        with open(os.path.join(output_dir, 'delta/summary.json')) as f:
+            summary = json.load(f)
+        self.assertEqual(3, summary['artefacts']['geodata/location_hierarchy']['unchanged'])
+
+    def test_diff_features(self):
+        def feature(area_id, x):
+            return {'type': 'Feature', 'properties': {'area_id': area_id},
+                    'geometry': {'type': 'Point', 'coordinates': [x, 0]}}
+        artefact_diff.diff_features(self.tmp_dir.name, 'geodata/areas', [feature('a', 0), feature('b', 0)])
+        counts = artefact_diff.diff_features(self.tmp_dir.name, 'geodata/areas', [feature('a', 1)])
+        self.assertEqual((0, 1, 1), (counts['added'], counts['removed'], counts['changed']))
+        with open(os.path.join(self.tmp_dir.name, 'delta/geodata/areas_changed.geojson')) as f:
+            self.assertEqual([feature('a', 1)], json.load(f)['features'])
+
+    def test_disabled(self):
+        with mock.patch.dict(os.environ, {'DELTA_ARTEFACTS': 'false'}):
+            self.assertIsNone(artefact_diff.diff_table(self.tmp_dir.name, 'geodata/location_hierarchy',
+                                                       self.previous, ['area_id']))
+        self.assertEqual([], os.listdir(self.tmp_dir.name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from datetime import date
+
+import pandas as pd
+
+import data_value_sets
+
+
+class TestDataValueSets(unittest.TestCase):
+    def setUp(self) -> None:
+        self.paths = pd.Series({
+            'root': '/root',
+            'dA': '/root/dA',
+            'dB': '/root/dB',
+            'f1': '/root/dA/f1',
+            'f2': '/root/dA/f2',
+            'f3': '/root/dB/f3'
+        })
+
+    def test_period_date_range(self):
+        self.assertEqual((date(2019, 1, 1), date(2019, 12, 31)), data_value_sets.period_date_range('2019'))
+        self.assertEqual((date(2020, 2, 1), date(2020, 2, 29)), data_value_sets.period_date_range('202002'))
+        self.assertEqual((date(2019, 10, 1), date(2019, 12, 31)), data_value_sets.period_date_range('2019Q4'))
+        self.assertEqual((date(2019, 7, 1), date(2019, 12, 31)), data_value_sets.period_date_range('2019S2'))
+        self.assertEqual((date(2019, 12, 30), date(2020, 1, 5)), data_value_sets.period_date_range('2020W1'))
+        self.assertEqual((date(2019, 4, 1), date(2020, 3, 31)), data_value_sets.period_date_range('2019April'))
+        with self.assertRaises(ValueError):
+            data_value_sets.period_date_range('LAST_12_MONTHS')
+
+    def test_get_resources(self):
+        resources = data_value_sets.get_resources(['de1', 'de2'], ['dA', 'dB'], ['2019Q1'])
+        self.assertEqual(2, len(resources))
+        self.assertEqual("dataValueSets.json?dataElement=de1&dataElement=de2&orgUnit=dA&children=true&"
+                         "startDate=2019-01-01&endDate=2019-03-31", resources[0])
+
+    def test_hierarchy_roots(self):
+        self.assertEqual(['root'], data_value_sets.hierarchy_roots(self.paths))
+        subtree = self.paths.drop('root').str.replace('/root', '/world/root')
+        self.assertEqual(['dA', 'dB'], data_value_sets.hierarchy_roots(subtree))
+        self.assertEqual([], data_value_sets.hierarchy_roots(pd.Series(dtype=object)))
+
+    def test_map_org_units(self):
+        explicit = data_value_sets.map_org_units(self.paths, ['dA', 'f3'], [])
+        self.assertEqual({('dA', 'dA'), ('f1', 'dA'), ('f2', 'dA'), ('f3', 'f3')},
+                         set(explicit.itertuples(index=False, name=None)))
+        by_level = data_value_sets.map_org_units(self.paths, ['dB'], [2])
+        self.assertEqual({('dB', 'dB'), ('f3', 'dB')}, set(by_level.itertuples(index=False, name=None)))
+
+    def test_aggregate_data_values(self):
+        raw = pd.DataFrame([
+            ['de1', 'co1', 'aoc', 'f1', '201901', '1'],
+            ['de1', 'co1', 'aoc', 'f2', '201902', '2'],
+            ['de1', 'co1', 'aoc', 'f2', '201902', '2'],  # pulled twice by overlapping requests
+            ['de1', 'co1', 'aoc', 'f3', '201903', '4'],
+            ['de1', 'co1', 'aoc', 'f3', '201904', 'text'],
+            ['de1', 'co1', 'aoc', 'f3', '202001', '8']
+        ], columns=data_value_sets.RAW_DATA_VALUE_KEY + ['value'])
+        df = data_value_sets.aggregate_data_values(raw, self.paths, ['root'], [2], ['2019'])
+        values = df.astype({'orgUnit': object, 'period': object}).set_index(['orgUnit', 'period'])['value']
+        self.assertEqual({('dA', '2019'): 3, ('dB', '2019'): 4}, values.to_dict())
+        empty = data_value_sets.aggregate_data_values(pd.DataFrame(), self.paths, ['root'], [2], ['2019'])
+        self.assertEqual(['dataElement', 'categoryOptionCombo', 'orgUnit', 'period', 'value'], list(empty))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import dhis2_client
+from http_cache import HTTPCache
+
+
+class FakeDHIS2Handler(BaseHTTPRequestHandler):
+    failures_left = 0
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            fail = server.failures_left > 0
+            if fail:
+                server.failures_left -= 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+        if fail:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = f'"{server.version}-{len(self.path)}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        body = json.dumps({'path': self.path, 'version': server.version}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeDHIS2Server(ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeDHIS2Handler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.failures_left = 0
+        self.delay = 0
+        self.version = 1
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api/"
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TestDHIS2Client(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = FakeDHIS2Server()
+        self.client = dhis2_client.DHIS2Client(self.server.url, 'admin', 'district', timeout=5,
+                                               backoff_factor=0)
+
+    def tearDown(self) -> None:
+        self.server.stop()
+
+    def test_get_decompresses_gzip_response(self):
+        r = self.client.get('dataElements?paging=false')
+        self.assertEqual('/api/dataElements?paging=false', r.json()['path'])
+        self.assertEqual('gzip', r.headers['Content-Encoding'])
+
+    def test_get_retries_server_errors(self):
+        self.server.failures_left = 2
+        r = self.client.get('organisationUnits.csv')
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(3, len(self.server.requests))
+        self.assertEqual(2, self.client.stats[-1].retries)
+
+    def test_get_raises_when_retries_exhausted(self):
+        self.server.failures_left = 10
+        client = dhis2_client.DHIS2Client(self.server.url, 'admin', 'district', retries=1, backoff_factor=0)
+        with self.assertRaises(ConnectionError):
+            client.get('organisationUnits.csv')
+
+    def test_stats_are_recorded_per_request(self):
+        self.client.get('a')
+        self.client.get('b')
+        self.assertEqual([f"{self.server.url}a", f"{self.server.url}b"], [x.url for x in self.client.stats])
+
+
+class TestAsyncDHIS2Client(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = FakeDHIS2Server()
+        self.client = dhis2_client.DHIS2Client(self.server.url, 'admin', 'district', timeout=5,
+                                               backoff_factor=0)
+
+    def tearDown(self) -> None:
+        self.server.stop()
+
+    def test_get_many_returns_responses_in_order(self):
+        resources = [f"reportTables/{x}" for x in range(6)]
+        responses = dhis2_client.get_many(resources, client=self.client, max_concurrency=3)
+        self.assertEqual([f"/api/{x}" for x in resources], [r.json()['path'] for r in responses])
+
+    def test_independent_requests_overlap(self):
+        self.server.delay = 0.3
+        start = time.perf_counter()
+        dhis2_client.get_many(['a', 'b', 'c', 'd'], client=self.client, max_concurrency=4)
+        self.assertLess(time.perf_counter() - start, 0.9)
+        self.assertEqual(4, self.server.max_in_flight)
+
+    def test_concurrency_is_bounded(self):
+        self.server.delay = 0.1
+        dhis2_client.get_many([str(x) for x in range(8)], client=self.client, max_concurrency=2)
+        self.assertEqual(2, self.server.max_in_flight)
+
+    def test_dependent_requests_chain_within_run_async(self):
+        async def fetch_chain(async_client, name):
+            first = await async_client.get(f"reportTables/{name}")
+            return await async_client.get(f"analytics?from={first.json()['path']}")
+
+        async def fetch_all(async_client):
+            return await asyncio.gather(*[fetch_chain(async_client, x) for x in ['t1', 't2']])
+
+        self.server.delay = 0.2
+        start = time.perf_counter()
+        responses = dhis2_client.run_async(fetch_all, client=self.client, max_concurrency=2)
+        self.assertLess(time.perf_counter() - start, 0.7)
+        self.assertEqual('/api/analytics?from=/api/reportTables/t1', responses[0].json()['path'])
+
+
+class TestHTTPCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = FakeDHIS2Server()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.client = dhis2_client.DHIS2Client(self.server.url, 'admin', 'district', timeout=5,
+                                               cache=HTTPCache(self.cache_dir.name))
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        self.cache_dir.cleanup()
+
+    def test_unchanged_resource_is_served_from_cache(self):
+        first = self.client.get('organisationUnits.csv?paging=false')
+        second = self.client.get('organisationUnits.csv?paging=false')
+        self.assertEqual([200, 304], [x.status_code for x in self.client.stats])
+        self.assertEqual(200, second.status_code)
+        self.assertEqual(first.json(), second.json())
+
+    def test_missing_cache_entry_is_requested_again(self):
+        first = self.client.get('organisationUnits.csv?paging=false')
+        headers = self.client.cache.conditional_headers(first.url)
+        for file_name in os.listdir(self.cache_dir.name):
+            os.remove(os.path.join(self.cache_dir.name, file_name))
+        # the entry disappears between reading the validators and the 304 response
+        with mock.patch.object(self.client.cache, 'conditional_headers', return_value=headers):
+            second = self.client.get('organisationUnits.csv?paging=false')
+        self.assertEqual([200, 304, 200], [x.status_code for x in self.client.stats])
+        self.assertEqual(first.json(), second.json())
+
+    def test_changed_resource_is_downloaded_again(self):
+        self.client.get('reportTables/abc')
+        self.server.version = 2
+        r = self.client.get('reportTables/abc')
+        self.assertEqual([200, 200], [x.status_code for x in self.client.stats])
+        self.assertEqual(2, r.json()['version'])
+
+    def test_query_is_part_of_the_key(self):
+        self.client.get('analytics?pe=2019')
+        r = self.client.get('analytics?pe=2020')
+        self.assertEqual([200, 200], [x.status_code for x in self.client.stats])
+        self.assertEqual('/api/analytics?pe=2020', r.json()['path'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+import pandas as pd
+
+import dhis2_periods
+
+
+class TestDHIS2Periods(unittest.TestCase):
+    def test_parse(self):
+        parsed = dhis2_periods.parse(['20200229', '2020W53', '2019BiW1', '201902B', '2019S2', '2019Oct'])
+        self.assertEqual(['Daily', 'Weekly', 'BiWeekly', 'BiMonthly', 'SixMonthly', 'FinancialOct'],
+                         list(parsed['period_type']))
+        self.assertEqual([2020, 2020, 2019, 2019, 2019, 2019], list(parsed['year']))
+        self.assertEqual(['2020-02-29', '2020-12-28', '2018-12-31', '2019-03-01', '2019-07-01', '2019-10-01'],
+                         list(parsed['start'].dt.strftime('%Y-%m-%d')))
+        self.assertEqual(['2020-02-29', '2021-01-03', '2019-01-13', '2019-04-30', '2019-12-31', '2020-09-30'],
+                         list(parsed['end'].dt.strftime('%Y-%m-%d')))
+        with self.assertRaises(ValueError) as cm:
+            dhis2_periods.parse(['2019', '201913', '2019W53', '20190229', 'LAST_12_MONTHS'])
+        self.assertEqual('Unsupported DHIS2 periods "201913", "2019W53", "20190229", "LAST_12_MONTHS"',
+                         str(cm.exception))
+
+    def test_latest(self):
+        self.assertEqual(['2019W9', '2019W10'], dhis2_periods.latest(['2019W10', '2019W8', '2019W9'], 2))
+        self.assertEqual(['2019Q4', '2020'], dhis2_periods.latest(['2020', '2019Q4', '201901'], 2))
+        self.assertEqual([], dhis2_periods.latest(['2019'], 0))
+
+    def test_roll_up(self):
+        periods = pd.Series(['201903', '201904', '2019W1', '2020W1', '2019W26', '2019Q2'], dtype='category')
+        self.assertEqual(['2019', '2019', '2019', '2020', '2019', '2019'],
+                         list(dhis2_periods.roll_up(periods, 'Yearly')))
+        # weeks go to the period of their Thursday
+        self.assertEqual(['2019Q1', '2019Q2', '2019Q1', '2020Q1', '2019Q2', '2019Q2'],
+                         list(dhis2_periods.roll_up(periods, 'Quarterly')))
+        self.assertEqual(['2018April', '2019April', '2018April', '2019April', '2019April', '2019April'],
+                         list(dhis2_periods.roll_up(periods, 'FinancialApril')))
+        self.assertEqual(['2018Oct', '2018Oct', '2018Oct', '2019Oct', '2018Oct', '2018Oct'],
+                         list(dhis2_periods.roll_up(periods, 'FinancialOct')))
+        with self.assertRaises(ValueError):
+            dhis2_periods.roll_up(periods, 'Monthly')
+        with self.assertRaises(ValueError):
+            dhis2_periods.roll_up(periods, 'Weekly')
+
+    def test_split(self):
+        self.assertEqual(['2019Q1', '2019Q2', '2019Q3', '2019Q4', '201905', '2019W3'],
+                         dhis2_periods.split(['2019', '201905', '2019Q2', '2019W3'], 'Quarterly'))
+        self.assertEqual(['201904', '201905', '201906'] + [f"2019{x:02d}" for x in range(7, 13)] +
+                         ['202001', '202002', '202003'], dhis2_periods.split(['2019April'], 'Monthly'))
+        with self.assertRaises(ValueError):
+            dhis2_periods.split(['2019Nov'], 'Quarterly')
+
+
+if __name__ == '__main__':
+    unittest.main()
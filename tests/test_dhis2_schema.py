@@ -0,0 +1,40 @@
+import unittest
+
+import pandas as pd
+
+import dhis2_schema
+
+
+class TestDHIS2Schema(unittest.TestCase):
+    def test_compact_data_values(self):
+        df = pd.DataFrame({
+            'dataElement': ['de1', 'de2', 'de1'],
+            'orgUnit': ['ou1', 'ou1', 'ou2'],
+            'period': ['2019', '2018', '2019'],
+            'value': ['1', '2.5', 'x']
+        })
+        df = dhis2_schema.compact_data_values(df)
+        for column in ['dataElement', 'orgUnit', 'period']:
+            self.assertIsInstance(df[column].dtype, pd.CategoricalDtype)
+        self.assertEqual(['2018', '2019'], list(df['period'].cat.categories))
+        self.assertTrue(pd.api.types.is_numeric_dtype(df['value']))
+        self.assertTrue(df['value'].isna().iloc[2])
+        pd.testing.assert_frame_equal(df, dhis2_schema.compact_data_values(df.copy()))
+
+    def test_replace_values_matches_replace(self):
+        series = pd.Series(['b', 'a', None, 'c', 'a'])
+        mapping = pd.Series({'a': 'z', 'c': 'a'})
+        replaced = dhis2_schema.replace_values(series, mapping)
+        self.assertIsInstance(replaced.dtype, pd.CategoricalDtype)
+        self.assertEqual(list(series.replace(mapping).fillna('-')), list(replaced.astype(object).fillna('-')))
+        self.assertEqual(sorted(replaced.cat.categories), list(replaced.cat.categories))
+
+    def test_fillna_categorical(self):
+        df = pd.DataFrame({'sex': pd.Categorical(['male', None]), 'age': ['15-49', None]})
+        df = dhis2_schema.fillna(df, ['sex', 'age'])
+        self.assertEqual(['male', ''], list(df['sex']))
+        self.assertEqual(['15-49', ''], list(df['age']))
+
+
+if __name__ == '__main__':
+    unittest.main()
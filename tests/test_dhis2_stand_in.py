@@ -0,0 +1,95 @@
+import io
+import json
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+
+import data_value_sets
+import dhis2_client
+from benchmarks import dhis2_stand_in
+from http_cache import HTTPCache
+
+
+class TestDHIS2StandIn(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.responses = dhis2_stand_in.SyntheticResponses(200, 2_000)
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def client(self, stand_in, **kwargs):
+        return dhis2_client.DHIS2Client(stand_in.url, 'admin', 'district', **{'backoff_factor': 0, **kwargs})
+
+    def test_org_units_are_gzipped(self):
+        with dhis2_stand_in.StandIn(self.responses) as stand_in:
+            r = self.client(stand_in).get("organisationUnits.csv?paging=false&fields=id,name,path,coordinates")
+        self.assertEqual('gzip', r.headers['Content-Encoding'])
+        org_units = pd.read_csv(io.StringIO(r.text))
+        self.assertEqual(len(self.responses.org_units), len(org_units))
+        self.assertIn('coordinates', list(org_units))
+        self.assertLess(stand_in.stats['bytes_sent'], len(r.content))
+
+    def test_pivot_table_pulls_match(self):
+        with dhis2_stand_in.StandIn(self.responses, gzip_enabled=False) as stand_in:
+            client = self.client(stand_in)
+            report_table = client.get(f"reportTables/{dhis2_stand_in.SYNTHETIC_PIVOT_TABLE_ID}").json()
+            data_elements = [x['dataElement']['id'] for x in report_table['dataDimensionItems']]
+            periods = [x['id'] for x in report_table['periods']]
+            analytics = client.get(f"analytics/dataValueSet.json?dimension=dx:{';'.join(data_elements)}&"
+                                   f"dimension=co&dimension=pe:{';'.join(periods)}").json()['dataValues']
+            roots = [x['id'] for x in report_table['organisationUnits']]
+            raw = [x for resource in data_value_sets.get_resources(data_elements, roots, periods)
+                   for x in client.get(resource).json()['dataValues']]
+            page = client.get("organisationUnits?fields=id,path&pageSize=20&page=2").json()
+        # without gzip the client gets exactly the bytes sent
+        self.assertEqual(stand_in.stats['bytes_sent'], sum(x.bytes for x in client.stats))
+        self.assertEqual(len(self.responses.data_values), len(analytics))
+        self.assertEqual(len(analytics), len(raw))
+        self.assertEqual({'page': 2, 'pageCount': 10, 'total': 200, 'pageSize': 20}, page['pager'])
+        self.assertEqual(['id', 'path'], list(page['organisationUnits'][0]))
+
+    def test_injected_errors_are_retried(self):
+        with dhis2_stand_in.StandIn(self.responses, error_rate=1) as stand_in:
+            with self.assertRaises(ConnectionError):
+                self.client(stand_in, retries=2).get("dataElements?paging=false")
+        self.assertEqual(3, stand_in.stats['errors'])
+
+        # the first draw of seed 1 fails, the second one doesn't
+        with dhis2_stand_in.StandIn(self.responses, error_rate=0.5, seed=1, latency=0.1) as stand_in:
+            client = self.client(stand_in, retries=2)
+            start = time.perf_counter()
+            client.get("dataElements?paging=false")
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+        self.assertEqual((1, 1), (stand_in.stats['errors'], client.stats[0].retries))
+
+    def test_not_modified(self):
+        with dhis2_stand_in.StandIn(self.responses) as stand_in:
+            client = self.client(stand_in, cache=HTTPCache(self.tmp_dir.name))
+            first = client.get("categoryOptionCombos?paging=false&fields=id,name").text
+            second = client.get("categoryOptionCombos?paging=false&fields=id,name").text
+        self.assertEqual(first, second)
+        self.assertEqual(1, stand_in.stats['not_modified'])
+
+    def test_record_and_replay(self):
+        recorded = dhis2_stand_in.RecordedResponses(self.tmp_dir.name)
+        with dhis2_stand_in.StandIn(self.responses) as upstream:
+            recording = dhis2_stand_in.RecordingResponses(upstream.url, 'admin', 'district', recorded)
+            with dhis2_stand_in.StandIn(recording) as stand_in:
+                live = self.client(stand_in).get("dataElements?paging=false&fields=id,name").json()
+        with dhis2_stand_in.StandIn(recorded) as stand_in:
+            client = self.client(stand_in, retries=0)
+            self.assertEqual(live, client.get("dataElements?fields=id,name&paging=false").json())
+            with self.assertRaises(ConnectionError):
+                client.get("dataElements?paging=false")
+        self.assertEqual(1, stand_in.stats['not_found'])
+        self.assertEqual(json.loads(self.responses.get("dataElements?paging=false&fields=id,name")[2]), live)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import adr_dhis2_geodata_etl as geo_etl
+import dhis2_schema
+import geometry
+
+
+def square(min_x, min_y, size):
+    return [[[min_x, min_y], [min_x + size, min_y], [min_x + size, min_y + size], [min_x, min_y + size],
+             [min_x, min_y]]]
+
+
+class TestGeometry(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        geo_etl.OUTPUT_DIR_NAME = self.tmp_dir.name
+        geo_etl.AREAS_ADMIN_LEVEL = 1
+        self.df = pd.DataFrame([
+            ['c_0_1', 'Country', 'c0', 0, 'c_0_1', 'POLYGON', square(0, 0, 2), ''],
+            ['c_1_1', 'West', 'w1', 1, 'c_0_1', 'POLYGON', square(0, 0, 1), ''],
+            ['c_1_2', 'East', 'e1', 1, 'c_0_1', 'MULTI_POLYGON', [square(1, 0, 1)], ''],
+            ['c_1_3', 'No shape', 'n1', 1, 'c_0_1', 'NONE', [], ''],
+            ['c_2_1', 'West clinic', 'wc', 2, 'c_1_1', 'POINT', [], 0.5],
+            ['c_2_2', 'Misplaced clinic', 'mc', 2, 'c_1_1', 'POINT', [], 1.5],
+            ['c_2_3', 'Outside clinic', 'oc', 2, 'c_1_2', 'POINT', [], 5],
+            ['c_2_4', 'Unchecked clinic', 'uc', 2, 'c_1_3', 'POINT', [], 0.5],
+        ], columns=['id', 'name', 'dhis2_id', 'admin_level', 'parent_id', 'featureType', 'geoshape', 'long'])
+        self.df['lat'] = ['', '', '', '', 0.5, 0.5, 0.5, 0.5]
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_containing_areas(self):
+        shapes = geometry.area_shapes(self.df)
+        self.assertEqual(['c_0_1', 'c_1_1', 'c_1_2'], list(shapes['id']))
+        actual = geometry.containing_areas(shapes, [0.5, 1.5, 1.5, 5], [0.5, 0.5, 0.5, 0.5], [1, 1, 0, 1])
+        self.assertEqual(['c_1_1', 'c_1_2', 'c_0_1', ''], list(actual))
+
+    def test_overlapping_areas_prefer_current_parent(self):
+        overlapping = self.df.assign(geoshape=[square(0, 0, 2)] * 3 + [[]] * 5, featureType='POLYGON')
+        shapes = geometry.area_shapes(overlapping)
+        actual = geometry.containing_areas(shapes, [0.5, 0.5], [0.5, 0.5], [1, 1], preferred=['c_1_1', 'c_1_2'])
+        self.assertEqual(['c_1_1', 'c_1_2'], list(actual))
+
+    def test_facility_parent_mismatches(self):
+        df = geo_etl.check_facility_parents(self.df.copy())
+        mismatches = pd.read_csv(os.path.join(self.tmp_dir.name, 'geodata_errors/facility_parent_mismatches.csv'),
+                                 keep_default_na=False)
+        self.assertEqual(['c_2_2', 'c_2_3'], list(mismatches['facility_id']))
+        self.assertEqual(['c_1_2', ''], list(mismatches['containing_area_id']))
+        self.assertEqual(list(self.df['parent_id']), list(df['parent_id']))
+
+    def test_facility_parents_of_wkt_pulls(self):
+        df = pd.DataFrame({'geometry': ['POLYGON((10 -5, 20 -5, 20 5, 10 5, 10 -5))', 'POINT(15 0)']})
+        df = geo_etl.extract_geo_data(df)
+        self.assertEqual(('15.0', '0.0'), (df.at[1, 'long'], df.at[1, 'lat']))
+        df = df.assign(id=['c_1_1', 'c_2_1'], name=['Area', 'Clinic'], dhis2_id=['a1', 'f1'], admin_level=[1, 2],
+                       parent_id=['', 'c_1_1'])
+        geo_etl.check_facility_parents(df)
+        mismatches = pd.read_csv(os.path.join(self.tmp_dir.name, 'geodata_errors/facility_parent_mismatches.csv'))
+        self.assertTrue(mismatches.empty)
+
+    def test_reassign_facility_parents(self):
+        with mock.patch.dict(os.environ, {'REASSIGN_FACILITY_PARENTS': 'true'}):
+            df = geo_etl.check_facility_parents(self.df.copy())
+        self.assertEqual(['c_1_1', 'c_1_2', 'c_1_2', 'c_1_3'], list(df['parent_id'].iloc[4:]))
+
+    def test_invalid_geometries_are_reported_and_repaired(self):
+        bowtie = {'type': 'Polygon', 'coordinates': [[[0, 0], [2, 2], [2, 0], [0, 2], [0, 0]]]}
+        unclosed_clockwise = {'type': 'Polygon', 'coordinates': [[[0, 0], [0, 1], [1, 1], [1, 0]]]}
+        issues, repaired = geometry.validate_areas([('a', 'a', bowtie), ('b', 'b', unclosed_clockwise)], repair=True)
+        self.assertEqual([('a', 'invalid'), ('b', 'unclosed ring')], list(zip(issues['area_id'], issues['issue'])))
+        self.assertEqual('MultiPolygon', repaired['a']['type'])
+        ring = repaired['b']['coordinates'][0]
+        self.assertEqual(ring[0], ring[-1])
+        # counterclockwise exterior ring
+        self.assertGreater(sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:])), 0)
+
+    def test_sibling_overlaps_and_gaps(self):
+        def polygon(min_x, size):
+            return {'type': 'Polygon', 'coordinates': square(min_x, 0, size)}
+        areas = [('p', 'p', polygon(0, 3)), ('a', 'p', polygon(0, 1.5)), ('b', 'p', polygon(1, 1)),
+                 ('c', 'p', polygon(2.5, 0.5))]
+        issues, repaired = geometry.validate_areas(areas, workers=1)
+        self.assertEqual({}, repaired)
+        self.assertEqual([('a', 'overlap', 'b'), ('p', 'gap', '')],
+                         list(zip(issues['area_id'], issues['issue'], issues['other_area_id'])))
+        self.assertAlmostEqual(0.5, issues['size'][0])
+
+    def test_repair_area_geometries(self):
+        self.df.at[1, 'geoshape'] = [[[0, 0], [1, 1], [1, 0], [0, 1]]]
+        # categorical like the org units pulled from DHIS2, without a multi polygon yet
+        self.df.at[2, 'featureType'] = 'POLYGON'
+        self.df.at[2, 'geoshape'] = square(1, 0, 1)
+        self.df = dhis2_schema.compact_org_units(self.df)
+        with mock.patch.dict(os.environ, {'REPAIR_AREA_GEOMETRIES': 'true'}):
+            df = geo_etl.validate_area_geometries(self.df.copy())
+        issues = pd.read_csv(os.path.join(self.tmp_dir.name, 'geodata_errors/areas_geometry_issues.csv'))
+        self.assertEqual(['unclosed ring', 'invalid', 'gap'], list(issues['issue']))
+        self.assertEqual('MULTI_POLYGON', df.at[1, 'featureType'])
+        self.assertEqual(2, len(df.at[1, 'geoshape']))
+        self.assertEqual(self.df.at[4, 'geoshape'], df.at[4, 'geoshape'])
+
+
+if __name__ == '__main__':
+    unittest.main()
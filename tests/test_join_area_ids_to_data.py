@@ -0,0 +1,43 @@
+import os
+import unittest
+
+import pandas as pd
+
+from utils import join_area_ids_to_data as join_utils
+
+
+class TestJoinAreaIds(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        dirname = os.path.dirname(__file__)
+        cls.hierarchy = join_utils.read_area_hierarchy(
+            os.path.join(dirname, 'resources/geodata/location_hierarchy.csv'))
+        cls.dhis2_ids = join_utils.read_dhis2_id_mapping(
+            os.path.join(dirname, 'resources/geodata/dhis2_id_mapping.csv'))
+
+    def test_join_area_ids_by_dhis2_id(self):
+        df = pd.DataFrame({'org_unit': ['TEQlaapDQoK', 'eIQbndfxQMb', 'unknown'], 'value': [1, 2, 3]})
+        joined, unmatched = join_utils.join_area_ids(df, self.dhis2_ids, left_on='org_unit', right_on='dhis2_id')
+        self.assertEqual(['play_1_1', 'play_1_2'], list(joined['area_id'][:2]))
+        self.assertTrue(pd.isna(joined['area_id'][2]))
+        self.assertEqual(['unknown'], list(unmatched['org_unit']))
+
+    def test_join_area_ids_keeps_unmatched_keys(self):
+        df = pd.DataFrame({'area_id': ['TEQlaapDQoK', 'unknown']})
+        joined, _ = join_utils.join_area_ids(df, self.dhis2_ids, left_on='area_id', right_on='dhis2_id',
+                                             keep_unmatched_keys=True)
+        self.assertEqual(['play_1_1', 'unknown'], list(joined['area_id']))
+
+    def test_aggregate_to_level(self):
+        level_2 = self.hierarchy[self.hierarchy['area_level'] == 2]
+        df = pd.DataFrame({'area_id': level_2['area_id'].values, 'year': '2019', 'value': 1})
+        level_1 = join_utils.aggregate_to_level(df, self.hierarchy, 1, ['value'], group_columns=['year'])
+        self.assertEqual(len(level_2), level_1['value'].sum())
+        self.assertEqual(set(self.hierarchy[self.hierarchy['area_level'] == 1]['area_id']), set(level_1['area_id']))
+        country = join_utils.aggregate_to_level(df, self.hierarchy, 0, ['value'], group_columns=['year'])
+        self.assertEqual([len(level_2)], list(country['value']))
+        self.assertEqual(['Sierra Leone'], list(country['area_name']))
+
+
+if __name__ == '__main__':
+    unittest.main()
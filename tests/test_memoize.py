@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import memoize
+
+calls = []
+config = {'multiplier': 2}
+
+
+@memoize.stage(config=lambda: config)
+def multiply(df: pd.DataFrame) -> pd.DataFrame:
+    calls.append(len(df))
+    return df * config['multiplier']
+
+
+class TestMemoize(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        memoize.cache_dir = os.path.join(self.tmp_dir.name, 'memo')
+        calls.clear()
+        config['multiplier'] = 2
+
+    def tearDown(self) -> None:
+        memoize.cache_dir = None
+        self.tmp_dir.cleanup()
+
+    def test_unchanged_input_and_config_reuse_output(self):
+        df = pd.DataFrame({'value': range(10)})
+        first = multiply(df)
+        second = multiply(df.copy())
+        self.assertEqual([10], calls)
+        pd.testing.assert_frame_equal(first, second)
+
+        multiply(df.assign(value=df['value'] + 1))
+        config['multiplier'] = 3
+        pd.testing.assert_frame_equal(df * 3, multiply(df))
+        self.assertEqual([10, 10, 10], calls)
+
+    def test_unhashable_cells(self):
+        df = pd.DataFrame({'value': [[1, 2], [3]]})
+        multiply(df)
+        multiply(df)
+        self.assertEqual([2], calls)
+
+    def test_least_recently_used_outputs_are_evicted(self):
+        for i in range(3):
+            multiply(pd.DataFrame({'value': range(i * 1000, (i + 1) * 1000)}))
+        with mock.patch.dict(os.environ, {'MEMOIZE_CACHE_SIZE_MB': '0.02'}):
+            multiply(pd.DataFrame({'value': range(5000, 6000)}))
+        self.assertEqual(2, len(os.listdir(memoize.cache_dir)))
+
+    def test_disabled(self):
+        with mock.patch.dict(os.environ, {'MEMOIZE': 'false'}):
+            multiply(pd.DataFrame({'value': [1]}))
+            multiply(pd.DataFrame({'value': [1]}))
+        self.assertEqual([1, 1], calls)
+        self.assertFalse(os.path.exists(memoize.cache_dir))
+
+    def test_write_if_changed(self):
+        path = os.path.join(self.tmp_dir.name, 'out.csv')
+        self.assertTrue(memoize.write_if_changed(path, "a,b\n1,2\n", newline=''))
+        os.utime(path, (0, 0))
+        self.assertFalse(memoize.write_if_changed(path, "a,b\n1,2\n", newline=''))
+        self.assertEqual(0, os.path.getmtime(path))
+        self.assertTrue(memoize.write_if_changed(path, "a,b\n1,3\n", newline=''))
+        with open(path) as f:
+            self.assertEqual("a,b\n1,3\n", f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+import urllib.request
+from unittest import mock
+
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        metrics.reset()
+
+    def tearDown(self) -> None:
+        metrics.reset()
+        self.tmp_dir.cleanup()
+
+    def test_render(self):
+        metrics.start('pivot table', name='play')
+        metrics.observe_request('https://play.dhis2.org/api/reportTables/wIpu9GVn5gG', 200, 0.3, 1000, 0)
+        metrics.observe_request('https://play.dhis2.org/api/reportTables/aBcdefghij1', 503, 20.0, 20, 2)
+        text = metrics.render()
+        labels = 'etl="pivot table",name="play",endpoint="reportTables",host="play.dhis2.org"'
+        self.assertIn('dhis2_etl_http_requests_total{etl="pivot table",name="play",code="200",endpoint="reportTables",'
+                      'host="play.dhis2.org"} 1\n', text)
+        self.assertIn(f'dhis2_etl_http_downloaded_bytes_total{{{labels}}} 1020\n', text)
+        self.assertIn(f'dhis2_etl_http_retries_total{{{labels}}} 2\n', text)
+        self.assertIn('# TYPE dhis2_etl_http_request_duration_seconds histogram\n', text)
+        self.assertIn(f'dhis2_etl_http_request_duration_seconds_bucket{{{labels},le="0.5"}} 1\n', text)
+        self.assertIn(f'dhis2_etl_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2\n', text)
+        self.assertIn(f'dhis2_etl_http_request_duration_seconds_sum{{{labels}}} 20.3\n', text)
+        buckets = [x for x in text.splitlines() if x.startswith('dhis2_etl_http_request_duration_seconds_bucket')]
+        self.assertEqual(len(metrics.LATENCY_BUCKETS) + 1, len(buckets))
+        self.assertTrue(buckets[0].endswith('le="0.05"} 0'))
+        self.assertIn('process_resident_memory_bytes{', text)
+
+    def test_endpoint(self):
+        self.assertEqual('analytics/dataValueSet.json',
+                         metrics.endpoint('http://localhost/dhis/api/analytics/dataValueSet.json?dimension=dx:a'))
+        self.assertEqual('organisationUnits.geojson', metrics.endpoint('http://x/api/organisationUnits.geojson'))
+
+    def test_progress(self):
+        with mock.patch('time.monotonic', return_value=100):
+            progress = metrics.progress('pivot tables', 4, 'tables')
+        with mock.patch('time.monotonic', return_value=110):
+            progress.advance()
+            self.assertEqual(30, progress.eta())
+            self.assertEqual('pivot tables: 1/4 tables (25%), ETA 00:00:30', str(progress))
+        text = metrics.render()
+        self.assertIn('dhis2_etl_progress_done{task="pivot tables"} 1\n', text)
+        self.assertIn('dhis2_etl_progress_total{task="pivot tables"} 4\n', text)
+        self.assertIn('dhis2_etl_progress_eta_seconds{task="pivot tables"} 30\n', text)
+
+    def test_port_in_use(self):
+        with mock.patch.dict(os.environ, {'METRICS_PORT': '0'}):
+            exporter = metrics.start('geodata')
+        port = exporter.server.server_address[1]
+        with mock.patch.dict(os.environ, {'METRICS_PORT': str(port)}), \
+                mock.patch('metrics._exporter', None), self.assertLogs('metrics', 'WARNING'):
+            self.assertIsNone(metrics.start('pivot table').server)
+        exporter.stop()
+
+    def test_textfile_and_endpoint(self):
+        path = os.path.join(self.tmp_dir.name, 'textfile', 'dhis2_etl.prom')
+        with mock.patch.dict(os.environ, {'METRICS_TEXTFILE': path, 'METRICS_PORT': '0'}):
+            exporter = metrics.start('geodata')
+        metrics.stage_started('save area geometries')
+        port = exporter.server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as r:
+            self.assertIn('dhis2_etl_stage_running{etl="geodata",stage="save area geometries",table=""} 1',
+                          r.read().decode())
+        metrics.stage_finished('save area geometries', '', 1.5)
+        metrics.stop()
+        with open(path) as f:
+            text = f.read()
+        self.assertIn('dhis2_etl_stage_duration_seconds{etl="geodata",stage="save area geometries",table=""} 1.5', text)
+        self.assertEqual([], [x for x in os.listdir(os.path.dirname(path)) if x.endswith('.tmp')])
+
+
+if __name__ == '__main__':
+    unittest.main()
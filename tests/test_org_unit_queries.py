@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import adr_dhis2_geodata_etl as geo_etl
+import dhis2_client
+import org_unit_queries
+from benchmarks import dhis2_stand_in
+
+
+class TestOrgUnitQueries(unittest.TestCase):
+    def test_choose_root(self):
+        self.assertEqual(('b', 2), org_unit_queries.choose_root([{'id': 'a', 'level': 3}, {'id': 'b', 'level': 2}]))
+        self.assertIsNone(org_unit_queries.choose_root([{'id': 'a', 'level': 2}, {'id': 'b', 'level': 2}]))
+        self.assertIsNone(org_unit_queries.choose_root([]))
+
+    def test_get_resources(self):
+        resources = org_unit_queries.get_resources(2, ('ImspTQPwCqd', 2))
+        self.assertIn('&fields=id,name,displayName,shortName,path,ancestors,featureType,coordinates,geometry&'
+                      'filter=path:like:ImspTQPwCqd&filter=level:le:4', resources['areas'])
+        self.assertTrue(resources['facilities'].endswith(
+            '&fields=id,name,displayName,shortName,path,ancestors,featureType&filter=path:like:ImspTQPwCqd&'
+            'filter=level:gt:4'))
+        self.assertTrue(org_unit_queries.get_resources(1)['facilities'].endswith('featureType&filter=level:gt:2'))
+        self.assertTrue(org_unit_queries.get_facility_points_resource(pd.DataFrame(columns=['id', 'featureType']), 1)
+                        .endswith('&filter=level:gt:2&fields=id,coordinates&filter=featureType:eq:POINT'))
+        self.assertTrue(org_unit_queries.get_facility_points_resource(pd.DataFrame(columns=['id']), 1)
+                        .endswith('&fields=id,geometry'))
+
+    def test_merge(self):
+        areas = pd.DataFrame({'name': ['A'], 'id': ['a'], 'featureType': ['POLYGON'], 'coordinates': ['[[[0,0]]]']})
+        facilities = pd.DataFrame({'name': ['F', 'G'], 'id': ['f', 'g'], 'featureType': ['POINT', 'POLYGON']})
+        points = pd.DataFrame({'id': ['f'], 'coordinates': ['[1,2]']})
+        df = org_unit_queries.merge(areas, facilities, points)
+        self.assertEqual(['name', 'id', 'featureType', 'coordinates'], list(df))
+        self.assertEqual(['[[[0,0]]]', '[1,2]'], list(df['coordinates'][:2]))
+        self.assertTrue(pd.isna(df['coordinates'][2]))
+
+
+class TestOrgUnitsPushdown(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.responses = dhis2_stand_in.SyntheticResponses(2_000, 100)
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        geo_etl.OUTPUT_DIR_NAME = self.tmp_dir.name
+        dhis2_client._clients.clear()
+
+    def tearDown(self) -> None:
+        dhis2_client._clients.clear()
+        self.tmp_dir.cleanup()
+
+    def get_org_units(self, stand_in, pushdown):
+        dhis2_client._clients.clear()
+        with mock.patch.dict(os.environ, {'DHIS2_URL': stand_in.url, 'ORG_UNITS_PUSHDOWN': pushdown,
+                                          'DHIS2_HTTP_CACHE': 'false', 'DHIS2_BACKOFF_FACTOR': '0'}):
+            df = geo_etl.get_dhis2_org_data()
+        df = geo_etl.extract_location_subtree(df.astype(object).copy())
+        return df.sort_values('id').reset_index(drop=True)
+
+    def assert_same_org_units(self, subtree_org_name, areas_admin_level, org_units_format='coordinates'):
+        geo_etl.SUBTREE_ORG_NAME = subtree_org_name
+        geo_etl.AREAS_ADMIN_LEVEL = areas_admin_level
+        responses = self.responses
+        if org_units_format != 'coordinates':
+            responses = dhis2_stand_in.SyntheticResponses(2_000, 100, org_units_format=org_units_format)
+        with dhis2_stand_in.StandIn(responses) as stand_in:
+            expected = self.get_org_units(stand_in, 'false')
+            full_bytes = stand_in.stats['bytes_sent']
+            actual = self.get_org_units(stand_in, 'true')
+        pd.testing.assert_frame_equal(expected, actual[list(expected)])
+        return full_bytes, stand_in.stats['bytes_sent'] - full_bytes
+
+    def test_whole_hierarchy(self):
+        self.assert_same_org_units(False, 2)
+
+    def test_subtree(self):
+        full_bytes, pushed_down_bytes = self.assert_same_org_units('Area 1-1', 1)
+        self.assertLess(pushed_down_bytes, full_bytes / 2)
+
+    def test_without_feature_types(self):
+        self.assert_same_org_units('Area 1-1', 1, org_units_format='geojson')
+
+    def test_ambiguous_subtree_root_pulls_everything(self):
+        geo_etl.SUBTREE_ORG_NAME = 'Area 1-1'
+        with mock.patch('org_unit_queries.choose_root', return_value=None), \
+                dhis2_stand_in.StandIn(self.responses) as stand_in:
+            df = self.get_org_units(stand_in, 'true')
+        self.assertEqual(2, stand_in.stats['requests'])
+        self.assertEqual('Area 1-1', df.loc[df['path'].str.count('/') == 1, 'name'].iloc[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
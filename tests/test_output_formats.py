@@ -0,0 +1,94 @@
+import importlib.util
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import output_formats
+
+has_pyarrow = importlib.util.find_spec('pyarrow') is not None
+
+
+class TestOutputFormats(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, 'location_hierarchy.csv')
+        self.df = pd.DataFrame({
+            'area_id': ['a', 'b'],
+            'area_name': ['A', 'B'],
+            'area_level': [0, 1],
+            'parent_area_id': ['a', 'a'],
+            'area_sort_order': ['', '']
+        })
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_csv_by_default(self):
+        with mock.patch.dict(os.environ, {}, clear=True):
+            output_formats.write_table(self.df, self.csv_path, 'location_hierarchy')
+        self.assertEqual(['location_hierarchy.csv'], os.listdir(self.tmp_dir.name))
+        with open(self.csv_path) as f:
+            self.assertEqual(self.df.to_csv(index=False), f.read())
+
+    def test_unknown_format(self):
+        with mock.patch.dict(os.environ, {'OUTPUT_FORMATS': 'csv,xlsx'}):
+            self.assertRaises(ValueError, output_formats.get_formats)
+
+    @unittest.skipUnless(has_pyarrow, "pyarrow is not installed")
+    def test_columnar_formats_have_declared_schema(self):
+        import pyarrow as pa
+        import pyarrow.feather
+        import pyarrow.parquet
+
+        with mock.patch.dict(os.environ, {'OUTPUT_FORMATS': 'parquet,feather'}):
+            output_formats.write_table(self.df, self.csv_path, 'location_hierarchy')
+        self.assertFalse(os.path.exists(self.csv_path))
+        table = pyarrow.parquet.read_table(os.path.join(self.tmp_dir.name, 'location_hierarchy.parquet'))
+        # the empty sort order column is a double column of nulls, not strings
+        self.assertEqual([pa.string(), pa.string(), pa.int64(), pa.string(), pa.float64()], table.schema.types)
+        self.assertEqual([None, None], table.column('area_sort_order').to_pylist())
+        feather = pyarrow.feather.read_table(os.path.join(self.tmp_dir.name, 'location_hierarchy.feather'))
+        self.assertTrue(feather.equals(table))
+
+    @unittest.skipUnless(has_pyarrow, "pyarrow is not installed")
+    def test_table_writer_parts(self):
+        import pyarrow.parquet
+
+        schema = {'area_id': 'string', 'sex': 'string', 'tested': 'double'}
+        with mock.patch.dict(os.environ, {'OUTPUT_FORMATS': 'csv,parquet', 'PARQUET_ROW_GROUP_SIZE': '1'}):
+            with output_formats.TableWriter(self.csv_path, schema, float_format='%.f') as writer:
+                writer.write(pd.DataFrame({'area_id': ['a', 'a'], 'sex': ['female', 'male'], 'tested': [1.0, 2.0]}))
+                writer.write(pd.DataFrame({'area_id': ['b'], 'sex': [''], 'tested': [None]}))
+        with open(self.csv_path) as f:
+            self.assertEqual("area_id,sex,tested\na,female,1\na,male,2\nb,,\n", f.read())
+        parquet = pyarrow.parquet.ParquetFile(os.path.join(self.tmp_dir.name, 'location_hierarchy.parquet'))
+        self.assertEqual(3, parquet.metadata.num_row_groups)
+        self.assertEqual({'area_id': ['a', 'a', 'b'], 'sex': ['female', 'male', None], 'tested': [1.0, 2.0, None]},
+                         parquet.read().to_pydict())
+
+    @unittest.skipUnless(has_pyarrow, "pyarrow is not installed")
+    def test_geoparquet(self):
+        import pyarrow.parquet
+        import shapely.wkb
+
+        features = [{
+            'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [[[0, 0], [2, 0], [2, 1], [0, 0]]]},
+            'properties': {'area_id': 'a', 'area_name': 'A', 'area_level': '1'}
+        }]
+        path = os.path.join(self.tmp_dir.name, 'areas.parquet')
+        output_formats.write_geoparquet(features, path)
+        table = pyarrow.parquet.read_table(path)
+        geo = json.loads(table.schema.metadata[b'geo'])
+        self.assertEqual('geometry', geo['primary_column'])
+        self.assertEqual([0, 0, 2, 1], geo['columns']['geometry']['bbox'])
+        self.assertEqual(1, table.column('area_level')[0].as_py())
+        self.assertEqual(2, shapely.wkb.loads(table.column('geometry')[0].as_py()).bounds[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import json
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+import profiling
+
+
+@profiling.log_and_profile("double rows")
+def double_rows(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.concat([df, df])
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self) -> None:
+        profiling.reset()
+
+    def test_run_report_contains_stage_metrics(self):
+        double_rows(pd.DataFrame({'value': range(10)}))
+        with tempfile.TemporaryDirectory() as output_dir:
+            profiling.write_run_report(output_dir, name='test')
+            with open(os.path.join(output_dir, 'reports/run_report.json')) as f:
+                report = json.load(f)
+            stages_csv = pd.read_csv(os.path.join(output_dir, 'reports/run_report.csv'))
+        self.assertEqual('test', report['run']['name'])
+        stage = report['stages'][0]
+        self.assertEqual('double rows', stage['stage'])
+        self.assertEqual((10, 20), (stage['rows_in'], stage['rows_out']))
+        self.assertGreater(stage['memory_out'], stage['memory_in'])
+        self.assertEqual(['double rows'], list(stages_csv['stage']))
+
+    def test_profile_stage_is_dumped(self):
+        os.environ['PROFILE_STAGE'] = 'double rows'
+        try:
+            double_rows(pd.DataFrame({'value': range(10)}))
+            with tempfile.TemporaryDirectory() as output_dir:
+                profiling.write_run_report(output_dir)
+                self.assertTrue(os.path.exists(os.path.join(output_dir, 'reports/double_rows.prof')))
+        finally:
+            del os.environ['PROFILE_STAGE']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import program_config
+
+
+class TestProgramConfig(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        program_config._compiled.clear()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def write(self, name, config):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'w') as f:
+            f.write(config if isinstance(config, str) else json.dumps(config))
+        return path
+
+    def test_later_files_override_earlier_ones(self):
+        categories_1 = self.write('cat_1.json', [
+            {'id': 'c1', 'mapping': {'age_group': '15-49', 'sex': 'female'}},
+            {'id': 'c2', 'remove': True}
+        ])
+        categories_2 = self.write('cat_2.json', [{'id': 'c1', 'mapping': {'sex': 'male'}}])
+        columns_1 = self.write('col_1.json', [{'id': 'de1', 'mapping': ['anc_clients', 'anc_tested']}])
+        columns_2 = self.write('col_2.json', [
+            {'id': 'de1', 'mapping': '', 'categoryMapping': {'age_group': '00-49'}},
+            {'id': 'de2', 'mapping': 'anc_known_pos', 'categoryMapping': None}
+        ])
+        config = program_config.load(f"{categories_1},{categories_2}", f"{columns_1},{columns_2}")
+        self.assertEqual([('de1', 0, 'anc_clients'), ('de1', 1, 'anc_tested'), ('de2', 0, 'anc_known_pos')],
+                         list(config.data_element_names.itertuples(index=False, name=None)))
+        self.assertEqual([('de1', 'age_group', '00-49', 0)],
+                         list(config.column_categories.itertuples(index=False, name=None)))
+        self.assertEqual(['sex'], list(config.category_mappings.loc[config.category_mappings['id'] == 'c1', 'category']))
+        self.assertEqual(['c2'], config.categories_to_remove)
+
+    def test_compiled_config_is_cached_by_content(self):
+        categories = self.write('cat.json', [{'id': 'c1', 'mapping': {'sex': 'male'}}])
+        cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        program_config.load(categories, None, cache_dir=cache_dir)
+        program_config._compiled.clear()
+        with mock.patch.object(program_config, '_compile') as compile_:
+            config = program_config.load(categories, None, cache_dir=cache_dir)
+        compile_.assert_not_called()
+        self.assertEqual(['c1'], list(config.category_mappings['id']))
+        self.assertIsInstance(config.category_mappings, pd.DataFrame)
+
+        self.write('cat.json', [{'id': 'c1', 'mapping': {'sex': 'female'}}])
+        config = program_config.load(categories, None, cache_dir=cache_dir)
+        self.assertEqual(['female'], list(config.category_mappings['value']))
+        self.assertEqual(2, len(os.listdir(cache_dir)))
+
+    def test_invalid_configs(self):
+        with self.assertRaises(program_config.ConfigError):
+            program_config.load(self.write('cat.json', '[{"id": "c1",]'), None)
+        with self.assertRaises(program_config.ConfigError):
+            program_config.load(self.write('cat.json', [{'name': 'no id'}]), None)
+        with self.assertRaises(program_config.ConfigError):
+            program_config.load(self.write('cat.json', []), self.write('col.json', [{'id': 'de1', 'mapping': 1}]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import run_all
+
+
+class TestRunAll(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources/geodata/response.csv')
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def write_env(self, name, csv_path):
+        path = os.path.join(self.tmp_dir.name, f"{name}.env")
+        with open(path, 'w') as f:
+            f.write(f"DHIS2_URL=https://{name}.example.org/api/\n"
+                    f"OUTPUT_DIR_NAME={name}\n"
+                    f"ISO_CODE={name}\n"
+                    f"GEODATA_CSV_FILE={csv_path}\n"
+                    f"PROGRAM_DATA='[]'\n")
+        return path
+
+    def test_jobs(self):
+        env_file = self.write_env('play', self.csv_path)
+        jobs = run_all.get_jobs([env_file], ['geodata', 'pivot'], ['-p'], [])
+        self.assertEqual([f"geodata:{env_file}", f"pivot:{env_file}"], [x.id for x in jobs])
+        self.assertEqual(['-e', env_file, '-p'], jobs[0].argv)
+        self.assertEqual('play.example.org', jobs[1].host)
+        self.assertEqual(jobs[0].id, jobs[1].depends_on)
+
+    def test_metrics_environ(self):
+        env_file = self.write_env('play', self.csv_path)
+        with open(env_file, 'a') as f:
+            f.write("METRICS_PORT=9100\n")
+        job = run_all.get_jobs([env_file], ['pivot'], [], [])[0]
+        self.assertEqual({'METRICS_PORT': '9102'}, run_all.get_metrics_environ(job, 2))
+        with mock.patch.dict(os.environ, {'METRICS_TEXTFILE': '/metrics/dhis2_etl.prom'}):
+            self.assertEqual({'METRICS_PORT': '9100', 'METRICS_TEXTFILE': '/metrics/dhis2_etl_pivot_play.prom'},
+                             run_all.get_metrics_environ(job, 0))
+
+    def test_exiting_jobs_fail(self):
+        play_env = self.write_env('play', self.csv_path)
+        other_env = self.write_env('other', self.csv_path)
+        state_file = os.path.join(self.tmp_dir.name, 'state.json')
+
+        exit_code = run_all.main([play_env, other_env, '--etl', 'geodata', '-j', '2', '--state-file', state_file,
+                                  '--geodata-args=--bogus'])
+        state = run_all.read_state(state_file)
+        self.assertEqual(1, exit_code)
+        self.assertEqual(['failed', 'failed'], [state[f"geodata:{x}"]['status'] for x in (play_env, other_env)])
+        self.assertIn('exited with code 2', state[f"geodata:{play_env}"]['error'])
+
+    def test_failed_jobs_are_retried_on_resume(self):
+        play_env = self.write_env('play', self.csv_path)
+        broken_env = self.write_env('broken', os.path.join(self.tmp_dir.name, 'missing.csv'))
+        state_file = os.path.join(self.tmp_dir.name, 'state.json')
+
+        exit_code = run_all.main([play_env, broken_env, '--etl', 'geodata', '-j', '2', '--state-file', state_file])
+        state = run_all.read_state(state_file)
+        self.assertEqual(1, exit_code)
+        self.assertEqual('done', state[f"geodata:{play_env}"]['status'])
+        self.assertEqual('failed', state[f"geodata:{broken_env}"]['status'])
+        self.assertTrue(os.path.exists('output/play/geodata/location_hierarchy.csv'))
+        # env of one country doesn't leak into the next one
+        self.assertNotIn('GEODATA_CSV_FILE', os.environ)
+
+        os.remove('output/play/geodata/location_hierarchy.csv')
+        exit_code = run_all.main([play_env, broken_env, '--etl', 'geodata', '--resume', '--state-file', state_file])
+        self.assertEqual(1, exit_code)
+        self.assertFalse(os.path.exists('output/play/geodata/location_hierarchy.csv'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import vector_tiles
+
+
+def read_varint(data, i):
+    value, shift = 0, 0
+    while True:
+        byte = data[i]
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        i += 1
+        if not byte & 0x80:
+            return value, i
+
+
+def read_message(data):
+    """Fields of a protobuf message as a list of (field number, value), values of packed fields are bytes."""
+    fields, i = [], 0
+    while i < len(data):
+        key, i = read_varint(data, i)
+        if key & 7 == 0:
+            value, i = read_varint(data, i)
+        else:
+            length, i = read_varint(data, i)
+            value, i = data[i:i + length], i + length
+        fields.append((key >> 3, value))
+    return fields
+
+
+def read_packed(data):
+    values, i = [], 0
+    while i < len(data):
+        value, i = read_varint(data, i)
+        values.append(value)
+    return values
+
+
+def decode_rings(commands):
+    rings, x, y, i = [], 0, 0, 0
+    while i < len(commands):
+        command, count = commands[i] & 7, commands[i] >> 3
+        i += 1
+        if command == vector_tiles.CLOSE_PATH:
+            continue
+        for _ in range(count):
+            dx, dy = [(v >> 1) ^ -(v & 1) for v in commands[i:i + 2]]
+            x, y, i = x + dx, y + dy, i + 2
+            if command == vector_tiles.MOVE_TO:
+                rings.append([])
+            rings[-1].append((x, y))
+    return rings
+
+
+class TestVectorTiles(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        square = [[[0, 0], [0, 10], [10, 10], [10, 0], [0, 0]], [[2, 2], [4, 2], [4, 4], [2, 4], [2, 2]]]
+        self.features = [
+            {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': square},
+             'properties': {'area_id': 'c_1_1', 'area_name': 'North', 'area_level': '1'}},
+            {'type': 'Feature', 'geometry': {'type': 'MultiPolygon', 'coordinates': [[[[-10, -10], [-1, -10], [-1, -1],
+                                                                                       [-10, -10]]]]},
+             'properties': {'area_id': 'c_0_1', 'area_name': 'Country', 'area_level': '0'}},
+        ]
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_encode_geometry(self):
+        import shapely.geometry
+
+        # exterior ring clockwise in tile coordinates (y down), the hole counterclockwise
+        shape = shapely.geometry.Polygon([(0, 0), (0, 0.5), (0.5, 0.5), (0.5, 0)],
+                                         [[(0.1, 0.1), (0.2, 0.1), (0.2, 0.2), (0.1, 0.2)]])
+        commands = [int(x) for x in vector_tiles.encode_geometry(shape, 1, 0, 0)]
+        self.assertEqual([[(2048, 0), (2048, 2048), (0, 2048), (0, 0)],
+                          [(410, 819), (819, 819), (819, 410), (410, 410)]], decode_rings(commands))
+        self.assertEqual(vector_tiles.encode_geometry(shapely.geometry.Polygon([(0, 0), (0.00001, 0), (0, 0.00001)]),
+                                                      1, 0, 0).tolist(), [])
+
+    def test_packed_varints(self):
+        values = [0, 1, 127, 128, 300, 2 ** 32 + 5]
+        self.assertEqual(values, read_packed(read_message(vector_tiles._packed(1, values))[0][1]))
+
+    def test_write_mbtiles(self):
+        path = os.path.join(self.tmp_dir.name, 'areas.mbtiles')
+        vector_tiles.write_mbtiles(self.features, path, min_zoom=0, max_zoom=3)
+        connection = sqlite3.connect(path)
+        metadata = dict(connection.execute("SELECT name, value FROM metadata"))
+        self.assertEqual('pbf', metadata['format'])
+        self.assertEqual('-10.0,-10.0,10.0,10.0', metadata['bounds'])
+        self.assertEqual(['area_level_0', 'area_level_1'],
+                         [x['id'] for x in json.loads(metadata['json'])['vector_layers']])
+        # both areas touch the center of the world, so at zoom 1 they are in the tiles around it
+        self.assertEqual([(0, 0, 0), (1, 0, 0), (1, 0, 1), (1, 1, 0), (1, 1, 1)],
+                         connection.execute("SELECT zoom_level, tile_column, tile_row FROM tiles "
+                                            "WHERE zoom_level <= 1 ORDER BY 1, 2, 3").fetchall())
+        tile = gzip.decompress(connection.execute("SELECT tile_data FROM tiles WHERE zoom_level = 0").fetchone()[0])
+        layers = [dict((k, v) for k, v in read_message(x) if k in (1, 5)) for k, x in read_message(tile)]
+        self.assertEqual([b'area_level_0', b'area_level_1'], [x[1] for x in layers])
+        self.assertEqual([4096, 4096], [x[5] for x in layers])
+        north = [read_message(x) for k, x in read_message(read_message(tile)[1][1]) if k == 2][0]
+        rings = decode_rings(read_packed(dict(north)[4]))
+        self.assertEqual(2, len(rings))
+        self.assertEqual((2048, 2048), rings[0][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,103 @@
+import argparse
+import logging
+
 import pandas as pd
 
+logger = logging.getLogger(__name__)
+logger.setLevel("INFO")
 
 POP_FILENAME = '../inputs/botswana/bwa_population.csv'
 AREA_HIERARCHY = '../inputs/botswana/bwa_area_hiearchy_2021.csv'
 
+
+def read_area_hierarchy(hierarchy_path):
+    """Read a `location_hierarchy.csv` style file indexed by area_id."""
+    hierarchy = pd.read_csv(hierarchy_path, dtype={'area_id': str, 'parent_area_id': str, 'area_name': str})
+    hierarchy['area_level'] = hierarchy['area_level'].astype(int)
+    return hierarchy.set_index('area_id', drop=False)
+
+
+def read_dhis2_id_mapping(mapping_path):
+    """Read a `dhis2_id_mapping.csv` style file as a dhis2_id -> area_id frame.
+
+    Legacy mapping files with a `dhis2_id` column instead of `map_id` are also supported.
+    """
+    mapping = pd.read_csv(mapping_path, dtype=str, index_col=False)
+    if 'map_id' in list(mapping):
+        mapping = mapping.rename(columns={'map_id': 'dhis2_id'})
+    return mapping
+
+
+def build_ancestors_table(hierarchy):
+    """Build a long table with one row per (area, ancestor) pair, including the area itself.
+
+    Parents are resolved level by level with hash merges, so the cost is one merge per level
+    of the hierarchy rather than one Python call per area.
+    """
+    parents = hierarchy[['area_id', 'parent_area_id']].reset_index(drop=True)
+    levels = hierarchy.set_index('area_id')['area_level']
+    current = pd.DataFrame({'area_id': parents['area_id'], 'ancestor_id': parents['area_id']})
+    frames = [current]
+    max_depth = int(hierarchy['area_level'].max() - hierarchy['area_level'].min()) if len(hierarchy) else 0
+    for _ in range(max_depth):
+        current = current.merge(parents, how='inner', left_on='ancestor_id', right_on='area_id',
+                                suffixes=('', '_parent'))
+        # roots point at themselves in location_hierarchy.csv
+        current = current[current['parent_area_id'].notna() & (current['parent_area_id'] != current['ancestor_id'])]
+        current = current[['area_id', 'parent_area_id']].rename(columns={'parent_area_id': 'ancestor_id'})
+        if current.empty:
+            break
+        frames.append(current)
+    ancestors = pd.concat(frames, ignore_index=True)
+    ancestors['ancestor_level'] = ancestors['ancestor_id'].map(levels)
+    return ancestors
+
+
+def join_area_ids(df, area_map, left_on, right_on, area_id_column='area_id', keep_unmatched_keys=False):
+    """Attach area ids from `area_map` to `df` with a hash join on `left_on` == `right_on`.
+
+    Returns the joined frame and a frame of distinct keys that could not be matched. With
+    `keep_unmatched_keys` unmatched rows keep their original key as area id.
+    """
+    lookup = (area_map[[right_on, 'area_id']]
+              .dropna(subset=[right_on])
+              .drop_duplicates(subset=right_on, keep='last')
+              .set_index(right_on)['area_id'])
+    area_ids = df[left_on].map(lookup)
+    unmatched_mask = area_ids.isna()
+    unmatched = pd.DataFrame({left_on: df.loc[unmatched_mask, left_on].drop_duplicates()})
+    if keep_unmatched_keys:
+        area_ids = area_ids.where(~unmatched_mask, df[left_on])
+    df[area_id_column] = area_ids
+    return df, unmatched
+
+
+def aggregate_to_level(df, hierarchy, area_level, value_columns, group_columns=(), area_id_column='area_id'):
+    """Sum `value_columns` of `df` up to every area at `area_level` that is an ancestor of the row's area."""
+    ancestors = build_ancestors_table(hierarchy)
+    ancestors = ancestors[ancestors['ancestor_level'] == area_level]
+    joined = df.merge(ancestors[['area_id', 'ancestor_id']], how='inner', left_on=area_id_column, right_on='area_id',
+                      suffixes=('_orig', ''))
+    group_columns = ['ancestor_id'] + list(group_columns)
+    aggregated = joined.groupby(group_columns, sort=False)[list(value_columns)].sum(min_count=1).reset_index()
+    aggregated = aggregated.rename(columns={'ancestor_id': area_id_column})
+    aggregated.insert(1, 'area_level', area_level)
+    aggregated.insert(2, 'area_name', aggregated[area_id_column].map(hierarchy['area_name']))
+    return aggregated
+
+
 if __name__ == '__main__':
-    with open(POP_FILENAME) as f:
-        pop = pd.read_csv(f)
-    with open(AREA_HIERARCHY) as f:
-        area_hierarchy = pd.read_csv(f)
-    area_ids = pop['Health District'].replace(area_hierarchy[['area_id', 'area_name']].set_index('area_name')['area_id'])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Join area ids onto program or population data by area name.')
+    parser.add_argument('-d', '--data-file', default=POP_FILENAME, help='csv file with the data to join')
+    parser.add_argument('-a', '--area-hierarchy', default=AREA_HIERARCHY, help='area hierarchy csv file')
+    parser.add_argument('-k', '--key-column', default='Health District', help='column in the data with area names')
+    parser.add_argument('-o', '--output-file', help='where to save the data with area ids')
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.data_file)
+    area_hierarchy = read_area_hierarchy(args.area_hierarchy)
+    data, unmatched_names = join_area_ids(data, area_hierarchy, left_on=args.key_column, right_on='area_name')
+    for name in unmatched_names[args.key_column]:
+        logger.warning(f"Unmatched area name: {name}")
+    if args.output_file:
+        data.to_csv(args.output_file, index=False)
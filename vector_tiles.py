@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import gzip
+import json
+import math
+import os
+import sqlite3
+import struct
+from collections import defaultdict
+
+from lazy_import import lazy_module
+
+np = lazy_module('numpy')
+
+EXTENT = 4096
+# extra tile area included around every tile, in tile units, so polygon edges don't show at tile borders
+BUFFER = 64
+# simplification tolerance in tile units, geometries are simplified less the deeper the zoom level
+SIMPLIFY_TOLERANCE = 2
+DEFAULT_MIN_ZOOM = 0
+DEFAULT_MAX_ZOOM = 10
+
+POLYGON = 3
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+
+
+def write_mbtiles(features, path, min_zoom=DEFAULT_MIN_ZOOM, max_zoom=DEFAULT_MAX_ZOOM, name='areas'):
+    """Write GeoJSON area `features` as an MBTiles archive of Mapbox Vector Tiles.
+
+    Every `area_level` gets its own layer, `area_level_<level>`, with the feature properties as
+    attributes. Geometries are simplified per zoom level to about a pixel, clipped to the tiles and
+    encoded following the Mapbox Vector Tile 2.1 spec; tiles are gzipped like in other MBTiles.
+    """
+    import shapely.geometry
+    import shapely.ops
+
+    areas = []
+    for feature in features:
+        try:
+            shape = shapely.geometry.shape(feature['geometry'])
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError):
+            continue
+        if shape.is_empty:
+            continue
+        layer = f"area_level_{feature['properties'].get('area_level', '')}"
+        areas.append((layer, feature['properties'], shapely.ops.transform(_to_world, shape), shape.bounds))
+
+    tiles = defaultdict(lambda: defaultdict(list))
+    shapes = [world_shape for _, _, world_shape, _ in areas]
+    buffer = BUFFER / EXTENT
+    # from the deepest zoom up, every zoom level simplifies the already simplified shapes of the level below
+    for zoom in range(max_zoom, min_zoom - 1, -1):
+        scale = 2 ** zoom
+        shapes = [x.simplify(SIMPLIFY_TOLERANCE / (scale * EXTENT), preserve_topology=True) for x in shapes]
+        for (layer, properties, _, _), shape in zip(areas, shapes):
+            if shape.is_empty:
+                continue
+            min_x, min_y, max_x, max_y = shape.bounds
+            for x in range(_tile(min_x - buffer / scale, scale), _tile(max_x + buffer / scale, scale) + 1):
+                for y in range(_tile(min_y - buffer / scale, scale), _tile(max_y + buffer / scale, scale) + 1):
+                    clipped = shapely.ops.clip_by_rect(shape, (x - buffer) / scale, (y - buffer) / scale,
+                                                       (x + 1 + buffer) / scale, (y + 1 + buffer) / scale)
+                    geometry = encode_geometry(clipped, scale, x, y)
+                    if len(geometry):
+                        tiles[(zoom, x, y)][layer].append((properties, geometry))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+        connection.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, "
+                           "tile_data BLOB)")
+        connection.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+        connection.executemany("INSERT INTO metadata VALUES (?, ?)",
+                               _metadata(areas, name, min_zoom, max_zoom).items())
+        connection.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", (
+            # MBTiles rows are numbered from the bottom (TMS), XYZ tiles from the top
+            (zoom, x, 2 ** zoom - 1 - y, gzip.compress(encode_tile(layers), mtime=0))
+            for (zoom, x, y), layers in sorted(tiles.items())
+        ))
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+    return len(tiles)
+
+
+def encode_tile(layers):
+    """Vector tile protobuf of `layers`, a dict of layer name to a list of (properties, geometry commands)."""
+    tile = b''
+    for layer_name, features in sorted(layers.items()):
+        keys, values = {}, {}
+        encoded_features = b''
+        for i, (properties, geometry) in enumerate(features):
+            tags = []
+            for key, value in properties.items():
+                if value is None:
+                    continue
+                tags.append(keys.setdefault(key, len(keys)))
+                tags.append(values.setdefault((type(value).__name__, value), len(values)))
+            feature = (_field(1, 0) + _varint(i + 1) + _packed(2, tags) + _field(3, 0) + _varint(POLYGON) +
+                       _packed(4, geometry))
+            encoded_features += _message(2, feature)
+        layer = (_field(15, 0) + _varint(2) + _message(1, layer_name.encode()) + encoded_features +
+                 b''.join(_message(3, str(x).encode()) for x in keys) +
+                 b''.join(_message(4, _value(x[1])) for x in values) +
+                 _field(5, 0) + _varint(EXTENT))
+        tile += _message(3, layer)
+    return tile
+
+
+def encode_geometry(shape, scale, tile_x, tile_y):
+    """Geometry commands of the (multi)polygon `shape`, given in world coordinates, in tile `tile_x`, `tile_y`.
+
+    Exterior rings are clockwise and interior rings counterclockwise in tile coordinates (y pointing
+    down), rings that collapse to less than three points at this zoom are dropped.
+    """
+    commands = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for polygon in _polygons(shape):
+        for i, ring in enumerate([polygon.exterior] + list(polygon.interiors)):
+            coords = np.asarray(ring.coords)[:-1, :2]
+            points = np.rint((coords * scale - (tile_x, tile_y)) * EXTENT).astype(np.int64)
+            if len(points):
+                # drop repeated points, also the ones that only repeat after rounding
+                points = points[np.any(points != np.roll(points, 1, axis=0), axis=1) | (len(points) == 1)]
+            area = _signed_area(points) if len(points) >= 3 else 0
+            if area == 0:
+                if i == 0:
+                    break
+                continue
+            if (area > 0) != (i == 0):
+                points = points[::-1]
+            deltas = np.diff(np.vstack([cursor, points]), axis=0)
+            cursor = points[-1]
+            zigzag = ((deltas << 1) ^ (deltas >> 63)).ravel()
+            commands.append([_command(MOVE_TO, 1), zigzag[0], zigzag[1], _command(LINE_TO, len(points) - 1)])
+            commands.append(zigzag[2:])
+            commands.append([_command(CLOSE_PATH, 1)])
+    return np.concatenate(commands).astype(np.uint64) if commands else np.zeros(0, dtype=np.uint64)
+
+
+def _to_world(lon, lat):
+    """Web Mercator coordinates scaled to [0, 1], with y pointing down like tile rows."""
+    lat = np.radians(np.clip(np.asarray(lat, dtype=float), -85.0511, 85.0511))
+    x = (np.asarray(lon, dtype=float) + 180) / 360
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2
+    return x, y
+
+
+def _tile(world, scale):
+    return min(max(int(math.floor(world * scale)), 0), scale - 1)
+
+
+def _polygons(shape):
+    if shape.geom_type == 'Polygon':
+        return [shape]
+    return [x for part in getattr(shape, 'geoms', []) for x in _polygons(part)]
+
+
+def _signed_area(points):
+    x, y = points[:, 0].astype(float), points[:, 1].astype(float)
+    return float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+
+def _command(command_id, count):
+    return (command_id & 0x7) | (count << 3)
+
+
+def _zigzag(n):
+    return (n << 1) if n >= 0 else ((-n) << 1) - 1
+
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number, wire_type):
+    return _varint((number << 3) | wire_type)
+
+
+def _message(number, payload):
+    return _field(number, 2) + _varint(len(payload)) + payload
+
+
+def _packed(number, values):
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return _message(number, b'')
+    # varints of all values at once: 7 bit groups, with the high bit set on all but the last group
+    groups = np.stack([(values >> np.uint64(7 * k)) & np.uint64(0x7f) for k in range(10)], axis=1).astype(np.uint8)
+    lengths = np.maximum(1, 10 - np.argmax(groups[:, ::-1] != 0, axis=1))
+    lengths[~groups.any(axis=1)] = 1
+    positions = np.arange(10)
+    groups[positions < (lengths[:, None] - 1)] |= 0x80
+    return _message(number, groups[positions < lengths[:, None]].tobytes())
+
+
+def _value(value):
+    if isinstance(value, bool):
+        return _field(7, 0) + _varint(int(value))
+    if isinstance(value, int):
+        return _field(6, 0) + _varint(_zigzag(value))
+    if isinstance(value, float):
+        return _field(3, 1) + struct.pack('<d', value)
+    return _message(1, str(value).encode())
+
+
+def _metadata(areas, name, min_zoom, max_zoom):
+    bounds = [min(x[3][0] for x in areas), min(x[3][1] for x in areas),
+              max(x[3][2] for x in areas), max(x[3][3] for x in areas)] if areas else [-180, -85, 180, 85]
+    fields = defaultdict(dict)
+    for layer, properties, _, _ in areas:
+        fields[layer].update({key: 'Number' if isinstance(value, (int, float)) and not isinstance(value, bool)
+                              else 'String' for key, value in properties.items()})
+    return {
+        'name': name,
+        'format': 'pbf',
+        'type': 'overlay',
+        'version': '1',
+        'minzoom': str(min_zoom),
+        'maxzoom': str(max_zoom),
+        'bounds': ','.join(str(x) for x in bounds),
+        'center': f"{(bounds[0] + bounds[2]) / 2},{(bounds[1] + bounds[3]) / 2},{min_zoom}",
+        'json': json.dumps({'vector_layers': [{'id': layer, 'fields': layer_fields, 'minzoom': min_zoom,
+                                               'maxzoom': max_zoom} for layer, layer_fields in
+                                              sorted(fields.items())]}),
+    }